@@ -0,0 +1,162 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.fakes import CANNED_ANSWER
+
+QUOTA_ERROR = {
+    "error": {
+        "code": 429,
+        "message": "Resource has been exhausted (e.g. check quota).",
+        "status": "RESOURCE_EXHAUSTED",
+    }
+}
+
+
+def _response(text: str, prompt_tokens: int) -> dict[str, Any]:
+    output_tokens = len(text) // 4 + 1
+    return {
+        "candidates": [
+            {
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+    }
+
+
+# Speaks the REST flavour of the Gemini generateContent and
+# streamGenerateContent calls. Answers every prompt with the same text after
+# `delay` seconds and, like Gemini, returns 429 to keys over `rpm`.
+class FakeGeminiServer:
+    def __init__(
+        self,
+        port: int = 0,
+        answer: str = CANNED_ANSWER,
+        delay: float = 0.0,
+        rpm: int = 0,
+        host: str = "127.0.0.1",
+    ) -> None:
+        self.answer = answer
+        self.delay = delay
+        self.rpm = rpm
+        self.requests: dict[str, int] = {}
+        self.throttled: dict[str, int] = {}
+        self._recent: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeGeminiServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _over_quota(self, key: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            recent = self._recent.setdefault(key, deque())
+            while recent and recent[0] <= now - 60:
+                recent.popleft()
+            if self.rpm and len(recent) >= self.rpm:
+                self.throttled[key] = self.throttled.get(key, 0) + 1
+                return True
+            recent.append(now)
+            return False
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                url = urlsplit(self.path)
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                key = (
+                    self.headers.get("x-goog-api-key")
+                    or parse_qs(url.query).get("key", [""])[0]
+                )
+                if not url.path.endswith(("generateContent", "GenerateContent")):
+                    self._send(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+                    return
+                if server._over_quota(key):
+                    self._send(429, QUOTA_ERROR)
+                    return
+
+                prompt = " ".join(
+                    part.get("text", "")
+                    for content in body.get("contents", [])
+                    for part in content.get("parts", [])
+                )
+                time.sleep(server.delay)
+                prompt_tokens = len(prompt) // 4 + 1
+                if url.path.endswith(":streamGenerateContent"):
+                    # A JSON array of responses, one per word
+                    words = server.answer.split(" ")
+                    chunks = [_response(word + " ", prompt_tokens) for word in words]
+                    self._send(200, chunks)
+                else:
+                    self._send(200, _response(server.answer, prompt_tokens))
+
+            def _send(self, status: int, payload: Any) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve canned Gemini answers, point LLM_ENDPOINT at it."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.5)
+    parser.add_argument("--rpm", type=int, default=0, help="429 above this, 0 is off")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.port, delay=args.delay, rpm=args.rpm, host=args.host)
+    print(f"Fake Gemini on {server.url}, set LLM_ENDPOINT={server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
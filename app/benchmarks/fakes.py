@@ -0,0 +1,167 @@
+import random
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from langchain_core.language_models import SimpleChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+
+from src.analyzer import ProductAnalyzer
+from src.sources import save_fixture
+
+CANNED_ANSWER = (
+    "1. Strengthen the case corners, several reviews report cracks after drops.\n"
+    "2. Tighten the button covers, they feel loose and rattle.\n"
+    "3. Improve the grip coating, it peels after a few weeks of use."
+)
+
+_SUBJECTS = "case battery screen charger cable button strap lens port clip".split()
+_PRAISE = [
+    "works great and feels sturdy",
+    "fits perfectly and looks nice",
+    "is easy to use and reliable",
+    "arrived quickly and was well packed",
+]
+_COMPLAINTS = [
+    "cracked after a week of normal use",
+    "stopped working and the refund took ages",
+    "is flimsy and the edges are sharp",
+    "does not fit and feels cheap",
+    "was missing and support was useless",
+]
+
+
+# Answers every prompt with the same text after `delay` seconds,
+# streaming splits it into words
+class FakeLLM(SimpleChatModel):
+    answer: str = CANNED_ANSWER
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _call(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        time.sleep(self.delay)
+        return self.answer
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.delay)
+        for word in self.answer.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+class FakeProductAnalyzer(ProductAnalyzer):
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        # No cache, every call has to go through the whole pipeline
+        super().__init__(api_key="benchmark", cache=None)
+
+    def _get_llm(self) -> FakeLLM:  # type: ignore[override]
+        return FakeLLM(delay=self.delay)
+
+
+def make_reviews(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    reviews: list[str] = []
+    for ix in range(count):
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            subject = rng.choice(_SUBJECTS)
+            opinion = rng.choice(_COMPLAINTS if rng.random() < 0.6 else _PRAISE)
+            sentences.append(f"The {subject} {opinion}.")
+        reviews.append(f"Review {ix}: " + " ".join(sentences))
+    return reviews
+
+
+def make_analysis(seed: int = 0) -> str:
+    # Shaped like the table the summary prompt asks for
+    rng = random.Random(seed)
+    rows = [
+        "| **Key Issue** | **Improvement Suggestion** | **Priority** |",
+        "|---|---|---|",
+    ]
+    for _ in range(4):
+        subject = rng.choice(_SUBJECTS)
+        rows.append(
+            f"| The {subject} {rng.choice(_COMPLAINTS)} "
+            f"| Rework the {subject} | {rng.choice(['High', 'Medium', 'Low'])} |"
+        )
+    return "\n".join(rows)
+
+
+def make_product(count: int, seed: int = 0) -> dict[str, Any]:
+    return {
+        "product": "Benchmark phone case",
+        "price": "$19.99",
+        "category": "Cell Phones & Accessories",
+        "rating": 3.9,
+        "url": "https://www.amazon.com/dp/B0BENCHMRK",
+        "comments": make_reviews(count, seed),
+    }
+
+
+def make_product_page(product: dict[str, Any]) -> str:
+    return (
+        "<html><body>"
+        f"<span id='productTitle'>{product['product']}</span>"
+        "<div id='corePrice_feature_div'>"
+        f"<span class='a-offscreen'>{product['price']}</span></div>"
+        "<div id='wayfinding-breadcrumbs_feature_div'>"
+        f"<ul><li>{product['category']}</li></ul></div>"
+        "<div id='averageCustomerReviews_feature_div'>"
+        f"<span class='a-size-base a-color-base'>{product['rating']}</span></div>"
+        "</body></html>"
+    )
+
+
+def make_review_page(reviews: list[str], has_next: bool) -> str:
+    # Roughly the markup around each review on the real page
+    blocks = "".join(
+        "<div data-hook='review' class='a-section review'>"
+        "<div class='a-row'><a class='a-profile'>Customer</a></div>"
+        "<i data-hook='review-star-rating'>"
+        f"<span class='a-icon-alt'>{ix % 5 + 1}.0 out of 5 stars</span></i>"
+        "<span data-hook='review-date'>"
+        f"Reviewed in the United States on March {ix % 28 + 1}, 2024</span>"
+        "<span data-hook='avp-badge'>Verified Purchase</span>"
+        "<span data-hook='review-body' class='a-size-base review-text'>"
+        f"<span>{review}</span></span>"
+        "<span data-hook='helpful-vote-statement'>"
+        f"{ix + 2} people found this helpful</span></div>"
+        for ix, review in enumerate(reviews)
+    )
+    pagination = (
+        "<ul class='a-pagination'><li class='a-last'><a href='#'>Next</a></li></ul>"
+        if has_next
+        else ""
+    )
+    return f"<html><body><div id='cm_cr-review_list'>{blocks}</div>{pagination}</body></html>"
+
+
+def make_fixture(
+    fixture_dir: Path, pages: int, per_page: int = 10, seed: int = 0
+) -> str:
+    product = make_product(pages * per_page, seed)
+    reviews = product["comments"]
+    review_pages = [
+        make_review_page(
+            reviews[ix : ix + per_page], has_next=ix + per_page < len(reviews)
+        )
+        for ix in range(0, len(reviews), per_page)
+    ]
+    save_fixture(fixture_dir, "B0BENCHMRK", make_product_page(product), review_pages)
+    return product["url"]
@@ -0,0 +1,328 @@
+import argparse
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks.fakes import (
+    FakeProductAnalyzer,
+    make_analysis,
+    make_fixture,
+    make_product,
+    make_product_page,
+    make_review_page,
+    make_reviews,
+)
+from src.analyzer import load_templates
+from src.config import settings
+from src.issues import IssueIndex
+from src.parsing import Review, parse_product_details, parse_review_page
+from src.sources import FixtureSource
+
+STAGES = ("parse", "scrape", "templates", "prompt", "analyze", "issues")
+PROMPT_SIZES = (10, 100, 1_000, 10_000)
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    rank = pct / 100 * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def measure(
+    name: str,
+    fn: Callable[[], Any],
+    items: int = 1,
+    repeat: int = 10,
+    max_seconds: float = 10.0,
+    **params: Any,
+) -> dict[str, Any]:
+    fn()  # warm-up, fills lazy imports and caches outside of the samples
+    samples: list[float] = []
+    started = time.perf_counter()
+    while len(samples) < repeat:
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        # Slow cases stop early, but always get enough runs for a p95
+        if len(samples) >= 3 and time.perf_counter() - started > max_seconds:
+            break
+
+    # Measured in a separate run, tracing slows every allocation down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50 = _percentile(samples, 50)
+    result = {
+        "name": name,
+        "params": params,
+        "runs": len(samples),
+        "items": items,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": p50 * 1000,
+        "p95_ms": _percentile(samples, 95) * 1000,
+        "throughput": items / p50 if p50 else 0.0,
+        "peak_memory_kb": peak / 1024,
+    }
+    print(
+        f"{name:<28} p50 {result['p50_ms']:>10.2f} ms  p95 {result['p95_ms']:>10.2f} ms"
+        f"  {result['throughput']:>12.1f} items/s  {result['peak_memory_kb']:>10.0f} KiB"
+    )
+    return result
+
+
+def bench_parse(args: argparse.Namespace) -> list[dict[str, Any]]:
+    product = make_product(10)
+    review_page = make_review_page(product["comments"], has_next=True)
+    product_page = make_product_page(product)
+    return [
+        measure(
+            "parse.review_page",
+            lambda: parse_review_page(review_page),
+            items=10,
+            repeat=args.repeat,
+        ),
+        measure(
+            "parse.product_details",
+            lambda: parse_product_details(product_page),
+            repeat=args.repeat,
+        ),
+    ]
+
+
+def bench_scrape(args: argparse.Namespace) -> list[dict[str, Any]]:
+    # Whole fetch_product_data over recorded pages, reviews count as items
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        url = make_fixture(Path(fixture_dir), pages=args.pages)
+        source = FixtureSource(Path(fixture_dir))
+
+        def fetch() -> None:
+            with source.scraper() as fetcher:
+                fetcher.fetch_product_data(url, args.pages)
+
+        return [
+            measure(
+                "scrape.fixture",
+                fetch,
+                items=args.pages * 10,
+                repeat=args.repeat,
+                pages=args.pages,
+                concurrency=settings.REVIEW_CONCURRENCY,
+            )
+        ]
+
+
+def bench_templates(args: argparse.Namespace) -> list[dict[str, Any]]:
+    def load() -> None:
+        load_templates.cache_clear()
+        load_templates(settings.TEMPLATE_PATH)
+
+    return [
+        measure("templates.load", load, repeat=args.repeat),
+        measure(
+            "templates.cached",
+            lambda: load_templates(settings.TEMPLATE_PATH),
+            repeat=args.repeat,
+        ),
+    ]
+
+
+def bench_prompt(args: argparse.Namespace) -> list[dict[str, Any]]:
+    analyzer = FakeProductAnalyzer()
+    results = []
+    for size in args.sizes:
+        comments = make_reviews(size)
+        results.append(
+            measure(
+                f"prompt[n={size}]",
+                lambda: analyzer._prepare_review_analysis(comments),
+                items=size,
+                repeat=args.repeat,
+                reviews=size,
+                local_scoring=settings.LOCAL_SCORING,
+                token_budget=settings.PROMPT_TOKEN_BUDGET,
+            )
+        )
+    return results
+
+
+def bench_analyze(args: argparse.Namespace) -> list[dict[str, Any]]:
+    analyzer = FakeProductAnalyzer(delay=args.llm_delay)
+    results = []
+    for size in (100, 1_000):
+        product = make_product(size)
+        results.append(
+            measure(
+                f"analyze[n={size}]",
+                lambda: analyzer.analyze_product(product),
+                items=size,
+                repeat=args.repeat,
+                reviews=size,
+                llm_delay=args.llm_delay,
+                mode=settings.ANALYSIS_MODE,
+            )
+        )
+    # Pages of 10 as they come from stream_reviews
+    product = make_product(1_000)
+    pages = [
+        [Review(text=text) for text in product["comments"][ix : ix + 10]]
+        for ix in range(0, 1_000, 10)
+    ]
+    results.append(
+        measure(
+            "analyze.review_stream[n=1000]",
+            lambda: analyzer.analyze_review_stream(product, iter(pages)),
+            items=1_000,
+            repeat=args.repeat,
+            reviews=1_000,
+            llm_delay=args.llm_delay,
+            mode=settings.ANALYSIS_MODE,
+        )
+    )
+    product = make_product(100)
+    results.append(
+        measure(
+            "analyze.stream[n=100]",
+            lambda: analyzer.analyze_product(product, on_token=lambda token: None),
+            items=100,
+            repeat=args.repeat,
+            reviews=100,
+            llm_delay=args.llm_delay,
+        )
+    )
+    return results
+
+
+def bench_issues(args: argparse.Namespace) -> list[dict[str, Any]]:
+    # One index of --products analyses with 10 reviews each, built once
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = IssueIndex(Path(index_dir) / "issues.db")
+        for ix in range(args.products):
+            index.add_product(
+                f"B{ix:09d}", f"Product {ix}", make_analysis(ix), make_reviews(10, ix)
+            )
+        products = args.products
+        analysis, reviews = make_analysis(products), make_reviews(10, products)
+        return [
+            measure(
+                f"issues.add[n={products}]",
+                lambda: index.add_product("B000000000", "Product", analysis, reviews),
+                repeat=args.repeat,
+                products=products,
+            ),
+            measure(
+                f"issues.search[n={products}]",
+                lambda: index.search("the battery cracked", 10),
+                repeat=args.repeat,
+                products=products,
+            ),
+            measure(
+                f"issues.clusters[n={products}]",
+                index.clusters,
+                repeat=args.repeat,
+                products=products,
+                threshold=settings.ISSUE_CLUSTER_THRESHOLD,
+            ),
+        ]
+
+
+BENCHMARKS: dict[str, Callable[[argparse.Namespace], list[dict[str, Any]]]] = {
+    "parse": bench_parse,
+    "scrape": bench_scrape,
+    "templates": bench_templates,
+    "prompt": bench_prompt,
+    "analyze": bench_analyze,
+    "issues": bench_issues,
+}
+
+
+def _git_revision() -> str:
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision.stdout.strip()
+
+
+def compare(results: list[dict[str, Any]], baseline_path: Path) -> None:
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        if (old := baseline.get(result["name"])) is None:
+            continue
+        change = (result["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0
+        memory = result["peak_memory_kb"] - old["peak_memory_kb"]
+        print(
+            f"{result['name']:<28} p50 {old['p50_ms']:>10.2f} -> "
+            f"{result['p50_ms']:>10.2f} ms ({change:+6.1f}%)  memory {memory:+.0f} KiB"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the scraping, prompt building and analysis stages."
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(PROMPT_SIZES))
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument(
+        "--products", type=int, default=2000, help="Products in the issue index"
+    )
+    parser.add_argument(
+        "--llm-delay",
+        type=float,
+        default=0.05,
+        help="Seconds the fake LLM waits before answering",
+    )
+    parser.add_argument("-o", "--output", type=Path)
+    parser.add_argument(
+        "--compare", type=Path, help="Earlier results file to compare against"
+    )
+    args = parser.parse_args()
+
+    revision = _git_revision()
+    results: list[dict[str, Any]] = []
+    for stage in args.stages:
+        results.extend(BENCHMARKS[stage](args))
+
+    output = args.output or RESULTS_DIR / f"{revision}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "revision": revision,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
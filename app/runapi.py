@@ -0,0 +1,15 @@
+import uvicorn
+
+from src.api import create_app
+from src.config import settings
+
+app = create_app()
+
+if __name__ == "__main__":
+    # Jobs live in this process, so the API must run as a single worker
+    uvicorn.run(
+        app,
+        host=settings.API_HOST,
+        port=settings.API_PORT,
+        root_path=settings.API_ROOT_PATH,
+    )
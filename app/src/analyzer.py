@@ -1,5 +1,10 @@
+import asyncio
+import contextvars
 import logging
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cache, lru_cache
+from pathlib import Path
+from typing import Any, Callable, Iterable
 
 import yaml
 from langchain.chains import LLMChain
@@ -8,11 +13,24 @@ from langchain.prompts import (
     HumanMessagePromptTemplate,
     PromptTemplate,
 )
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import SecretStr
 
+from src.cache import AnalysisCache, analysis_cache, make_cache_key
 from src.config import settings
+from src.llm_scheduler import ScheduledGemini
+from src.metrics import CACHE_REQUESTS, LLM_TOKENS, span
+from src.parsing import Review
+from src.preprocess import ReviewDeduplicator, estimate_tokens, select_reviews
+from src.scoring import (
+    CRITICAL_LABELS,
+    ReviewScores,
+    critical_reviews,
+    group_by_aspect,
+    score_reviews,
+    score_sentiment,
+)
 
 LOGGER = logging.getLogger("llm")
 
@@ -21,20 +39,37 @@ class LLMAnalysisError(Exception):
     pass
 
 
+@cache
+def load_templates(path: Path) -> dict[str, str]:
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
 class ProductAnalyzer:
-    def __init__(self, api_key: str = ""):
+    def __init__(self, api_key: str = "", cache: AnalysisCache | None = analysis_cache):
         self.api_key = SecretStr(api_key)
+        self.cache = cache if settings.ANALYSIS_CACHE else None
 
-        with open(settings.TEMPLATE_PATH) as f:
-            templates = yaml.safe_load(f)
-        self.templates: dict[str, str] = templates
+        self.templates: dict[str, str] = load_templates(settings.TEMPLATE_PATH)
 
+        self.llm = self._get_llm()
         self.llm_chain = self._get_chain()
+        self.map_chain = self._get_map_chain()
 
-    def _get_chain(self) -> LLMChain:
-        if not self.api_key:
+    def _get_llm(self) -> BaseChatModel:
+        # The analyzer's own key first, then the shared ones from GOOGLE_API_KEYS
+        api_keys = list(
+            dict.fromkeys(
+                filter(
+                    None, [self.api_key.get_secret_value(), *settings.GOOGLE_API_KEYS]
+                )
+            )
+        )
+        if not api_keys:
             raise ValueError("API Key not set")
+        return ScheduledGemini(api_keys=[SecretStr(key) for key in api_keys])
 
+    def _get_chain(self) -> LLMChain:
         input_variables = [
             "title",
             "category",
@@ -54,48 +89,292 @@ class ProductAnalyzer:
             input_variables=input_variables, messages=[system_message, human_message]
         )
 
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash-8b",
-            temperature=0.7,
-            api_key=self.api_key,
+        return LLMChain(llm=self.llm, prompt=prompt)
+
+    def _get_map_chain(self) -> LLMChain:
+        input_variables = ["title", "category", "reviews"]
+        prompt = PromptTemplate(
+            input_variables=input_variables, template=self.templates["map-prompt"]
         )
+        return LLMChain(llm=self.llm, prompt=prompt)
 
-        return LLMChain(llm=llm, prompt=prompt)
+    def analyze_product(
+        self,
+        data: dict[str, str | float | list[str]],
+        on_token: Callable[[str], None] | None = None,
+        scores: ReviewScores | None = None,
+    ) -> str:
+        if not self.llm_chain:
+            raise ValueError("LLM Chain not set properly.")
 
-    def analyze_product(self, data: dict[str, str | float | list[str]]) -> str:
+        with span("analyze_product", reviews=len(data["comments"])) as current:
+            try:
+                comments = data["comments"]
+                context = self._context(data)
+                if settings.ANALYSIS_MODE == "single":
+                    reviews = self._format_reviews(comments, scores=scores)
+                    map_reduce = False
+                else:
+                    # Map-reduce covers every review, so no budget is applied here
+                    reviews = self._format_reviews(
+                        comments, token_budget=0, scores=scores
+                    )
+                    map_reduce = self._use_map_reduce(reviews)
+
+                mode = "map-reduce" if map_reduce else "single"
+                current.set(mode=mode, prompt_reviews=len(reviews))
+                cache_key = make_cache_key(
+                    mode
+                    + self.llm_chain.prompt.format(
+                        **context, reviews_analysis="\n".join(reviews)
+                    ),
+                    settings.LLM_MODEL,
+                    settings.LLM_TEMPERATURE,
+                )
+                if self.cache and (cached := self.cache.get(cache_key)) is not None:
+                    CACHE_REQUESTS.inc(cache="analysis", result="hit")
+                    LOGGER.info(f"Analysis served from cache {self.cache.stats}")
+                    if on_token:
+                        on_token(cached)
+                    return cached
+                if self.cache:
+                    CACHE_REQUESTS.inc(cache="analysis", result="miss")
+
+                if map_reduce:
+                    reviews_analysis = asyncio.run(self._map_reviews(context, reviews))
+                else:
+                    reviews_analysis = "\n".join(reviews)
+
+                result = self._summarise(context, reviews_analysis, on_token)
+                if self.cache:
+                    self.cache.put(cache_key, result)
+                return result
+            except Exception as e:
+                LOGGER.error(f"LLM Chain error: {str(e)}")
+                raise LLMAnalysisError()
+
+    def analyze_review_stream(
+        self,
+        data: dict[str, Any],
+        pages: Iterable[list[Review]],
+        on_token: Callable[[str], None] | None = None,
+        scores: ReviewScores | None = None,
+    ) -> str:
+        # Reviews are deduplicated and scored page by page. Once they outgrow
+        # the prompt budget they are summarised in map chunks while the later
+        # pages are still being fetched, only reviews waiting for a chunk are
+        # kept. Results are not cached, the prompt is only known at the end.
         if not self.llm_chain:
             raise ValueError("LLM Chain not set properly.")
+
+        context = self._context(data)
+        deduplicator = ReviewDeduplicator()
+        chunk_size = max(2, settings.MAP_CHUNK_SIZE)
+        map_reduce = settings.ANALYSIS_MODE == "map_reduce"
+        pending: list[str] = []
+        pending_tokens = 0
+        # Praise is only prompted for when no review complains at all
+        fallback: list[str] = []
+        fallback_tokens = 0
+        has_critical = not settings.LOCAL_SCORING
+        partials: list[Future[str]] = []
+
+        with span("analyze_review_stream") as current, ThreadPoolExecutor(
+            max_workers=settings.MAP_CONCURRENCY, thread_name_prefix="map"
+        ) as executor:
+            try:
+                for page in pages:
+                    comments = deduplicator.add([review.text for review in page])
+                    if settings.LOCAL_SCORING and comments:
+                        labels, compound = score_sentiment(comments)
+                        if scores is not None:
+                            scores.extend(labels, compound)
+                        critical = [
+                            comment
+                            for comment, label in zip(comments, labels)
+                            if label in CRITICAL_LABELS
+                        ]
+                        if not has_critical and not critical:
+                            if fallback_tokens < settings.PROMPT_TOKEN_BUDGET:
+                                fallback.extend(comments)
+                                fallback_tokens += sum(map(estimate_tokens, comments))
+                            continue
+                        has_critical = True
+                        comments = critical
+                    pending.extend(comments)
+                    pending_tokens += sum(map(estimate_tokens, comments))
+                    if settings.ANALYSIS_MODE == "auto" and not map_reduce:
+                        map_reduce = pending_tokens > settings.PROMPT_TOKEN_BUDGET
+                    while map_reduce and len(pending) >= chunk_size:
+                        chunk, pending = pending[:chunk_size], pending[chunk_size:]
+                        partials.append(self._submit_chunk(executor, context, chunk))
+
+                LOGGER.info(f"Review selection: {deduplicator.report}")
+                if not has_critical:
+                    pending = fallback
+                mode = "map-reduce" if map_reduce else "single"
+                current.set(mode=mode, reviews=deduplicator.report.total)
+                if map_reduce:
+                    if pending:
+                        partials.append(self._submit_chunk(executor, context, pending))
+                    summaries = [partial.result() for partial in partials]
+                    tokens = sum(map(estimate_tokens, summaries))
+                    if len(summaries) > 1 and tokens > settings.PROMPT_TOKEN_BUDGET:
+                        reviews_analysis = asyncio.run(
+                            self._map_reviews(context, summaries)
+                        )
+                    else:
+                        reviews_analysis = "\n".join(summaries)
+                else:
+                    reviews_analysis = "\n".join(self._format_reviews(pending))
+                return self._summarise(context, reviews_analysis, on_token)
+            except Exception as e:
+                LOGGER.error(f"LLM Chain error: {str(e)}")
+                raise LLMAnalysisError()
+
+    def _context(self, data: dict[str, Any]) -> dict[str, Any]:
         if isinstance(data["rating"], str):
             rating = int(data["rating"])
         else:
             rating = -1
+        return {
+            "title": data["product"],
+            "category": data.get("category", "No category available"),
+            "average_rating": rating if rating > 0 else "Unknown",
+        }
 
-        try:
-            context = {
-                "title": data["product"],
-                "category": data.get("category", "No category available"),
-                "reviews_analysis": self._prepare_review_analysis(data["comments"]),
-                "average_rating": rating if rating > 0 else "Unknown",
-            }
-
-            LOGGER.info("Running Gemini analysis...")
-            result = self.llm_chain.run(context)
-            LOGGER.info("Analysis complete")
-            return result
-        except Exception as e:
-            LOGGER.error(f"LLM Chain error: {str(e)}")
-            raise LLMAnalysisError()
+    def _summarise(
+        self,
+        context: dict[str, Any],
+        reviews_analysis: str,
+        on_token: Callable[[str], None] | None = None,
+    ) -> str:
+        LOGGER.info("Running Gemini analysis...")
+        context["reviews_analysis"] = reviews_analysis
+        with span("llm_call", streaming=bool(on_token)):
+            if on_token:
+                result = self._stream(context, on_token)
+            else:
+                result = self.llm_chain.run(context)
+        # Reviews make up nearly all of the prompt
+        LLM_TOKENS.inc(estimate_tokens(reviews_analysis), direction="input")
+        LLM_TOKENS.inc(estimate_tokens(result), direction="output")
+        LOGGER.info("Analysis complete")
+        return result
 
-    def _prepare_review_analysis(self, comments_data: Any) -> str:
+    def _stream(self, context: dict[str, Any], on_token: Callable[[str], None]) -> str:
+        messages = self.llm_chain.prompt.format_messages(**context)
+        parts: list[str] = []
+        for chunk in self.llm.stream(messages):
+            parts.append(str(chunk.content))
+            on_token(parts[-1])
+        return "".join(parts)
+
+    def _use_map_reduce(self, reviews: list[str]) -> bool:
+        if settings.ANALYSIS_MODE == "map_reduce":
+            return True
+        tokens = sum(estimate_tokens(review) for review in reviews)
+        return tokens > settings.PROMPT_TOKEN_BUDGET
+
+    def _submit_chunk(
+        self, executor: ThreadPoolExecutor, context: dict[str, Any], chunk: list[str]
+    ) -> Future[str]:
+        reviews = [
+            self.templates["comment-template"].format(comment=comment)
+            for comment in chunk
+        ]
+        # Keeps the map calls inside the caller's trace
+        return executor.submit(
+            contextvars.copy_context().run, self._map_chunk, context, reviews
+        )
+
+    def _map_chunk(self, context: dict[str, Any], chunk: list[str]) -> str:
+        text = "\n".join(chunk)
+        with span("map_chunk", reviews=len(chunk)):
+            summary = self.map_chain.run(
+                title=context["title"], category=context["category"], reviews=text
+            )
+        return self._partial_summary(text, summary, len(chunk))
+
+    def _partial_summary(self, text: str, summary: str, count: int) -> str:
+        LLM_TOKENS.inc(estimate_tokens(text), direction="input")
+        LLM_TOKENS.inc(estimate_tokens(summary), direction="output")
+        return self.templates["partial-template"].format(
+            count=count, summary=summary.strip()
+        )
+
+    async def _map_reviews(self, context: dict[str, Any], reviews: list[str]) -> str:
+        # Summarises chunks of reviews concurrently until the partial summaries
+        # fit into a single summary prompt
+        semaphore = asyncio.Semaphore(settings.MAP_CONCURRENCY)
+
+        async def summarise(chunk: list[str]) -> str:
+            text = "\n".join(chunk)
+            async with semaphore:
+                with span("map_chunk", reviews=len(chunk)):
+                    summary = await self.map_chain.arun(
+                        title=context["title"],
+                        category=context["category"],
+                        reviews=text,
+                    )
+            return self._partial_summary(text, summary, len(chunk))
+
+        chunk_size = max(2, settings.MAP_CHUNK_SIZE)
+        level = 1
+        while True:
+            chunks = [
+                reviews[i : i + chunk_size] for i in range(0, len(reviews), chunk_size)
+            ]
+            LOGGER.info(f"Map step {level}: {len(chunks)} chunks")
+            reviews = list(await asyncio.gather(*map(summarise, chunks)))
+            tokens = sum(estimate_tokens(review) for review in reviews)
+            if len(reviews) == 1 or tokens <= settings.PROMPT_TOKEN_BUDGET:
+                return "\n".join(reviews)
+            level += 1
+
+    def _format_reviews(
+        self,
+        comments_data: Any,
+        token_budget: int = settings.PROMPT_TOKEN_BUDGET,
+        scores: ReviewScores | None = None,
+    ) -> list[str]:
         if not isinstance(comments_data, list):
             raise ValueError("Incorrect data format")
 
+        aspect_terms: list[str] = []
+        if settings.LOCAL_SCORING and comments_data:
+            scores = scores or score_reviews(comments_data)
+            LOGGER.info(f"Local scoring: {scores.label_counts}")
+            # Only complaints lead to improvements, keep everything if none found
+            if critical := critical_reviews(comments_data, scores):
+                comments_data = critical
+                aspect_terms = scores.aspect_terms
+
+        selected, report = select_reviews(comments_data, token_budget=token_budget)
+        LOGGER.info(f"Review selection: {report}")
+
+        groups = group_by_aspect(selected, aspect_terms) if aspect_terms else []
         reviews_analysis: list[str] = []
-        for comm in comments_data:
-            context = {"comment": comm}
-            review_text = self.templates["comment-template"].format(**context)
-            reviews_analysis.append(review_text)
+        for aspect, group in groups or [("", selected)]:
+            for ix, comm in enumerate(group):
+                context = {"comment": comm}
+                review_text = self.templates["comment-template"].format(**context)
+                if aspect and ix == 0:
+                    header = self.templates["aspect-template"].format(
+                        aspect=aspect, count=len(group)
+                    )
+                    review_text = header + review_text
+                reviews_analysis.append(review_text)
 
         if not reviews_analysis:
             raise LLMAnalysisError("No comments found")
-        return "\n".join(reviews_analysis)
+        return reviews_analysis
+
+    def _prepare_review_analysis(self, comments_data: Any) -> str:
+        return "\n".join(self._format_reviews(comments_data))
+
+
+@lru_cache(maxsize=16)
+def get_product_analyzer(api_key: str) -> ProductAnalyzer:
+    # Analyzers are stateless between calls, so one per key serves every session
+    return ProductAnalyzer(api_key=api_key)
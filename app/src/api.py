@@ -0,0 +1,226 @@
+import hmac
+import logging
+from dataclasses import asdict
+from typing import Any
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from src.analyzer import get_product_analyzer
+from src.config import settings
+from src.fetcher import extract_asin
+from src.issues import ISSUE, REVIEW, issue_index
+from src.jobs import AnalysisJob, job_manager
+from src.logconf import setup_logging
+from src.metrics import start_metrics_server
+from src.sources import get_fetcher_source
+
+LOGGER = logging.getLogger("jobs")
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _job_status(request: Request, job: AnalysisJob) -> dict[str, Any]:
+    # Paths include the root path, so they stay valid behind the proxy
+    def link(name: str) -> str:
+        return request.url_for(name, job_id=job.id).path
+
+    return {
+        "id": job.id,
+        "url": job.url,
+        "max_pages": job.max_pages,
+        "status": job.status,
+        "pages_done": job.pages_done,
+        "comments_fetched": job.comments_fetched,
+        "failed_while": job.failed_while,
+        "links": {
+            "self": link("get_job"),
+            "data": link("get_job_data"),
+            "analysis": link("get_job_analysis"),
+        },
+    }
+
+
+def _get_job(request: Request) -> AnalysisJob:
+    job = job_manager.get(request.path_params["job_id"])
+    if job is None:
+        raise ApiError(404, "Job not found.")
+    return job
+
+
+async def _read_submission(request: Request) -> tuple[list[str], int]:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise ApiError(400, "Request body must be a JSON object.")
+
+    urls = body.get("urls", [body["url"]] if "url" in body else [])
+    if not isinstance(urls, list) or not urls:
+        raise ApiError(422, "Provide a product `url` or a list of `urls`.")
+    if len(urls) > settings.API_MAX_URLS:
+        raise ApiError(422, f"At most {settings.API_MAX_URLS} urls per request.")
+    invalid = [url for url in urls if not isinstance(url, str) or not extract_asin(url)]
+    if invalid:
+        raise ApiError(422, f"Not Amazon product urls: {invalid}")
+
+    max_pages = body.get("max_pages", 5)
+    if not isinstance(max_pages, int) or not 1 <= max_pages <= settings.API_MAX_PAGES:
+        raise ApiError(
+            422, f"`max_pages` must be between 1 and {settings.API_MAX_PAGES}."
+        )
+    return urls, max_pages
+
+
+async def submit_jobs(request: Request) -> JSONResponse:
+    urls, max_pages = await _read_submission(request)
+    # Only the configured credentials, never ones sent with the request
+    email = settings.API_EMAIL or settings.EMAIL
+    password = settings.API_PASSWORD or settings.PASSWORD
+    if not settings.FIXTURE_DIR and not (email and password):
+        raise ApiError(503, "API_EMAIL and API_PASSWORD are not configured.")
+    try:
+        analyzer = get_product_analyzer(
+            settings.API_GOOGLE_API_KEY or settings.GOOGLE_API_KEY
+        )
+    except ValueError:
+        raise ApiError(503, "API_GOOGLE_API_KEY or GOOGLE_API_KEYS is not configured.")
+    # Shared by every request, pooled drivers and analyzers stay warm
+    source = get_fetcher_source(email, password)
+    jobs = [job_manager.submit(source, analyzer, url, max_pages) for url in urls]
+    LOGGER.info(f"API submitted {len(jobs)} jobs")
+    return JSONResponse(
+        {"jobs": [_job_status(request, job) for job in jobs]}, status_code=202
+    )
+
+
+async def get_job(request: Request) -> JSONResponse:
+    return JSONResponse(_job_status(request, _get_job(request)))
+
+
+async def get_job_data(request: Request) -> JSONResponse:
+    job = _get_job(request)
+    if job.data is None:
+        raise ApiError(409, f"No data yet, the job is {job.status}.")
+    return JSONResponse({"id": job.id, "data": job.data})
+
+
+async def get_job_analysis(request: Request) -> JSONResponse:
+    # Partial while the answer is streamed, complete once the job is done
+    job = _get_job(request)
+    if job.status == "failed":
+        raise ApiError(409, f"The job failed while {job.failed_while}.")
+    return JSONResponse(
+        {
+            "id": job.id,
+            "status": job.status,
+            "complete": job.status == "done",
+            "analysis": job.summary,
+            "review_scores": job.scores.label_counts if job.scores else None,
+        }
+    )
+
+
+def _int_param(request: Request, name: str, default: int, maximum: int) -> int:
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        raise ApiError(422, f"`{name}` must be an integer.")
+    if not 1 <= value <= maximum:
+        raise ApiError(422, f"`{name}` must be between 1 and {maximum}.")
+    return value
+
+
+async def search_issues(request: Request) -> JSONResponse:
+    query = request.query_params.get("q", "").strip()
+    if not query:
+        raise ApiError(422, "Provide the text to search for as `q`.")
+    kind = request.query_params.get("kind")
+    if kind not in (None, ISSUE, REVIEW):
+        raise ApiError(422, f"`kind` must be {ISSUE} or {REVIEW}.")
+    k = _int_param(request, "k", 10, 100)
+    hits = await run_in_threadpool(issue_index.search, query, k, kind)
+    return JSONResponse({"query": query, "hits": [asdict(hit) for hit in hits]})
+
+
+async def get_issue_clusters(request: Request) -> JSONResponse:
+    try:
+        threshold = float(
+            request.query_params.get("threshold", settings.ISSUE_CLUSTER_THRESHOLD)
+        )
+    except ValueError:
+        raise ApiError(422, "`threshold` must be a number.")
+    min_products = _int_param(request, "min_products", 2, 1000)
+    limit = _int_param(request, "limit", 20, 1000)
+    clusters = await run_in_threadpool(issue_index.clusters, threshold, min_products)
+    return JSONResponse(
+        {
+            "clusters": [
+                {
+                    "label": cluster.label,
+                    "asins": cluster.asins,
+                    "issues": [asdict(hit) for hit in cluster.hits],
+                }
+                for cluster in clusters[:limit]
+            ]
+        }
+    )
+
+
+async def health(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok"})
+
+
+async def _require_token(
+    request: Request, call_next: RequestResponseEndpoint
+) -> Response:
+    # Scrapes spend the operator's Amazon account and Gemini quota
+    path = request.url.path.removeprefix(request.scope.get("root_path", ""))
+    if path == "/health":
+        return await call_next(request)
+    if not settings.API_TOKEN:
+        return JSONResponse({"detail": "API_TOKEN is not configured."}, status_code=503)
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), settings.API_TOKEN.encode()
+    ):
+        return JSONResponse(
+            {"detail": "Missing or invalid API token."},
+            status_code=401,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await call_next(request)
+
+
+async def _handle_api_error(request: Request, exc: Exception) -> JSONResponse:
+    assert isinstance(exc, ApiError)
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
+
+def create_app() -> Starlette:
+    setup_logging()
+    start_metrics_server()
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/jobs", submit_jobs, methods=["POST"]),
+            Route("/jobs/{job_id}", get_job),
+            Route("/jobs/{job_id}/data", get_job_data),
+            Route("/jobs/{job_id}/analysis", get_job_analysis),
+            Route("/issues/search", search_issues),
+            Route("/issues/clusters", get_issue_clusters),
+        ],
+        middleware=[Middleware(BaseHTTPMiddleware, dispatch=_require_token)],
+        exception_handlers={ApiError: _handle_api_error},
+    )
@@ -1,9 +1,12 @@
 import streamlit as st
 
-from src.analyzer import ProductAnalyzer
+from src.analyzer import get_product_analyzer
 from src.config import settings
-from src.fetcher import AmazonScraper
+from src.jobs import job_manager
 from src.logconf import setup_logging
+from src.metrics import start_metrics_server
+from src.scoring import ReviewScores
+from src.sources import get_fetcher_source
 
 # NOTE: This file would need some refactor.
 # Current structure doesn't provide easy error handling
@@ -19,6 +22,7 @@ class AppManager:
         if "logger_set" not in st.session_state:
             st.session_state.logger_set = True
             setup_logging()
+            start_metrics_server()
         cls.set_basic_config()
         cls.set_menu()
         cls.set_working_section()
@@ -54,8 +58,8 @@ class AppManager:
             if st.button("Connect"):
                 if hasattr(st.session_state, "product_analyzer"):
                     delattr(st.session_state, "product_analyzer")
-                if hasattr(st.session_state, "amazon_scraper"):
-                    delattr(st.session_state, "amazon_scraper")
+                if hasattr(st.session_state, "amazon_pool"):
+                    delattr(st.session_state, "amazon_pool")
                 cls._handle_menu_submit(google_api_key, amazon_login, amazon_password)
 
     @staticmethod
@@ -66,22 +70,22 @@ class AppManager:
             st.session_state.google_api_key = google_api_key
             try:
                 with st.spinner("Establishing connection..."):
-                    st.session_state.product_analyzer = ProductAnalyzer(
-                        api_key=google_api_key
+                    st.session_state.product_analyzer = get_product_analyzer(
+                        google_api_key
                     )
                 st.success("Analyzing tools ready to use!")
             except Exception:
                 st.error("Unexpected error while connecting to Gemini.")
 
-        if amazon_login and amazon_password:
+        # Recorded fixtures need no Amazon account
+        if settings.FIXTURE_DIR or (amazon_login and amazon_password):
             st.session_state.amazon_login = amazon_login
             st.session_state.amazon_password = amazon_password
             try:
-                st.session_state.amazon_scraper = AmazonScraper(
-                    email=amazon_login, password=amazon_password
-                )
+                pool = get_fetcher_source(amazon_login, amazon_password)
                 with st.spinner("Connecting to Amazon..."):
-                    st.session_state.amazon_scraper.open_connection()
+                    pool.warm_up()
+                st.session_state.amazon_pool = pool
                 st.success("Amazon connected successfully!")
             except Exception:
                 st.error(
@@ -90,7 +94,7 @@ class AppManager:
 
         if not google_api_key:
             st.warning("Google API Key is missing.")
-        if not (amazon_login and amazon_password):
+        if not (settings.FIXTURE_DIR or (amazon_login and amazon_password)):
             st.warning("Amazon credentials are incomplete.")
 
     @classmethod
@@ -98,6 +102,7 @@ class AppManager:
         cls._display_title()
         cls._display_product_input()
         cls._display_product_details()
+        cls._display_job()
 
     @staticmethod
     def _display_title() -> None:
@@ -119,40 +124,72 @@ class AppManager:
                 delattr(st.session_state, "products_data")
             if hasattr(st.session_state, "current_summary"):
                 delattr(st.session_state, "current_summary")
-            cls._load_product_data(product_url, max_pages)
-            cls._generate_analysis()
+            if hasattr(st.session_state, "review_scores"):
+                delattr(st.session_state, "review_scores")
+            cls._submit_job(product_url, max_pages)
 
     @staticmethod
-    def _load_product_data(product_url: str, max_pages: int) -> None:
+    def _submit_job(product_url: str, max_pages: int) -> None:
         if not product_url:
             st.warning("Please enter a product URL.")
             return
-        if "amazon_scraper" not in st.session_state:
+        if "amazon_pool" not in st.session_state:
             st.error("Connect to amazon first.")
-        try:
-            with st.spinner("Fetching product data..."):
-                st.session_state.products_data = (
-                    st.session_state.amazon_scraper.fetch_product_data(
-                        product_url, max_pages
-                    )
-                )
-                st.success("Product data loaded successfully!")
-        except Exception:
-            st.error("Error loading product data. Try to establish connection again.")
+            return
+        if "product_analyzer" not in st.session_state:
+            st.error("Connect to Gemini first.")
+            return
+        # The job runs outside the script thread and survives reruns,
+        # the session only keeps its id
+        job = job_manager.submit(
+            st.session_state.amazon_pool,
+            st.session_state.product_analyzer,
+            product_url,
+            max_pages,
+        )
+        st.session_state.job_id = job.id
 
-    @staticmethod
-    def _generate_analysis() -> None:
-        if "products_data" not in st.session_state:
+    @classmethod
+    def _display_job(cls) -> None:
+        if "job_id" not in st.session_state:
             return
-        data = st.session_state.products_data
+        job = job_manager.get(st.session_state.job_id)
+        run_every = 0.5 if job and job.running else None
+        st.fragment(cls._render_job, run_every=run_every)()
 
-        with st.spinner("Analyzing product reviews..."):
-            try:
-                summary = st.session_state.product_analyzer.analyze_product(data)
-                st.session_state.current_summary = summary
-                st.success("Analysis generated successfully!")
-            except Exception:
+    @staticmethod
+    def _render_job() -> None:
+        job = job_manager.get(st.session_state.get("job_id", ""))
+        if job is None:
+            return
+        if job.status in ("queued", "scraping"):
+            st.progress(
+                min(job.pages_done / job.max_pages, 1.0),
+                text=f"Fetching product data... {job.pages_done}/{job.max_pages} "
+                f"review pages, {job.comments_fetched} comments so far",
+            )
+        elif job.status == "analyzing":
+            if "products_data" not in st.session_state:
+                # Rerun the whole page once so product details show up
+                st.session_state.products_data = job.data
+                st.session_state.review_scores = job.scores
+                st.rerun()
+            st.subheader("💡 Improvement Analysis")
+            st.markdown(job.summary or "Analyzing product reviews...")
+        elif job.status == "done":
+            st.session_state.products_data = job.data
+            st.session_state.review_scores = job.scores
+            st.session_state.current_summary = job.summary
+            del st.session_state.job_id
+            st.rerun()
+        else:
+            del st.session_state.job_id
+            if job.failed_while == "analyzing":
                 st.error("An error occured during analysis.")
+            else:
+                st.error(
+                    "Error loading product data. Try to establish connection again."
+                )
 
     @staticmethod
     def _display_product_details() -> None:
@@ -178,6 +215,21 @@ class AppManager:
         rating = data["rating"] if data["rating"] > 0 else "?"
         col2.metric("Average rating", f"{rating}/5")
         col3.metric("Fetched comments", len(data["comments"]))
+        if st.session_state.get("review_scores"):
+            AppManager._display_review_scores(st.session_state.review_scores)
         if "current_summary" in st.session_state:
             st.subheader("💡 Improvement Analysis")
             st.markdown(st.session_state.current_summary)
+
+    @staticmethod
+    def _display_review_scores(scores: ReviewScores) -> None:
+        st.subheader("🔎 Review Breakdown")
+        counts = scores.label_counts
+        columns = st.columns(len(counts))
+        for column, (label, count) in zip(columns, counts.items()):
+            column.metric(label.capitalize(), count)
+        rows = [
+            {"Aspect": aspect, **{label.capitalize(): n for label, n in labels.items()}}
+            for aspect, labels in scores.breakdown().items()
+        ]
+        st.dataframe(rows, hide_index=True, use_container_width=True)
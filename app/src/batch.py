@@ -0,0 +1,235 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from src.analyzer import ProductAnalyzer, get_product_analyzer
+from src.config import settings
+from src.fetcher import ScrapingError
+from src.issues import index_analysis
+from src.logconf import setup_logging
+from src.metrics import start_metrics_server
+from src.sources import FetcherSource, get_fetcher_source
+
+LOGGER = logging.getLogger("batch")
+
+
+@dataclass
+class BatchItem:
+    index: int
+    url: str
+    status: str = "pending"
+    error: str | None = None
+    data: dict[str, Any] | None = None
+    analysis: str | None = None
+    scrape_seconds: float = 0.0
+    analysis_seconds: float = 0.0
+
+
+@dataclass
+class BatchProgress:
+    total: int
+    done: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def finished(self) -> int:
+        return self.done + self.failed
+
+    def __str__(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        return (
+            f"[{self.finished}/{self.total}] {self.done} done, "
+            f"{self.failed} failed, {elapsed:.0f}s elapsed"
+        )
+
+
+class DriverLostError(ScrapingError):
+    pass
+
+
+def _describe(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        source: FetcherSource,
+        analyzer: ProductAnalyzer,
+        max_pages: int = 5,
+        scrape_workers: int = settings.POOL_SIZE,
+        llm_workers: int = 2,
+    ) -> None:
+        self.source = source
+        self.analyzer = analyzer
+        self.max_pages = max_pages
+        self.scrape_workers = max(1, scrape_workers)
+        self.llm_workers = max(1, llm_workers)
+
+        self._scrape_queue: queue.Queue[BatchItem | None] = queue.Queue()
+        # Bounded so scraping cannot run arbitrarily far ahead of the LLM
+        self._analysis_queue: queue.Queue[BatchItem | None] = queue.Queue(
+            maxsize=2 * self.llm_workers
+        )
+        self._output_lock = threading.Lock()
+        self.progress = BatchProgress(total=0)
+
+    def run(self, urls: list[str], output_path: Path) -> BatchProgress:
+        self.progress = BatchProgress(total=len(urls))
+        for index, url in enumerate(urls):
+            self._scrape_queue.put(BatchItem(index=index, url=url))
+        for _ in range(self.scrape_workers):
+            self._scrape_queue.put(None)
+
+        scrapers = [
+            threading.Thread(target=self._scrape_worker, name=f"scrape-{i}")
+            for i in range(self.scrape_workers)
+        ]
+        analysts = [
+            threading.Thread(target=self._analysis_worker, name=f"llm-{i}")
+            for i in range(self.llm_workers)
+        ]
+        with open(output_path, "a") as self._output:
+            for thread in scrapers + analysts:
+                thread.start()
+            for thread in scrapers:
+                thread.join()
+            # Left over only when every scraping worker lost its driver
+            while not self._scrape_queue.empty():
+                if item := self._scrape_queue.get():
+                    self._fail(item, ScrapingError("No scraping worker available"))
+            for _ in range(self.llm_workers):
+                self._analysis_queue.put(None)
+            for thread in analysts:
+                thread.join()
+        LOGGER.info(f"Batch finished {self.progress}")
+        return self.progress
+
+    def _scrape_worker(self) -> None:
+        try:
+            while self._scrape_items():
+                LOGGER.warning("Scraping worker lost its driver, checking out another.")
+        except Exception as e:
+            # Without a driver this worker cannot take any more items,
+            # the remaining workers keep draining the queue
+            LOGGER.error(f"Scraping worker stopped: {_describe(e)}")
+
+    def _scrape_items(self) -> bool:
+        # True when the driver died on an item, it goes back to the pool as
+        # unhealthy and is replaced
+        try:
+            with self.source.scraper() as scraper:
+                while (item := self._scrape_queue.get()) is not None:
+                    item.status = "scraping"
+                    start = time.monotonic()
+                    try:
+                        item.data = scraper.fetch_product_data(item.url, self.max_pages)
+                    except Exception as e:
+                        self._fail(item, e)
+                        if not scraper.is_alive():
+                            raise DriverLostError(_describe(e))
+                        continue
+                    finally:
+                        item.scrape_seconds = time.monotonic() - start
+                    self._analysis_queue.put(item)
+        except DriverLostError:
+            return True
+        return False
+
+    def _analysis_worker(self) -> None:
+        while (item := self._analysis_queue.get()) is not None:
+            try:
+                self._analyze(item)
+            except Exception as e:
+                # Keeps draining, the scraping workers block on the bounded
+                # queue once every analysis worker is gone
+                LOGGER.error(f"{item.url} could not be recorded: {_describe(e)}")
+
+    def _analyze(self, item: BatchItem) -> None:
+        item.status = "analyzing"
+        start = time.monotonic()
+        try:
+            item.analysis = self.analyzer.analyze_product(item.data)
+            item.analysis_seconds = time.monotonic() - start
+            item.status = "done"
+            index_analysis(item.data, item.analysis)
+            self._record(item)
+        except Exception as e:
+            item.analysis_seconds = time.monotonic() - start
+            self._fail(item, e)
+
+    def _fail(self, item: BatchItem, error: Exception) -> None:
+        LOGGER.warning(f"{item.url} failed while {item.status}: {_describe(error)}")
+        item.status = "failed"
+        item.error = _describe(error)
+        self._record(item)
+
+    def _record(self, item: BatchItem) -> None:
+        with self._output_lock:
+            self._output.write(json.dumps(asdict(item)) + "\n")
+            self._output.flush()
+            if item.status == "done":
+                self.progress.done += 1
+            else:
+                self.progress.failed += 1
+            LOGGER.info(f"{self.progress} - {item.url}")
+
+
+def read_urls(sources: list[str]) -> list[str]:
+    urls: list[str] = []
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source) as f:
+                lines = (line.strip() for line in f)
+                urls.extend(line for line in lines if line and not line.startswith("#"))
+        else:
+            urls.append(source)
+    return urls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Analyze many Amazon products and write the results as JSONL."
+    )
+    parser.add_argument(
+        "urls", nargs="+", help="Product URLs or files with one URL per line"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, default=Path("batch_results.jsonl")
+    )
+    parser.add_argument("--max-pages", type=int, default=5)
+    parser.add_argument("--scrape-workers", type=int, default=settings.POOL_SIZE)
+    parser.add_argument("--llm-workers", type=int, default=2)
+    args = parser.parse_args()
+
+    setup_logging()
+    start_metrics_server()
+    urls = read_urls(args.urls)
+    source = get_fetcher_source(
+        os.getenv("EMAIL", settings.EMAIL), os.getenv("PASSWORD", settings.PASSWORD)
+    )
+    analyzer = get_product_analyzer(
+        os.getenv("GOOGLE_API_KEY", settings.GOOGLE_API_KEY)
+    )
+    runner = BatchRunner(
+        source,
+        analyzer,
+        max_pages=args.max_pages,
+        scrape_workers=args.scrape_workers,
+        llm_workers=args.llm_workers,
+    )
+    progress = runner.run(urls, args.output)
+    if progress.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
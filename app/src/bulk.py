@@ -0,0 +1,409 @@
+import argparse
+import json
+import logging
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.analyzer import get_product_analyzer
+from src.config import settings
+from src.llm_scheduler import share_llm_quota
+from src.logconf import setup_logging
+from src.parsing import build_product_data
+
+LOGGER = logging.getLogger("batch")
+
+# Columns of the Amazon-Reviews-2023 dumps prepared by download_mock_data.ipynb
+REVIEW_COLUMNS = ["parent_asin", "text", "helpful_vote"]
+METADATA_COLUMNS = [
+    "parent_asin",
+    "title",
+    "average_rating",
+    "price",
+    "category",
+    "main_category",
+]
+PRODUCT_URL = "https://www.amazon.com/dp/{asin}"
+CHECKPOINT_FILE = "checkpoint.json"
+_IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression="zstd")
+
+
+class BulkInputError(Exception):
+    pass
+
+
+@dataclass
+class BulkResult:
+    asin: str
+    product: str
+    reviews: int
+    status: str = "done"
+    error: str | None = None
+    analysis: str | None = None
+    analysis_seconds: float = 0.0
+
+
+@dataclass
+class BucketReport:
+    bucket: int
+    done: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+
+def _bucket_path(work_dir: Path, kind: str, bucket: int) -> Path:
+    return work_dir / f"{kind}-{bucket:04d}.arrow"
+
+
+def _part_path(work_dir: Path, bucket: int) -> Path:
+    return work_dir / f"results-{bucket:04d}.jsonl"
+
+
+def _source_id(path: Path) -> dict[str, Any]:
+    stat = path.stat()
+    return {"path": str(path.resolve()), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def _bucket_ids(asins: pa.Array, buckets: int) -> np.ndarray:
+    # crc32 is stable across processes, unlike hash(), and only runs once
+    # per distinct ASIN of the batch
+    encoded = asins.dictionary_encode()
+    per_value = np.fromiter(
+        (
+            zlib.crc32(asin.encode()) % buckets
+            for asin in encoded.dictionary.to_pylist()
+        ),
+        dtype=np.int64,
+        count=len(encoded.dictionary),
+    )
+    return per_value[encoded.indices.to_numpy(zero_copy_only=False)]
+
+
+def partition(
+    source: Path,
+    work_dir: Path,
+    kind: str,
+    columns: list[str],
+    buckets: int,
+    batch_size: int = settings.BULK_BATCH_SIZE,
+) -> int:
+    # Streams the parquet file one batch at a time and spills every row to
+    # the bucket of its parent_asin, so each product ends up in one bucket
+    parquet = pq.ParquetFile(source)
+    available = [name for name in columns if name in parquet.schema_arrow.names]
+    if "parent_asin" not in available:
+        raise BulkInputError(f"{source} has no parent_asin column")
+
+    schema = parquet.schema_arrow
+    schema = pa.schema([schema.field(name) for name in available])
+    writers: dict[int, pa.ipc.RecordBatchStreamWriter] = {}
+    rows = 0
+    try:
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=available):
+            batch = batch.filter(pc.is_valid(batch.column("parent_asin")))
+            if not batch.num_rows:
+                continue
+            ids = _bucket_ids(batch.column("parent_asin"), buckets)
+            order = np.argsort(ids, kind="stable")
+            batch = batch.take(pa.array(order))
+            present, starts = np.unique(ids[order], return_index=True)
+            ends = [*starts[1:], batch.num_rows]
+            for bucket, start, end in zip(present, starts, ends):
+                if bucket not in writers:
+                    sink = pa.OSFile(str(_bucket_path(work_dir, kind, bucket)), "wb")
+                    writers[bucket] = pa.ipc.new_stream(
+                        sink, schema, options=_IPC_OPTIONS
+                    )
+                writers[bucket].write_batch(batch.slice(start, end - start))
+            rows += batch.num_rows
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return rows
+
+
+def _read_bucket(work_dir: Path, kind: str, bucket: int) -> pa.Table | None:
+    path = _bucket_path(work_dir, kind, bucket)
+    if not path.exists():
+        return None
+    with pa.OSFile(str(path), "rb") as source:
+        return pa.ipc.open_stream(source).read_all()
+
+
+def _clean_review(text: str) -> str:
+    return " ".join(text.replace("<br />", " ").split())
+
+
+def iter_products(
+    reviews: pa.Table,
+    metadata: pa.Table | None,
+    max_reviews: int = 0,
+    min_reviews: int = 1,
+) -> Iterator[tuple[str, dict[str, str | float | list[str]]]]:
+    # Yields the same shape AmazonScraper.fetch_product_data returns,
+    # most helpful reviews first like Amazon's own ordering
+    sort_keys = [("parent_asin", "ascending")]
+    if "helpful_vote" in reviews.column_names:
+        sort_keys.append(("helpful_vote", "descending"))
+    reviews = reviews.sort_by(sort_keys)
+
+    details: dict[str, dict[str, Any]] = {}
+    if metadata is not None:
+        details = {row["parent_asin"]: row for row in metadata.to_pylist()}
+
+    asins = reviews.column("parent_asin").to_numpy(zero_copy_only=False)
+    texts = reviews.column("text").to_pylist()
+    bounds = np.flatnonzero(asins[1:] != asins[:-1]) + 1
+    for start, end in zip([0, *bounds], [*bounds, len(asins)]):
+        if end - start < min_reviews:
+            continue
+        asin = str(asins[start])
+        stop = start + max_reviews if max_reviews > 0 else end
+        comments = [
+            _clean_review(text) for text in texts[start : min(end, stop)] if text
+        ]
+        meta = details.get(asin, {})
+        rating = meta.get("average_rating")
+        product = {
+            "product": meta.get("title") or "",
+            "price": str(meta.get("price") or ""),
+            "category": meta.get("category") or meta.get("main_category") or "",
+            "rating": float(rating) if rating is not None else -1.0,
+        }
+        yield asin, build_product_data(product, PRODUCT_URL.format(asin=asin), comments)
+
+
+def _recover_part(part: Path) -> set[str]:
+    # Drops the last line of a worker killed mid-write and returns the ASINs
+    # that already have a result
+    if not part.exists():
+        return set()
+    finished: set[str] = set()
+    valid: list[str] = []
+    with open(part) as f:
+        lines = f.readlines()
+    for line in lines:
+        try:
+            finished.add(json.loads(line)["asin"])
+        except (json.JSONDecodeError, KeyError):
+            continue
+        valid.append(line if line.endswith("\n") else line + "\n")
+    if valid != lines:
+        with open(part, "w") as f:
+            f.writelines(valid)
+    return finished
+
+
+def analyze_bucket(
+    work_dir: Path,
+    bucket: int,
+    api_key: str,
+    max_reviews: int,
+    min_reviews: int,
+) -> BucketReport:
+    # Runs inside a pool process, every finished product is appended to the
+    # bucket's part file right away so a restart only redoes unfinished ones
+    report = BucketReport(bucket=bucket)
+    reviews = _read_bucket(work_dir, "reviews", bucket)
+    if reviews is None:
+        return report
+    metadata = _read_bucket(work_dir, "metadata", bucket)
+    part = _part_path(work_dir, bucket)
+    finished = _recover_part(part)
+    analyzer = get_product_analyzer(api_key)
+
+    with open(part, "a") as output:
+        products = iter_products(reviews, metadata, max_reviews, min_reviews)
+        for asin, data in products:
+            if asin in finished:
+                report.skipped += 1
+                continue
+            result = BulkResult(
+                asin=asin, product=str(data["product"]), reviews=len(data["comments"])
+            )
+            start = time.monotonic()
+            try:
+                result.analysis = analyzer.analyze_product(data)
+                report.done += 1
+            except Exception as e:
+                result.status = "failed"
+                result.error = str(e) or type(e).__name__
+                report.failed += 1
+            result.analysis_seconds = time.monotonic() - start
+            output.write(json.dumps(asdict(result)) + "\n")
+            output.flush()
+    return report
+
+
+class BulkEngine:
+    def __init__(
+        self,
+        work_dir: Path = settings.BULK_WORK_DIR,
+        workers: int = settings.BULK_WORKERS,
+        buckets: int = settings.BULK_BUCKETS,
+        max_reviews: int = 100,
+        min_reviews: int = 1,
+    ) -> None:
+        self.work_dir = Path(work_dir)
+        self.workers = max(1, workers)
+        self.buckets = max(1, buckets)
+        self.max_reviews = max_reviews
+        self.min_reviews = min_reviews
+
+    def run(
+        self,
+        reviews_path: Path,
+        metadata_path: Path | None,
+        output_path: Path,
+        api_key: str,
+    ) -> BucketReport:
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        checkpoint = self._prepare(reviews_path, metadata_path)
+        pending = [b for b in range(self.buckets) if b not in checkpoint["done"]]
+        LOGGER.info(
+            f"{len(pending)}/{self.buckets} buckets left, {self.workers} workers"
+        )
+
+        total = BucketReport(bucket=-1)
+        # Each process has its own LLM scheduler, they split the key quotas
+        workers = max(1, min(self.workers, len(pending)))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=share_llm_quota,
+            initargs=(workers,),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    analyze_bucket,
+                    self.work_dir,
+                    bucket,
+                    api_key,
+                    self.max_reviews,
+                    self.min_reviews,
+                )
+                for bucket in pending
+            }
+            while futures:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    report = future.result()
+                    total.done += report.done
+                    total.failed += report.failed
+                    total.skipped += report.skipped
+                    checkpoint["done"].append(report.bucket)
+                    self._save_checkpoint(checkpoint)
+                    LOGGER.info(
+                        f"[{len(checkpoint['done'])}/{self.buckets}] bucket "
+                        f"{report.bucket}: {report.done} done, {report.failed} failed"
+                    )
+
+        self._merge(output_path)
+        LOGGER.info(
+            f"Bulk analysis finished: {total.done} done, {total.failed} failed, "
+            f"{total.skipped} resumed from checkpoint"
+        )
+        return total
+
+    def _prepare(self, reviews_path: Path, metadata_path: Path | None) -> dict:
+        sources = {
+            "reviews": _source_id(reviews_path),
+            "metadata": _source_id(metadata_path) if metadata_path else None,
+            "buckets": self.buckets,
+        }
+        checkpoint = self._load_checkpoint()
+        if checkpoint and checkpoint["sources"] == sources:
+            LOGGER.info(f"Resuming from {self.work_dir / CHECKPOINT_FILE}")
+            return checkpoint
+
+        # Different input, start over without stale spill or part files
+        for path in self.work_dir.glob("*-[0-9][0-9][0-9][0-9].*"):
+            path.unlink()
+        start = time.monotonic()
+        rows = partition(
+            reviews_path, self.work_dir, "reviews", REVIEW_COLUMNS, self.buckets
+        )
+        if metadata_path:
+            partition(
+                metadata_path, self.work_dir, "metadata", METADATA_COLUMNS, self.buckets
+            )
+        LOGGER.info(
+            f"Partitioned {rows} reviews into {self.buckets} buckets "
+            f"in {time.monotonic() - start:.1f}s"
+        )
+        checkpoint = {"sources": sources, "done": []}
+        self._save_checkpoint(checkpoint)
+        return checkpoint
+
+    def _load_checkpoint(self) -> dict | None:
+        try:
+            with open(self.work_dir / CHECKPOINT_FILE) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _save_checkpoint(self, checkpoint: dict) -> None:
+        path = self.work_dir / CHECKPOINT_FILE
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, path)
+
+    def _merge(self, output_path: Path) -> None:
+        with open(output_path, "w") as output:
+            for bucket in range(self.buckets):
+                part = _part_path(self.work_dir, bucket)
+                if part.exists():
+                    with open(part) as f:
+                        output.writelines(f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Analyze every product of an Amazon-Reviews-2023 category dump."
+    )
+    parser.add_argument("reviews", type=Path, help="review_<CATEGORY>.parquet")
+    parser.add_argument(
+        "-m", "--metadata", type=Path, help="metadata_<CATEGORY>.parquet"
+    )
+    parser.add_argument("-o", "--output", type=Path, default=Path("bulk_results.jsonl"))
+    parser.add_argument("--work-dir", type=Path, default=settings.BULK_WORK_DIR)
+    parser.add_argument("--workers", type=int, default=settings.BULK_WORKERS)
+    parser.add_argument("--buckets", type=int, default=settings.BULK_BUCKETS)
+    parser.add_argument(
+        "--max-reviews",
+        type=int,
+        default=100,
+        help="Most helpful reviews analysed per product, 0 for all",
+    )
+    parser.add_argument("--min-reviews", type=int, default=1)
+    args = parser.parse_args()
+
+    setup_logging()
+    engine = BulkEngine(
+        work_dir=args.work_dir,
+        workers=args.workers,
+        buckets=args.buckets,
+        max_reviews=args.max_reviews,
+        min_reviews=args.min_reviews,
+    )
+    report = engine.run(
+        args.reviews,
+        args.metadata,
+        args.output,
+        os.getenv("GOOGLE_API_KEY", settings.GOOGLE_API_KEY),
+    )
+    if report.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.config import settings
+
+LOGGER = logging.getLogger("llm")
+
+
+def make_cache_key(prompt: str, model: str, temperature: float) -> str:
+    payload = f"{model}\0{temperature!r}\0{prompt}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class AnalysisCache:
+    def __init__(
+        self,
+        path: Path = settings.ANALYSIS_CACHE_PATH,
+        ttl: float = settings.ANALYSIS_CACHE_TTL,
+        max_entries: int = settings.ANALYSIS_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS analyses_accessed_at"
+                " ON analyses (accessed_at)"
+            )
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT value, created_at FROM analyses WHERE key = ?",
+                        (key,),
+                    ).fetchone()
+                    if row and self.ttl > 0 and row[1] < now - self.ttl:
+                        conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                        row = None
+                    if row:
+                        conn.execute(
+                            "UPDATE analyses SET accessed_at = ? WHERE key = ?",
+                            (now, key),
+                        )
+            except sqlite3.Error as e:
+                LOGGER.warning(f"Analysis cache read failed: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                # Least recently used entries go first once the cache is full
+                conn.execute(
+                    "DELETE FROM analyses WHERE key IN ("
+                    " SELECT key FROM analyses ORDER BY accessed_at DESC"
+                    " LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            LOGGER.warning(f"Analysis cache write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM analyses")
+
+
+analysis_cache = AnalysisCache()
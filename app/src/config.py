@@ -1,5 +1,6 @@
 import os
 from dataclasses import dataclass
+from functools import cache
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -8,21 +9,175 @@ from webdriver_manager.chrome import ChromeDriverManager
 load_dotenv()
 
 
+@cache
+def _install_chrome_driver() -> str:
+    # Resolved on first browser launch only, once per process
+    return ChromeDriverManager().install()
+
+
 @dataclass
 class Config:
     DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1")
     # Do not set HEADFUL_BROWSER to true in containers
     HEADFUL_BROWSER = os.getenv("HEADFUL_BROWSER", "False").lower() in ("true", "1")
 
-    CHROME_DRIVER_PATH = ChromeDriverManager().install()
+    # Pin a local chromedriver to skip the online version check
+    CHROME_DRIVER_PATH = os.getenv("CHROME_DRIVER_PATH", "")
     TEMPLATE_PATH = Path("src/templates.yaml")
     CSS_PATH = Path("src/style.css")
 
+    # Warm browser pool shared by all sessions of the process
+    POOL_SIZE = int(os.getenv("POOL_SIZE", "2"))
+    POOL_CHECKOUT_TIMEOUT = float(os.getenv("POOL_CHECKOUT_TIMEOUT", "60"))
+    POOL_IDLE_TIMEOUT = float(os.getenv("POOL_IDLE_TIMEOUT", "900"))
+    DEBUGGING_PORT_BASE = int(os.getenv("DEBUGGING_PORT_BASE", "9222"))
+
+    # Cookies and local storage of logged-in accounts, reused across restarts
+    SESSION_STORE_DIR = Path(os.getenv("SESSION_STORE_DIR", ".sessions"))
+
+    # "selenium" drives the browser through review pages, "http" only borrows
+    # its cookies and downloads the pages directly
+    FETCH_BACKEND = os.getenv("FETCH_BACKEND", "selenium").lower()
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+    # Review pages requested at once by the http backend, 1 keeps them sequential
+    REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", "4"))
+    # Requests per second towards a single host and with a single account.
+    # Rates start at *_RATE_LIMIT, grow by RATE_INCREASE with every healthy
+    # response up to *_RATE_MAX and halve on captcha, 503 or robot checks,
+    # which also pause the requests for an exponentially growing backoff.
+    HOST_RATE_LIMIT = float(os.getenv("HOST_RATE_LIMIT", "2"))
+    HOST_RATE_MAX = float(os.getenv("HOST_RATE_MAX", "8"))
+    HOST_RATE_BURST = float(os.getenv("HOST_RATE_BURST", "4"))
+    ACCOUNT_RATE_LIMIT = float(os.getenv("ACCOUNT_RATE_LIMIT", "1"))
+    ACCOUNT_RATE_MAX = float(os.getenv("ACCOUNT_RATE_MAX", "4"))
+    RATE_MIN = float(os.getenv("RATE_MIN", "0.05"))
+    RATE_INCREASE = float(os.getenv("RATE_INCREASE", "0.1"))
+    THROTTLE_BACKOFF = float(os.getenv("THROTTLE_BACKOFF", "5"))
+    THROTTLE_BACKOFF_MAX = float(os.getenv("THROTTLE_BACKOFF_MAX", "300"))
+    THROTTLE_RETRIES = int(os.getenv("THROTTLE_RETRIES", "2"))
+    # Selenium waits for elements and page loads, not fixed sleeps
+    IMPLICIT_WAIT = float(os.getenv("IMPLICIT_WAIT", "2"))
+    PAGE_LOAD_TIMEOUT = float(os.getenv("PAGE_LOAD_TIMEOUT", "15"))
+    # Read details and first-page reviews from one load with one script call
+    SINGLE_PASS_EXTRACTION = os.getenv("SINGLE_PASS_EXTRACTION", "True").lower() in (
+        "true",
+        "1",
+    )
+    # Lean profile: images, fonts, media and ad/tracker hosts are blocked
+    # through DevTools, see src/lean.py
+    LEAN_BROWSER = os.getenv("LEAN_BROWSER", "False").lower() in ("true", "1")
+    BLOCKED_RESOURCES = tuple(
+        filter(None, os.getenv("BLOCKED_RESOURCES", "image,font,media").split(","))
+    )
+    BLOCKED_HOSTS = tuple(
+        filter(
+            None,
+            os.getenv(
+                "BLOCKED_HOSTS",
+                "amazon-adsystem.com,doubleclick.net,googlesyndication.com,"
+                "google-analytics.com,fls-na.amazon.com,unagi.amazon.com,"
+                "unagi-na.amazon.com",
+            ).split(","),
+        )
+    )
+
+    # Directory of recorded product and review pages, when set they are served
+    # instead of amazon.com, see src/sources.py
+    FIXTURE_DIR = os.getenv("FIXTURE_DIR", "")
+
+    # Scraped products keyed by ASIN, refreshed with only the newest reviews
+    PRODUCT_STORE = os.getenv("PRODUCT_STORE", "True").lower() in ("true", "1")
+    PRODUCT_STORE_PATH = Path(os.getenv("PRODUCT_STORE_PATH", ".cache/products.db"))
+    PRODUCT_STORE_TTL = float(os.getenv("PRODUCT_STORE_TTL", str(6 * 3600)))
+
+    # Review selection before prompting, token counts are estimates
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+    MAX_REVIEW_CHARS = int(os.getenv("MAX_REVIEW_CHARS", "2000"))
+    DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+
+    # Local sentiment and aspect scoring, only critical reviews reach the prompt
+    LOCAL_SCORING = os.getenv("LOCAL_SCORING", "True").lower() in ("true", "1")
+    MAX_ASPECTS = int(os.getenv("MAX_ASPECTS", "12"))
+
+    # "single" sends one prompt, "map_reduce" summarises chunks of reviews first,
+    # "auto" switches to map-reduce when the reviews exceed the token budget
+    ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto").lower()
+    MAP_CHUNK_SIZE = int(os.getenv("MAP_CHUNK_SIZE", "50"))
+    MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "4"))
+    # Jobs analyse reviews while the remaining pages are still being fetched
+    STREAM_REVIEWS = os.getenv("STREAM_REVIEWS", "False").lower() in ("true", "1")
+
+    # Background analyses started from the UI, kept for JOB_TTL seconds
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+
+    # Offline analysis of parquet review dumps, see src/bulk.py
+    BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))
+    BULK_BUCKETS = int(os.getenv("BULK_BUCKETS", "64"))
+    BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "10000"))
+    BULK_WORK_DIR = Path(os.getenv("BULK_WORK_DIR", ".cache/bulk"))
+
+    LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash-8b")
+    LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+    # Every Gemini call goes through src/llm_scheduler.py. Quotas are per API
+    # key, the defaults are the free tier of gemini-1.5-flash-8b.
+    GOOGLE_API_KEYS = tuple(filter(None, os.getenv("GOOGLE_API_KEYS", "").split(",")))
+    LLM_RPM = float(os.getenv("LLM_RPM", "15"))
+    LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))
+    LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+    LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+    LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "2"))
+    LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    # Base url of a Gemini compatible server, e.g. benchmarks/fake_gemini.py
+    LLM_ENDPOINT = os.getenv("LLM_ENDPOINT", "")
+
+    # Finished analyses keyed by the rendered prompt, model and temperature
+    ANALYSIS_CACHE = os.getenv("ANALYSIS_CACHE", "True").lower() in ("true", "1")
+    ANALYSIS_CACHE_PATH = Path(os.getenv("ANALYSIS_CACHE_PATH", ".cache/analyses.db"))
+    ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", str(24 * 3600)))
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1000"))
+
+    # Key issues and critical reviews of every finished analysis, see issues.py
+    ISSUE_INDEX = os.getenv("ISSUE_INDEX", "True").lower() in ("true", "1")
+    ISSUE_INDEX_PATH = Path(os.getenv("ISSUE_INDEX_PATH", ".cache/issues.db"))
+    ISSUE_INDEX_REVIEWS = int(os.getenv("ISSUE_INDEX_REVIEWS", "50"))
+    ISSUE_CLUSTER_THRESHOLD = float(os.getenv("ISSUE_CLUSTER_THRESHOLD", "0.45"))
+
+    # REST API next to the Streamlit UI, see runapi.py
+    API_HOST = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_MAX_URLS = int(os.getenv("API_MAX_URLS", "100"))
+    API_MAX_PAGES = int(os.getenv("API_MAX_PAGES", "20"))
+    # Bearer token every request but /health must send, the API refuses
+    # everything while it is empty
+    API_TOKEN = os.getenv("API_TOKEN", "")
+    # Prefix the API is served under by a proxy, e.g. /api behind nginx
+    API_ROOT_PATH = os.getenv("API_ROOT_PATH", "")
+    # Amazon account and Gemini key the API scrapes and analyses with. Read in
+    # production too, where EMAIL, PASSWORD and GOOGLE_API_KEY stay empty;
+    # with DEBUG=true the API falls back to those.
+    API_EMAIL = os.getenv("API_EMAIL", "")
+    API_PASSWORD = os.getenv("API_PASSWORD", "")
+    API_GOOGLE_API_KEY = os.getenv("API_GOOGLE_API_KEY", "")
+
+    # Spans and counters, served in the Prometheus text format on /metrics
+    METRICS = os.getenv("METRICS", "False").lower() in ("true", "1")
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+    # "text" or "json", one object per line with the span fields of traced stages
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
     EMAIL = ""
     PASSWORD = ""
 
     GOOGLE_API_KEY = ""
 
+    @property
+    def chrome_driver_path(self) -> str:
+        return self.CHROME_DRIVER_PATH or _install_chrome_driver()
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -1,33 +1,79 @@
 import logging
-import random
-import re
-import time
+from typing import Any, Callable, Iterator
 
 import undetected_chromedriver as uc  # type: ignore
-from selenium.common.exceptions import NoSuchElementException, WebDriverException
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
 from src.config import settings
+from src.http_fetcher import (
+    REVIEWS_SORT,
+    REVIEWS_URL,
+    HttpReviewFetcher,
+    ProgressCallback,
+)
+from src.lean import configure_lean_options, enable_blocking, report_page_weight
+from src.metrics import CACHE_REQUESTS, COMMENTS_FETCHED, PAGES_FETCHED, span
+from src.parsing import (
+    NEXT_PAGE_XPATH,
+    PRODUCT_PAGE_SCRIPT,
+    PRODUCT_PAGE_SCRIPT_ARGS,
+    REVIEW_TEXT_XPATH,
+    REVIEWS_LINK_XPATH,
+    REVIEWS_PER_PAGE,
+    Review,
+    build_product_data,
+    build_product_details,
+    extract_asin,
+    is_throttled_page,
+    parse_review_records,
+)
+from src.ratelimit import scheduler
+from src.sessions import SessionStore
+from src.store import product_store, split_new_comments
 
 LOGGER = logging.getLogger("fetcher")
 
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
+)
+
+
+AMAZON_HOST = "www.amazon.com"
+
 
 class ScrapingError(Exception):
     pass
 
 
+class ThrottledError(ScrapingError):
+    pass
+
+
 class AmazonScraper:
-    def __init__(self, email: str, password: str) -> None:
+    def __init__(self, email: str, password: str, debugging_port: int = 9222) -> None:
         self.email: str = email
         self.password: str = password
+        self.debugging_port: int = debugging_port
+
+        self.session_store = SessionStore()
 
         self.chrome_options = Options()
         self._config_chrome()
 
         self.driver: WebDriver
+        self.http_fetcher: HttpReviewFetcher | None = None
 
     def _config_chrome(self) -> None:
         if not settings.HEADFUL_BROWSER:
@@ -41,25 +87,54 @@ class AmazonScraper:
         self.chrome_options.add_argument("--disable-extensions")
         self.chrome_options.add_argument("--disable-gpu")
         self.chrome_options.add_argument("--disable-dev-shm-usage")
-        self.chrome_options.add_argument("--remote-debugging-port=9222")
         self.chrome_options.add_argument(
-            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
+            f"--remote-debugging-port={self.debugging_port}"
         )
+        self.chrome_options.add_argument(f"user-agent={USER_AGENT}")
+        if settings.LEAN_BROWSER:
+            configure_lean_options(self.chrome_options)
 
-    def _random_wait(
-        self, min_time: float = 0.5, max_time: float = 2, explicit: bool = False
+    def _load(
+        self, navigate: Callable[[], None], marker: WebElement | None = None
     ) -> None:
-        wait_time: float = random.uniform(min_time, max_time)
-        if explicit:
-            time.sleep(wait_time)
-        else:
-            self.driver.implicitly_wait(wait_time)
+        # Every page load waits for its turn with the scheduler. Throttled
+        # pages are reloaded after the backoff, up to THROTTLE_RETRIES times.
+        # Clicks pass an element of the current page, the load is complete
+        # once it has been replaced.
+        for attempt in range(settings.THROTTLE_RETRIES + 1):
+            scheduler.acquire(AMAZON_HOST, self.email)
+            if attempt:
+                self.driver.refresh()
+            else:
+                navigate()
+                if marker is not None:
+                    self._wait_until_stale(marker)
+            if settings.LEAN_BROWSER:
+                report_page_weight(self.driver, self.driver.current_url)
+            throttled = is_throttled_page(self.driver.page_source)
+            scheduler.report(AMAZON_HOST, self.email, throttled=throttled)
+            if not throttled:
+                return
+            LOGGER.warning("Throttled by Amazon, backing off.")
+        raise ThrottledError("Amazon keeps serving robot checks.")
+
+    def _click(self, element: WebElement, marker: WebElement | None = None) -> None:
+        marker = marker or self.driver.find_element(By.TAG_NAME, "html")
+        self._load(element.click, marker)
+
+    def _wait_until_stale(self, marker: WebElement) -> None:
+        try:
+            WebDriverWait(self.driver, settings.PAGE_LOAD_TIMEOUT).until(
+                EC.staleness_of(marker)
+            )
+        except TimeoutException:
+            LOGGER.warning("Page did not change after the click.")
 
     def open_connection(self) -> None:
         self.close_connection()
         try:
-            self._open_connection()
+            with span("open_connection", port=self.debugging_port):
+                self._open_connection()
         except WebDriverException as e:
             LOGGER.error(f"Error during login: {e}")
             self.close_connection()
@@ -67,12 +142,16 @@ class AmazonScraper:
 
     def _open_connection(self) -> None:
         self.driver = uc.Chrome(
-            service=Service(settings.CHROME_DRIVER_PATH), options=self.chrome_options
+            service=Service(settings.chrome_driver_path), options=self.chrome_options
         )
         self.driver.maximize_window()
-        self.driver.get("https://www.amazon.com")
-        self._random_wait()
-        self._random_wait(min_time=2, max_time=4, explicit=True)
+        self.driver.implicitly_wait(settings.IMPLICIT_WAIT)
+        if settings.LEAN_BROWSER:
+            enable_blocking(self.driver)
+        self._load(lambda: self.driver.get(f"https://{AMAZON_HOST}"))
+        if self._restore_session():
+            LOGGER.info("Logged in with stored session!")
+            return
 
         navigated = False
         while not navigated:
@@ -84,54 +163,169 @@ class AmazonScraper:
             email_element.clear()
             email_element.send_keys(self.email)
             continue_button = self.driver.find_element(By.ID, "continue")
-            continue_button.click()
+            self._click(continue_button)
             navigated = True
-            self._random_wait()
 
         password_element = self.driver.find_element(By.ID, "ap_password")
         password_element.clear()
         password_element.send_keys(self.password)
         sign_in_button = self.driver.find_element(By.ID, "signInSubmit")
-        sign_in_button.click()
-        self._random_wait(explicit=True)
+        self._click(sign_in_button)
 
+        if not self._is_logged_in():
+            raise Exception("Login failed. Could not find logged-in element.")
+        LOGGER.info("Logged in successfully!")
+        self._save_session()
+
+    def _is_logged_in(self) -> bool:
         try:
-            self.driver.find_element(By.ID, "nav-link-accountList-nav-line-1")
-            LOGGER.info("Logged in successfully!")
+            account_el = self.driver.find_element(
+                By.ID, "nav-link-accountList-nav-line-1"
+            )
         except NoSuchElementException:
-            raise Exception("Login failed. Could not find logged-in element.")
+            return False
+        # Logged out visitors see "Hello, sign in" in the same element
+        return not account_el.text.strip().lower().endswith("sign in")
+
+    def _restore_session(self) -> bool:
+        state = self.session_store.load(self.email)
+        if not state:
+            return False
+        for cookie in state["cookies"]:
+            try:
+                self.driver.add_cookie(cookie)
+            except WebDriverException as e:
+                LOGGER.debug(f"Skipping stored cookie {cookie.get('name')}: {e}")
+        self.driver.execute_script(
+            "for (const [k, v] of Object.entries(arguments[0])) {"
+            " window.localStorage.setItem(k, v); }",
+            state.get("local_storage", {}),
+        )
+        self._load(self.driver.refresh)
+        if self._is_logged_in():
+            return True
+        LOGGER.info("Stored session expired, logging in with credentials.")
+        self.session_store.clear(self.email)
+        self.driver.delete_all_cookies()
+        self._load(self.driver.refresh)
+        return False
+
+    def _save_session(self) -> None:
+        try:
+            local_storage = self.driver.execute_script(
+                "return Object.assign({}, window.localStorage);"
+            )
+            self.session_store.save(
+                self.email, self.driver.get_cookies(), local_storage or {}
+            )
+        except (WebDriverException, OSError) as e:
+            LOGGER.warning(f"Could not store session: {e}")
 
     def _navigate_sign_in(self) -> None:
         sign_in_element = self.driver.find_element(
             By.CSS_SELECTOR, 'a[data-nav-role="signin"]'
         )
-        sign_in_element.click()
-        self._random_wait(explicit=True)
+        self._click(sign_in_element)
+
+    def is_alive(self) -> bool:
+        if not (driver := getattr(self, "driver", None)):
+            return False
+        try:
+            driver.current_url
+        except WebDriverException:
+            return False
+        return True
 
     def close_connection(self) -> None:
+        if http_fetcher := getattr(self, "http_fetcher", None):
+            http_fetcher.close()
         if driver := getattr(self, "driver", None):
             driver.quit()
 
     def fetch_product_data(
-        self, product_url: str, max_review_pages: int
+        self,
+        product_url: str,
+        max_review_pages: int,
+        progress: ProgressCallback | None = None,
     ) -> dict[str, str | float | list[str]]:
+        asin = extract_asin(product_url)
         product_url = self._cleanse_url(product_url)
-        details = self.fetch_product_details(product_url)
-        comments = self.fetch_product_comments(product_url, max_review_pages)
-        return {
-            "product": details.get("product", ""),
-            "price": details.get("price", ""),
-            "category": details.get("category", ""),
-            "rating": details.get("rating", -1.0),
-            "url": product_url,
-            "comments": comments,
-        }
+        with span("fetch_product_data", asin=asin, backend=settings.FETCH_BACKEND):
+            return self._fetch_product_data(
+                asin, product_url, max_review_pages, progress
+            )
+
+    def _fetch_product_data(
+        self,
+        asin: str | None,
+        product_url: str,
+        max_review_pages: int,
+        progress: ProgressCallback | None,
+    ) -> dict[str, str | float | list[str]]:
+        stored = product_store.get(asin) if asin and settings.PRODUCT_STORE else None
+        limit = max_review_pages * REVIEWS_PER_PAGE
+        if (
+            stored
+            and stored.covers(max_review_pages)
+            and stored.is_fresh(settings.PRODUCT_STORE_TTL)
+        ):
+            CACHE_REQUESTS.inc(cache="product_store", result="hit")
+            LOGGER.info(f"Using stored data for {asin}.")
+            comments = stored.data["comments"][:limit]
+            if progress:
+                progress(max_review_pages, len(comments))
+            return {**stored.data, "comments": comments}
+
+        if settings.PRODUCT_STORE:
+            result = "stale" if stored else "miss"
+            CACHE_REQUESTS.inc(cache="product_store", result=result)
+        # New comments only reach back to the newest stored one, a store with
+        # fewer pages than requested is fetched again in full
+        refresh = stored if stored and stored.covers(max_review_pages) else None
+        pages = max_review_pages
+        fetcher: AmazonScraper | HttpReviewFetcher = self
+        if settings.FETCH_BACKEND == "http":
+            fetcher = self._get_http_fetcher()
+        if fetcher is self and not refresh and settings.SINGLE_PASS_EXTRACTION:
+            details, comments = self._fetch_product_page(
+                product_url, max_review_pages, progress
+            )
+        elif refresh:
+            details = fetcher.fetch_product_details(product_url)
+            comments = fetcher.fetch_new_comments(
+                product_url,
+                max_review_pages,
+                known=set(refresh.data["comments"]),
+                progress=progress,
+            )
+            # Capped at the pages stored before, the oldest comments drop out
+            pages = refresh.pages
+            comments = (comments + refresh.data["comments"])[: pages * REVIEWS_PER_PAGE]
+            details = {**refresh.data, **details}
+        else:
+            details = fetcher.fetch_product_details(product_url)
+            comments = fetcher.fetch_product_comments(
+                product_url, max_review_pages, progress=progress
+            )
+        data = build_product_data(details, product_url, comments)
+        if asin and settings.PRODUCT_STORE and (comments or details):
+            product_store.put(asin, data, pages)
+        return {**data, "comments": comments[:limit]}
+
+    def _get_http_fetcher(self) -> HttpReviewFetcher:
+        if not self.is_alive():
+            raise ScrapingError("Connection not opened. Call open_connection() first.")
+        if self.http_fetcher is None:
+            self.http_fetcher = HttpReviewFetcher(
+                user_agent=USER_AGENT, account=self.email
+            )
+        # Cookies may be refreshed by Amazon while the driver is in use
+        self.http_fetcher.update_cookies(self.driver.get_cookies())
+        return self.http_fetcher
 
     @staticmethod
     def _cleanse_url(url: str) -> str:
-        match = re.search(r"/dp/([A-Z0-9]{10})", url)
-        if match:
-            product_id = match.group(1)
+        if product_id := extract_asin(url):
             return f"https://www.amazon.com/dp/{product_id}"
         else:
             return "Invalid URL format"
@@ -139,85 +333,213 @@ class AmazonScraper:
     def fetch_product_details(self, product_url: str) -> dict[str, str | float]:
         if not self.driver:
             raise ScrapingError("Connection not opened. Call open_connection() first.")
-        details: dict[str, str | float] = {}
-        try:
-            self.driver.get(product_url)
-            self._random_wait()
-            product_el = self.driver.find_element(
-                By.XPATH, "//span[@id='productTitle']"
-            )
-            details["product"] = product_el.text.strip()
-            price_el = self.driver.find_element(
-                By.XPATH, "//div[@id='corePrice_feature_div']"
-            )
-            details["price"] = price_el.text.strip().replace("\n", ".")
-            LOGGER.info("-" + price_el.text.strip() + "-")
-            category_el = self.driver.find_element(
-                By.XPATH, "//div[@id='wayfinding-breadcrumbs_feature_div']//li[1]"
+        with span("fetch_product_details", backend="selenium"):
+            return self._fetch_product_details(product_url)
+
+    def _fetch_product_details(self, product_url: str) -> dict[str, str | float]:
+        self._load(lambda: self.driver.get(product_url))
+        page = self._read_page()
+        return build_product_details(
+            page["title"], page["price"], page["category"], page["rating"]
+        )
+
+    def _fetch_product_page(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> tuple[dict[str, str | float], list[str]]:
+        # Details and the reviews shown on the product page come from one load
+        # and one script call, the review pages are opened from there
+        with span("fetch_product_details", backend="selenium", single_pass=True):
+            self._load(lambda: self.driver.get(product_url))
+            page = self._read_page()
+            details = build_product_details(
+                page["title"], page["price"], page["category"], page["rating"]
             )
-            details["category"] = category_el.text.strip()
-            rating_el = self.driver.find_element(
-                By.XPATH,
-                "//div[@id='averageCustomerReviews_feature_div']"
-                "//span[contains(@class, 'a-size-base') and contains(@class, 'a-color-base')]",
+        comments = self._collect_reviews(max_pages, progress, page["reviews"])
+        return details, comments
+
+    def _read_page(self) -> dict[str, Any]:
+        try:
+            page = self.driver.execute_script(
+                PRODUCT_PAGE_SCRIPT, *PRODUCT_PAGE_SCRIPT_ARGS
             )
-            details["rating"] = float(rating_el.text.strip())
-        except NoSuchElementException as e:
-            LOGGER.error(f"Error fetching details: {e}")
-        return details
+        except WebDriverException as e:
+            LOGGER.error(f"Error reading page: {e}")
+            page = None
+        return page or {
+            "title": None,
+            "price": None,
+            "category": None,
+            "rating": None,
+            "reviews": [],
+            "has_next": False,
+        }
 
-    def fetch_product_comments(self, product_url: str, max_pages: int) -> list[str]:
+    def fetch_product_comments(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> list[str]:
         if not self.driver:
             raise ScrapingError("Connection not opened. Call open_connection() first.")
         try:
-            self.driver.get(product_url)
-            self._random_wait()
-            self._navigate_to_reviews()
+            self._load(lambda: self.driver.get(product_url))
+        except ThrottledError as e:
+            LOGGER.error(f"Error fetching comments: {e}")
+            return []
+        return self._collect_reviews(max_pages, progress)
+
+    def _collect_reviews(
+        self,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+        product_page_reviews: list[str] | None = None,
+    ) -> list[str]:
+        # Starts on the product page, which has no pagination of its own
+        comments: list[str] = []
+        try:
+            if not self._navigate_to_reviews() and product_page_reviews is not None:
+                comments = product_page_reviews
+                if progress:
+                    progress(1, len(comments))
+                return comments
             page_ix = 1
-            comments: list[str] = []
             has_next = True
             while has_next and page_ix <= max_pages:
-                page_comments = self._extract_single_page_reviews()
+                page_comments, has_next = self._extract_review_page()
                 comments.extend(page_comments)
                 LOGGER.info(
                     f"{len(page_comments)} comments fetched from page {page_ix}."
                 )
-                has_next = self._change_review_page()
+                if progress:
+                    progress(page_ix, len(comments))
+                has_next = has_next and page_ix < max_pages
+                has_next = has_next and self._change_review_page()
                 page_ix += 1
             LOGGER.info("No more pages of reviews.")
             return comments
         except NoSuchElementException as e:
             LOGGER.error(f"Error fetching comments: {e}")
             return []
+        except ThrottledError as e:
+            # Keep what was collected before Amazon started blocking
+            LOGGER.error(f"Stopped fetching comments: {e}")
+            return comments
 
-    def _navigate_to_reviews(self) -> None:
-        try:
-            reviews_tab = self.driver.find_element(
-                By.XPATH, "//a[contains(text(), 'See more reviews')]"
+    def stream_reviews(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> Iterator[list[Review]]:
+        if settings.FETCH_BACKEND == "http":
+            yield from self._get_http_fetcher().stream_reviews(
+                self._cleanse_url(product_url), max_pages, progress
             )
-            reviews_tab.click()
-            self._random_wait()
+            return
+        if not self.driver:
+            raise ScrapingError("Connection not opened. Call open_connection() first.")
+        fetched = 0
+        try:
+            # Right after fetch_product_details the product page is still open
+            if extract_asin(self.driver.current_url) != extract_asin(product_url):
+                self._load(lambda: self.driver.get(product_url))
+            if not self._navigate_to_reviews():
+                reviews, _ = parse_review_records(self.driver.page_source)
+                if progress:
+                    progress(1, len(reviews))
+                yield reviews
+                return
+            for page_ix in range(1, max_pages + 1):
+                with span("review_page", backend="selenium", page=page_ix) as current:
+                    reviews, has_next = parse_review_records(self.driver.page_source)
+                    current.set(comments=len(reviews))
+                PAGES_FETCHED.inc(backend="selenium")
+                COMMENTS_FETCHED.inc(len(reviews), backend="selenium")
+                fetched += len(reviews)
+                LOGGER.info(f"{len(reviews)} comments fetched from page {page_ix}.")
+                if progress:
+                    progress(page_ix, fetched)
+                yield reviews
+                if not has_next or page_ix == max_pages:
+                    break
+                if not self._change_review_page():
+                    break
+        except ThrottledError as e:
+            # The pages already yielded stay with the consumer
+            LOGGER.error(f"Stopped fetching comments: {e}")
+        LOGGER.info("No more pages of reviews.")
+
+    def fetch_new_comments(
+        self,
+        product_url: str,
+        max_pages: int,
+        known: set[str],
+        progress: ProgressCallback | None = None,
+    ) -> list[str]:
+        if not self.driver:
+            raise ScrapingError("Connection not opened. Call open_connection() first.")
+        asin = extract_asin(product_url)
+        if not asin:
+            raise ScrapingError(f"No ASIN in {product_url}")
+        comments: list[str] = []
+        try:
+            self._load_reviews(asin)
+            for page_ix in range(1, max_pages + 1):
+                page_comments, has_next = self._extract_review_page()
+                new_comments, reached_known = split_new_comments(page_comments, known)
+                comments.extend(new_comments)
+                if progress:
+                    progress(page_ix, len(comments))
+                if reached_known or page_ix == max_pages or not has_next:
+                    break
+                if not self._change_review_page():
+                    break
+        except (NoSuchElementException, ThrottledError) as e:
+            LOGGER.error(f"Error fetching comments: {e}")
+        LOGGER.info(f"{len(comments)} new comments fetched.")
+        return comments
+
+    def _navigate_to_reviews(self) -> bool:
+        try:
+            reviews_tab = self.driver.find_element(By.XPATH, REVIEWS_LINK_XPATH)
         except NoSuchElementException:
             LOGGER.warning(
                 "Could not find 'See all reviews' link. Falling back to product page comments."
             )
+            return False
+        # Opened sorted by date rather than through the link, which lists the
+        # top reviews, so a later refresh walks the same order
+        if asin := extract_asin(self.driver.current_url):
+            self._load_reviews(asin)
+        else:
+            self._click(reviews_tab)
+        return True
 
-    def _extract_single_page_reviews(self) -> list[str]:
-        self._random_wait(explicit=True)
-        comment_elements = self.driver.find_elements(
-            By.XPATH, "//span[contains(@class, 'review-text')]"
-        )
-        return [comm_el.text.strip() for comm_el in comment_elements]
+    def _load_reviews(self, asin: str) -> None:
+        reviews_url = REVIEWS_URL.format(asin=asin) + f"?sortBy={REVIEWS_SORT}"
+        self._load(lambda: self.driver.get(reviews_url))
+
+    def _extract_review_page(self) -> tuple[list[str], bool]:
+        with span("review_page", backend="selenium") as current:
+            page = self._read_page()
+            comments = page["reviews"]
+            current.set(comments=len(comments))
+        PAGES_FETCHED.inc(backend="selenium")
+        COMMENTS_FETCHED.inc(len(comments), backend="selenium")
+        return comments, page["has_next"]
 
     def _change_review_page(self) -> bool:
-        self._random_wait(explicit=True)
         try:
-            next_button = self.driver.find_element(
-                By.XPATH, "//ul[@class='a-pagination']//li[@class='a-last']/a"
-            )
-            next_button.click()
+            next_button = self.driver.find_element(By.XPATH, NEXT_PAGE_XPATH)
         except NoSuchElementException:
             return False
+        # The review list is swapped in place, so wait for a review to go stale
+        reviews = self.driver.find_elements(By.XPATH, REVIEW_TEXT_XPATH)
+        self._click(next_button, marker=reviews[0] if reviews else None)
         return True
 
     def __del__(self) -> None:
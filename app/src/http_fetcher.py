@@ -0,0 +1,281 @@
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.config import settings
+from src.metrics import COMMENTS_FETCHED, PAGES_FETCHED, span
+from src.parsing import (
+    Review,
+    extract_asin,
+    is_throttled_page,
+    parse_product_details,
+    parse_review_page,
+    parse_review_records,
+)
+from src.ratelimit import scheduler
+from src.store import split_new_comments
+
+LOGGER = logging.getLogger("fetcher")
+
+REVIEWS_URL = "https://www.amazon.com/product-reviews/{asin}/"
+# Full scrapes walk the same newest-first listing as refreshes, so stored
+# comments stay a prefix of it and new ones can be put in front
+REVIEWS_SORT = "recent"
+
+# Called with the number of review pages done and comments collected so far
+ProgressCallback = Callable[[int, int], None]
+
+T = TypeVar("T")
+
+
+class HttpFetchError(Exception):
+    pass
+
+
+class HttpReviewFetcher:
+    backend = "http"
+
+    def __init__(self, user_agent: str, account: str = "") -> None:
+        # Requests are paced per host and, when given, per account
+        self.account = account
+        self.session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.5, status_forcelist=(500, 502, 504))
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.HTTP_POOL_SIZE,
+            max_retries=retries,
+        )
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "User-Agent": user_agent,
+                "Accept": "text/html,application/xhtml+xml",
+                "Accept-Language": "en-US,en;q=0.9",
+            }
+        )
+
+    def update_cookies(self, cookies: list[dict[str, Any]]) -> None:
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+
+    def fetch_product_details(self, product_url: str) -> dict[str, str | float]:
+        try:
+            with span("fetch_product_details", backend=self.backend):
+                return parse_product_details(self._get(product_url))
+        except HttpFetchError as e:
+            LOGGER.error(f"Error fetching details: {e}")
+            return {}
+
+    def fetch_product_comments(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> list[str]:
+        if settings.REVIEW_CONCURRENCY > 1 and max_pages > 1:
+            return self._fetch_comments_concurrently(product_url, max_pages, progress)
+        comments: list[str] = []
+        page_ix = 1
+        has_next = True
+        while has_next and page_ix <= max_pages:
+            try:
+                page_comments, has_next = self.fetch_review_page(product_url, page_ix)
+            except HttpFetchError as e:
+                LOGGER.error(f"Error fetching comments: {e}")
+                break
+            comments.extend(page_comments)
+            LOGGER.info(f"{len(page_comments)} comments fetched from page {page_ix}.")
+            if progress:
+                progress(page_ix, len(comments))
+            has_next = has_next and bool(page_comments)
+            page_ix += 1
+        LOGGER.info("No more pages of reviews.")
+        return comments
+
+    def _fetch_comments_concurrently(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> list[str]:
+        concurrency = settings.REVIEW_CONCURRENCY
+        pages: dict[int, list[str]] = {}
+        # Lowered as soon as a page turns out to be the last one,
+        # pages past it that were already in flight are discarded
+        last_page = max_pages
+        next_ix = 1
+        in_flight: dict[Future, int] = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while in_flight or next_ix <= last_page:
+                while next_ix <= last_page and len(in_flight) < concurrency:
+                    # Keeps the pages inside the caller's trace
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        self.fetch_review_page,
+                        product_url,
+                        next_ix,
+                    )
+                    in_flight[future] = next_ix
+                    next_ix += 1
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_ix = in_flight.pop(future)
+                    try:
+                        page_comments, has_next = future.result()
+                    except HttpFetchError as e:
+                        LOGGER.error(f"Error fetching comments: {e}")
+                        page_comments, has_next = [], False
+                    pages[page_ix] = page_comments
+                    LOGGER.info(
+                        f"{len(page_comments)} comments fetched from page {page_ix}."
+                    )
+                    if not (page_comments and has_next):
+                        last_page = min(last_page, page_ix)
+                    if progress:
+                        progress(len(pages), sum(map(len, pages.values())))
+        LOGGER.info("No more pages of reviews.")
+        return [
+            comment
+            for page_ix in sorted(pages)
+            if page_ix <= last_page
+            for comment in pages[page_ix]
+        ]
+
+    def stream_reviews(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> Iterator[list[Review]]:
+        # Yields every page as soon as it is parsed, in page order. Up to
+        # REVIEW_CONCURRENCY pages are fetched ahead of the consumer.
+        concurrency = max(1, settings.REVIEW_CONCURRENCY)
+        fetched = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight: deque[Future] = deque()
+            next_ix = 1
+            try:
+                for page_ix in range(1, max_pages + 1):
+                    while next_ix <= max_pages and len(in_flight) < concurrency:
+                        in_flight.append(
+                            executor.submit(
+                                contextvars.copy_context().run,
+                                self.fetch_review_records,
+                                product_url,
+                                next_ix,
+                            )
+                        )
+                        next_ix += 1
+                    try:
+                        reviews, has_next = in_flight.popleft().result()
+                    except HttpFetchError as e:
+                        LOGGER.error(f"Error fetching comments: {e}")
+                        break
+                    fetched += len(reviews)
+                    LOGGER.info(f"{len(reviews)} comments fetched from page {page_ix}.")
+                    if progress:
+                        progress(page_ix, fetched)
+                    yield reviews
+                    if not (reviews and has_next):
+                        break
+            finally:
+                # Pages past the last one, or past where the consumer stopped
+                for future in in_flight:
+                    future.cancel()
+        LOGGER.info("No more pages of reviews.")
+
+    def fetch_new_comments(
+        self,
+        product_url: str,
+        max_pages: int,
+        known: set[str],
+        progress: ProgressCallback | None = None,
+    ) -> list[str]:
+        comments: list[str] = []
+        for page_ix in range(1, max_pages + 1):
+            try:
+                page_comments, has_next = self.fetch_review_page(product_url, page_ix)
+            except HttpFetchError as e:
+                LOGGER.error(f"Error fetching comments: {e}")
+                break
+            new_comments, reached_known = split_new_comments(page_comments, known)
+            comments.extend(new_comments)
+            if progress:
+                progress(page_ix, len(comments))
+            if reached_known or not (page_comments and has_next):
+                break
+        LOGGER.info(f"{len(comments)} new comments fetched.")
+        return comments
+
+    def fetch_review_page(
+        self, product_url: str, page_ix: int, sort_by: str | None = REVIEWS_SORT
+    ) -> tuple[list[str], bool]:
+        return self._fetch_review_page(product_url, page_ix, parse_review_page, sort_by)
+
+    def fetch_review_records(
+        self, product_url: str, page_ix: int, sort_by: str | None = REVIEWS_SORT
+    ) -> tuple[list[Review], bool]:
+        return self._fetch_review_page(
+            product_url, page_ix, parse_review_records, sort_by
+        )
+
+    def _fetch_review_page(
+        self,
+        product_url: str,
+        page_ix: int,
+        parse: Callable[[str], tuple[list[T], bool]],
+        sort_by: str | None = REVIEWS_SORT,
+    ) -> tuple[list[T], bool]:
+        asin = extract_asin(product_url)
+        if not asin:
+            raise HttpFetchError(f"No ASIN in {product_url}")
+        params: dict[str, Any] = {"reviewerType": "all_reviews", "pageNumber": page_ix}
+        if sort_by:
+            params["sortBy"] = sort_by
+        with span("review_page", backend=self.backend, page=page_ix) as current:
+            page = self._get(REVIEWS_URL.format(asin=asin), params)
+            comments, has_next = parse(page)
+            current.set(comments=len(comments))
+        PAGES_FETCHED.inc(backend=self.backend)
+        COMMENTS_FETCHED.inc(len(comments), backend=self.backend)
+        return comments, has_next
+
+    def _get(self, url: str, params: dict[str, Any] | None = None) -> str:
+        host = urlsplit(url).netloc
+        for _ in range(settings.THROTTLE_RETRIES + 1):
+            scheduler.acquire(host, self.account)
+            try:
+                response = self.session.get(
+                    url, params=params, timeout=settings.HTTP_TIMEOUT
+                )
+            except requests.RequestException as e:
+                raise HttpFetchError(f"Request to {url} failed: {e}")
+            throttled = response.status_code in (429, 503) or is_throttled_page(
+                response.text
+            )
+            scheduler.report(host, self.account, throttled=throttled)
+            if not throttled:
+                break
+            LOGGER.warning(f"Throttled by {host}, backing off.")
+        else:
+            raise HttpFetchError(f"Throttled by {host} for {response.url}")
+        try:
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise HttpFetchError(f"Request to {url} failed: {e}")
+        return response.text
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,540 @@
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer
+from sklearn.random_projection import SparseRandomProjection
+
+from src.config import settings
+from src.fetcher import extract_asin
+from src.logconf import setup_logging
+from src.metrics import span
+from src.scoring import CRITICAL_LABELS, score_sentiment
+
+LOGGER = logging.getLogger("issues")
+
+ISSUE, REVIEW = "issue", "review"
+N_FEATURES = 2**18
+DIMENSIONS = 256
+# Random hyperplane LSH, every table hashes a vector to LSH_BITS signs.
+# Lookups also probe the buckets one flipped sign away, so paraphrases at
+# a cosine of 0.5 are found almost always.
+LSH_TABLES = 16
+LSH_BITS = 8
+
+_WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+_MARKUP_RE = re.compile(r"[*_`]+|<br\s*/?>")
+_LIST_ITEM_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.+)$")
+
+
+def _normalize(text: str) -> str:
+    words = _WORD_RE.findall(text.lower())
+    return " ".join(word for word in words if word not in ENGLISH_STOP_WORDS)
+
+
+# Character n-grams within words match "drains" with "drain" and survive
+# typos. Hashed counts need no fitted vocabulary, so vectors stored months
+# apart stay comparable and nothing is refitted when products are added.
+_vectorizer = HashingVectorizer(
+    analyzer="char_wb",
+    ngram_range=(3, 5),
+    preprocessor=_normalize,
+    n_features=N_FEATURES,
+    alternate_sign=False,
+)
+# Fixed seed, vectors from earlier runs stay valid. Transposed once here,
+# SparseRandomProjection.transform would convert the matrix on every call.
+_projection = (
+    SparseRandomProjection(n_components=DIMENSIONS, random_state=7)
+    .fit(sparse.csr_matrix((1, N_FEATURES)))
+    .components_.T.tocsr()
+)
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    vectors = (_vectorizer.transform(texts) @ _projection).toarray()
+    vectors = vectors.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _strip_markup(text: str) -> str:
+    return _MARKUP_RE.sub("", text).strip(" :.-")
+
+
+def extract_issues(analysis: str) -> list[tuple[str, str]]:
+    # (key issue, improvement suggestion) from the table the prompts ask
+    # for, list items when the model answered without a table
+    issues: list[tuple[str, str]] = []
+    issue_column, suggestion_column = 0, 1
+    for line in analysis.splitlines():
+        if not line.strip().startswith("|"):
+            continue
+        cells = [_strip_markup(cell) for cell in line.strip().strip("|").split("|")]
+        headers = [cell.lower() for cell in cells]
+        if "key issue" in headers:
+            issue_column = headers.index("key issue")
+            suggestion_column = next(
+                (ix for ix, cell in enumerate(headers) if "suggestion" in cell),
+                issue_column + 1,
+            )
+            continue
+        if len(cells) <= issue_column or not cells[issue_column]:
+            continue
+        if set(cells[issue_column]) <= set("-: "):
+            continue
+        suggestion = cells[suggestion_column] if suggestion_column < len(cells) else ""
+        issues.append((cells[issue_column], suggestion))
+    if issues:
+        return issues
+    for line in analysis.splitlines():
+        if match := _LIST_ITEM_RE.match(line):
+            text = _strip_markup(match.group(1))
+            if text:
+                issues.append((text, ""))
+    return issues
+
+
+@dataclass
+class IssueHit:
+    asin: str
+    product: str
+    kind: str
+    text: str
+    detail: str
+    score: float
+
+
+@dataclass
+class IssueCluster:
+    label: str
+    hits: list[IssueHit] = field(default_factory=list)
+
+    @property
+    def asins(self) -> list[str]:
+        return sorted({hit.asin for hit in self.hits})
+
+
+class _HyperplaneLSH:
+    def __init__(self, seed: int = 11) -> None:
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((LSH_TABLES * LSH_BITS, DIMENSIONS)).astype(
+            np.float32
+        )
+        self._weights = 1 << np.arange(LSH_BITS)
+        self.tables: list[dict[int, list[int]]] = [{} for _ in range(LSH_TABLES)]
+
+    def hash(self, vectors: np.ndarray) -> np.ndarray:
+        bits = (vectors @ self.planes.T > 0).reshape(-1, LSH_TABLES, LSH_BITS)
+        return bits @ self._weights
+
+    def add(self, positions: Iterable[int], vectors: np.ndarray) -> None:
+        for position, keys in zip(positions, self.hash(vectors)):
+            for table, key in zip(self.tables, keys):
+                table.setdefault(int(key), []).append(position)
+
+    def candidates(self, vector: np.ndarray) -> set[int]:
+        keys = self.hash(vector[None, :])[0]
+        found: set[int] = set()
+        for table, key in zip(self.tables, keys.tolist()):
+            for probe in (key, *(key ^ flip for flip in self._weights.tolist())):
+                found.update(table.get(probe, ()))
+        return found
+
+
+# Key issues and critical reviews of every analysed product, kept in SQLite
+# with their vectors. Vectors and LSH tables are loaded into memory on first
+# use and grow with every add, nothing is ever rebuilt. The app, the API and
+# imports share the file, rows other processes wrote are picked up before
+# every query.
+class IssueIndex:
+    def __init__(self, path: Path = settings.ISSUE_INDEX_PATH) -> None:
+        self.path = Path(path)
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # data_version and the highest id of the last sync with the file
+        self._version: int | None = None
+        self._synced_id = 0
+        # Per position in memory, rows of replaced products stay but are dead
+        self._ids: list[int] = []
+        self._known_ids: set[int] = set()
+        self._asins: list[str] = []
+        self._kinds: list[str] = []
+        self._alive: list[bool] = []
+        self._chunks: list[np.ndarray] = []
+        self._matrix = np.empty((0, DIMENSIONS), dtype=np.float32)
+        self._positions: dict[str, list[int]] = {}
+        self._lsh = _HyperplaneLSH()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            table = self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'issues'"
+            ).fetchone()
+            with self._conn:
+                if table and "AUTOINCREMENT" not in table[0]:
+                    # Ids must never be reused, syncing relies on them growing
+                    self._conn.execute("DROP INDEX IF EXISTS issues_asin")
+                    self._conn.execute("ALTER TABLE issues RENAME TO issues_old")
+                    self._create_table()
+                    self._conn.execute("INSERT INTO issues SELECT * FROM issues_old")
+                    self._conn.execute("DROP TABLE issues_old")
+                else:
+                    self._create_table()
+        return self._conn
+
+    def _create_table(self) -> None:
+        assert self._conn is not None
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS issues ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " asin TEXT NOT NULL,"
+            " product TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " detail TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS issues_asin ON issues (asin)")
+
+    def _sync(self) -> None:
+        # data_version only changes with commits of other connections
+        conn = self._connect()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        with span("issue_index_sync") as current:
+            added = self._read_new_rows(conn)
+            count = conn.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
+            if count != sum(self._alive):
+                # Deleted elsewhere without a replacement, e.g. clear()
+                self._reset()
+                added = self._read_new_rows(conn)
+            current.set(added=added, entries=len(self._ids))
+        self._version = version
+        if added:
+            LOGGER.info(f"Issue index read {added} entries from {self.path}")
+
+    def _read_new_rows(self, conn: sqlite3.Connection) -> int:
+        rows = conn.execute(
+            "SELECT id, asin, kind, vector FROM issues WHERE id > ? ORDER BY id",
+            (self._synced_id,),
+        ).fetchall()
+        if rows:
+            self._synced_id = rows[-1][0]
+        # Own adds are in memory already
+        rows = [row for row in rows if row[0] not in self._known_ids]
+        if not rows:
+            return 0
+        # Products another process analysed again lose their older rows
+        replaced = sorted({row[1] for row in rows})
+        present: set[int] = set()
+        for start in range(0, len(replaced), 500):
+            chunk = replaced[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            present.update(
+                row_id
+                for (row_id,) in conn.execute(
+                    f"SELECT id FROM issues WHERE asin IN ({placeholders})", chunk
+                )
+            )
+        for asin in replaced:
+            for position in self._positions.pop(asin, []):
+                if self._ids[position] in present:
+                    self._positions.setdefault(asin, []).append(position)
+                else:
+                    self._alive[position] = False
+        self._append(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            np.vstack([np.frombuffer(row[3], dtype=np.float32) for row in rows]),
+        )
+        return len(rows)
+
+    def _append(
+        self, ids: list[int], asins: list[str], kinds: list[str], vectors: np.ndarray
+    ) -> None:
+        start = len(self._ids)
+        positions = range(start, start + len(ids))
+        for position, asin in zip(positions, asins):
+            self._positions.setdefault(asin, []).append(position)
+        self._ids.extend(ids)
+        self._known_ids.update(ids)
+        self._asins.extend(asins)
+        self._kinds.extend(kinds)
+        self._alive.extend([True] * len(ids))
+        self._chunks.append(vectors)
+        self._lsh.add(positions, vectors)
+
+    def _vectors(self) -> np.ndarray:
+        # Chunks are stacked lazily, adds stay cheap between queries
+        if len(self._matrix) != len(self._ids):
+            self._matrix = np.vstack([self._matrix, *self._chunks])
+            self._chunks = []
+        return self._matrix
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return sum(self._alive)
+
+    def add_product(
+        self,
+        asin: str,
+        product: str,
+        analysis: str = "",
+        reviews: list[str] | None = None,
+    ) -> int:
+        # Replaces everything indexed for the ASIN before
+        entries = [(ISSUE, text, detail) for text, detail in extract_issues(analysis)]
+        if reviews:
+            labels, _ = score_sentiment(reviews)
+            critical = [
+                review
+                for review, label in zip(reviews, labels)
+                if label in CRITICAL_LABELS
+            ]
+            entries.extend(
+                (REVIEW, review, "")
+                for review in critical[: settings.ISSUE_INDEX_REVIEWS]
+            )
+        with span("issue_index_add", asin=asin, entries=len(entries)):
+            vectors = embed([text for _, text, _ in entries]) if entries else None
+            now = time.time()
+            with self._lock:
+                self._sync()
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM issues WHERE asin = ?", (asin,))
+                    ids = [
+                        conn.execute(
+                            "INSERT INTO issues"
+                            " (asin, product, kind, text, detail, vector, created_at)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (asin, product, kind, text, detail, vector.tobytes(), now),
+                        ).lastrowid
+                        for (kind, text, detail), vector in zip(
+                            entries, vectors if vectors is not None else []
+                        )
+                    ]
+                for position in self._positions.pop(asin, []):
+                    self._alive[position] = False
+                if ids:
+                    self._append(
+                        ids, [asin] * len(ids), [e[0] for e in entries], vectors
+                    )
+        LOGGER.info(f"Indexed {len(entries)} issues and reviews of {asin}")
+        return len(entries)
+
+    def _hits(self, positions: list[int], scores: list[float]) -> list[IssueHit]:
+        ids = [self._ids[position] for position in positions]
+        rows: dict[int, tuple[str, ...]] = {}
+        # Chunked, big clusters would exceed SQLite's limit on parameters
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row in self._connect().execute(
+                "SELECT id, asin, product, kind, text, detail FROM issues"
+                f" WHERE id IN ({placeholders})",
+                chunk,
+            ):
+                rows[row[0]] = row[1:]
+        return [
+            IssueHit(*rows[row_id], score=round(float(score), 4))
+            for row_id, score in zip(ids, scores)
+            if row_id in rows
+        ]
+
+    def _candidates(self, vector: np.ndarray, kind: str | None) -> np.ndarray:
+        return np.array(
+            [
+                position
+                for position in self._lsh.candidates(vector)
+                if self._alive[position]
+                and (kind is None or self._kinds[position] == kind)
+            ],
+            dtype=np.int64,
+        )
+
+    def search(
+        self, query: str, k: int = 10, kind: str | None = None
+    ) -> list[IssueHit]:
+        vector = embed([query])[0]
+        with span("issue_index_search", k=k) as current, self._lock:
+            self._sync()
+            matrix = self._vectors()
+            candidates = self._candidates(vector, kind)
+            if len(candidates) < k:
+                # Too few collisions, every entry is scored instead
+                candidates = np.array(
+                    [
+                        position
+                        for position, alive in enumerate(self._alive)
+                        if alive and (kind is None or self._kinds[position] == kind)
+                    ],
+                    dtype=np.int64,
+                )
+            current.set(candidates=len(candidates))
+            if not len(candidates):
+                return []
+            scores = matrix[candidates] @ vector
+            best = np.argsort(-scores)[:k]
+            return self._hits(candidates[best].tolist(), scores[best].tolist())
+
+    def clusters(
+        self,
+        threshold: float = settings.ISSUE_CLUSTER_THRESHOLD,
+        min_products: int = 2,
+        kind: str = ISSUE,
+    ) -> list[IssueCluster]:
+        # Greedy cover: the issue with the most entries within `threshold`
+        # leads a cluster of its neighbours not taken yet, then the next one.
+        # Unlike single linkage, members never chain away from the label.
+        with span("issue_index_cluster") as current, self._lock:
+            self._sync()
+            matrix = self._vectors()
+            members = [
+                position
+                for position, alive in enumerate(self._alive)
+                if alive and self._kinds[position] == kind
+            ]
+            if not members:
+                return []
+            # The same issue worded the same way is compared once
+            unique, inverse, counts = np.unique(
+                matrix[members], axis=0, return_inverse=True, return_counts=True
+            )
+            inverse = inverse.reshape(-1)
+            unique_of = np.full(len(self._ids), -1, dtype=np.int64)
+            unique_of[members] = inverse
+            neighbours = []
+            for vector in unique:
+                others = np.unique(unique_of[self._candidates(vector, kind)])
+                neighbours.append(others[unique[others] @ vector >= threshold])
+            density = np.array([counts[others].sum() for others in neighbours])
+
+            leaders = np.full(len(unique), -1, dtype=np.int64)
+            for node in np.argsort(-density, kind="stable").tolist():
+                if leaders[node] < 0:
+                    others = neighbours[node]
+                    leaders[others[leaders[others] < 0]] = node
+            groups: dict[int, list[int]] = {}
+            for position, node in zip(members, inverse.tolist()):
+                groups.setdefault(int(leaders[node]), []).append(position)
+            groups = {
+                leader: group
+                for leader, group in groups.items()
+                if len({self._asins[position] for position in group}) >= min_products
+            }
+            current.set(entries=len(members), clusters=len(groups))
+
+            clusters = []
+            for leader, group in groups.items():
+                scores = matrix[group] @ unique[leader]
+                order = np.argsort(-scores, kind="stable")
+                hits = self._hits([group[ix] for ix in order], scores[order].tolist())
+                clusters.append(IssueCluster(label=hits[0].text, hits=hits))
+        clusters.sort(key=lambda cluster: (-len(cluster.asins), -len(cluster.hits)))
+        return clusters
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM issues")
+            self._reset()
+
+
+issue_index = IssueIndex()
+
+
+def index_analysis(data: dict[str, Any] | None, analysis: str) -> None:
+    # Called once an analysis is done, never fails the job that made it
+    if not settings.ISSUE_INDEX or not data:
+        return
+    asin = extract_asin(str(data.get("url", "")))
+    if not asin:
+        return
+    try:
+        issue_index.add_product(
+            asin, str(data.get("product", "")), analysis, list(data.get("comments", []))
+        )
+    except Exception as e:
+        LOGGER.warning(f"Indexing the analysis of {asin} failed: {e}")
+
+
+def import_results(paths: list[Path]) -> int:
+    # JSONL written by src.batch or src.bulk, failed products are skipped
+    products = 0
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                analysis = record.get("analysis")
+                if not analysis:
+                    continue
+                data = record.get("data") or {}
+                asin = record.get("asin") or extract_asin(
+                    str(data.get("url") or record.get("url", ""))
+                )
+                if not asin:
+                    continue
+                issue_index.add_product(
+                    asin,
+                    str(record.get("product") or data.get("product", "")),
+                    analysis,
+                    list(data.get("comments", [])),
+                )
+                products += 1
+    return products
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Search and cluster key issues across analysed products."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="Issues and reviews similar to text")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=10)
+    search.add_argument("--kind", choices=(ISSUE, REVIEW))
+    cluster = commands.add_parser("clusters", help="Issues shared by many products")
+    cluster.add_argument(
+        "--threshold", type=float, default=settings.ISSUE_CLUSTER_THRESHOLD
+    )
+    cluster.add_argument("--min-products", type=int, default=2)
+    cluster.add_argument("--limit", type=int, default=20)
+    add = commands.add_parser("import", help="Index batch or bulk JSONL results")
+    add.add_argument("paths", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.command == "search":
+        for hit in issue_index.search(args.query, args.k, args.kind):
+            print(f"{hit.score:.3f}  {hit.asin}  [{hit.kind}] {hit.text}")
+    elif args.command == "clusters":
+        clusters = issue_index.clusters(args.threshold, args.min_products)
+        for cluster in clusters[: args.limit]:
+            print(f"{len(cluster.asins)} products: {cluster.label}")
+            for hit in cluster.hits:
+                print(f"    {hit.asin}  {hit.text}")
+    else:
+        products = import_results(args.paths)
+        print(f"Indexed {products} products, {len(issue_index)} entries in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+import numpy as np
+
+from src.analyzer import ProductAnalyzer
+from src.config import settings
+from src.fetcher import extract_asin
+from src.issues import index_analysis
+from src.metrics import span
+from src.parsing import Review, build_product_data
+from src.scoring import ReviewScores, score_reviews
+from src.sources import FetcherSource
+
+LOGGER = logging.getLogger("jobs")
+
+
+@dataclass
+class AnalysisJob:
+    url: str
+    max_pages: int
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"
+    pages_done: int = 0
+    comments_fetched: int = 0
+    data: dict[str, Any] | None = None
+    scores: ReviewScores | None = None
+    # Grows while the answer is streamed, complete once status is "done"
+    summary: str = ""
+    failed_while: str | None = None
+    finished_at: float | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("queued", "scraping", "analyzing")
+
+    def on_page(self, pages_done: int, comments_fetched: int) -> None:
+        self.pages_done = pages_done
+        self.comments_fetched = comments_fetched
+
+    def on_token(self, token: str) -> None:
+        self.summary += token
+
+
+class JobManager:
+    def __init__(self, workers: int = settings.JOB_WORKERS) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="analysis"
+        )
+        self._jobs: dict[str, AnalysisJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        source: FetcherSource,
+        analyzer: ProductAnalyzer,
+        url: str,
+        max_pages: int,
+    ) -> AnalysisJob:
+        job = AnalysisJob(url=url, max_pages=max_pages)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, source, analyzer)
+        return job
+
+    def get(self, job_id: str) -> AnalysisJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - settings.JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def _run(
+        self, job: AnalysisJob, source: FetcherSource, analyzer: ProductAnalyzer
+    ) -> None:
+        try:
+            with span("job", job_id=job.id, url=job.url, max_pages=job.max_pages):
+                self._execute(job, source, analyzer)
+        except Exception as e:
+            LOGGER.error(f"Job {job.id} failed while {job.status}: {e}")
+            job.failed_while = job.status
+            job.status = "failed"
+        finally:
+            job.finished_at = time.monotonic()
+
+    def _execute(
+        self, job: AnalysisJob, source: FetcherSource, analyzer: ProductAnalyzer
+    ) -> None:
+        job.status = "scraping"
+        if settings.STREAM_REVIEWS:
+            self._execute_streaming(job, source, analyzer)
+            return
+        with source.scraper() as scraper:
+            job.data = scraper.fetch_product_data(
+                job.url, job.max_pages, progress=job.on_page
+            )
+        job.comments_fetched = len(job.data["comments"])
+        if settings.LOCAL_SCORING and job.data["comments"]:
+            # Cheap enough to show before the LLM answer starts
+            with span("score_reviews"):
+                job.scores = score_reviews(job.data["comments"])
+        job.status = "analyzing"
+        job.summary = analyzer.analyze_product(
+            job.data, on_token=job.on_token, scores=job.scores
+        )
+        job.status = "done"
+        index_analysis(job.data, job.summary)
+
+    def _execute_streaming(
+        self, job: AnalysisJob, source: FetcherSource, analyzer: ProductAnalyzer
+    ) -> None:
+        # Analysis runs alongside pagination, the job is "analyzing" once the
+        # last page is in. The scraper goes back to the pool right then, not
+        # after the final summary. Comments are kept for the data endpoint.
+        asin = extract_asin(job.url)
+        url = f"https://www.amazon.com/dp/{asin}" if asin else job.url
+        with ExitStack() as stack:
+            scraper = stack.enter_context(source.scraper())
+            details = scraper.fetch_product_details(url)
+            job.data = build_product_data(details, url, [])
+            if settings.LOCAL_SCORING:
+                job.scores = ReviewScores(labels=[], compound=np.empty(0), aspects=[])
+
+            def pages() -> Iterator[list[Review]]:
+                for page in scraper.stream_reviews(url, job.max_pages, job.on_page):
+                    job.data["comments"].extend(review.text for review in page)
+                    yield page
+                stack.close()
+                job.status = "analyzing"
+
+            job.summary = analyzer.analyze_review_stream(
+                job.data, pages(), on_token=job.on_token, scores=job.scores
+            )
+        job.status = "done"
+        index_analysis(job.data, job.summary)
+
+
+job_manager = JobManager()
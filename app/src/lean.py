@@ -0,0 +1,105 @@
+import json
+import logging
+from dataclasses import dataclass, field
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from src.config import settings
+from src.metrics import BROWSER_BYTES, BROWSER_REQUESTS
+
+LOGGER = logging.getLogger("fetcher")
+
+# Network.setBlockedURLs only matches urls, so resource types are blocked by
+# their extensions. Stylesheets and scripts stay, clicks need a working page.
+RESOURCE_PATTERNS = {
+    "image": ("*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico"),
+    "font": ("*.woff", "*.woff2", "*.ttf", "*.otf"),
+    "media": ("*.mp4", "*.webm", "*.m3u8", "*.mp3"),
+}
+# Blocked requests are never downloaded, what they would have cost is
+# estimated from typical sizes on product and review pages
+TYPICAL_BYTES = {
+    "Image": 25_000,
+    "Font": 40_000,
+    "Media": 500_000,
+    "Script": 30_000,
+    "XHR": 5_000,
+    "Fetch": 5_000,
+}
+DEFAULT_BYTES = 10_000
+
+
+@dataclass
+class PageWeight:
+    requests: int = 0
+    bytes: int = 0
+    blocked: int = 0
+    saved_bytes: int = 0
+    blocked_types: dict[str, int] = field(default_factory=dict)
+
+
+def blocked_url_patterns() -> list[str]:
+    patterns = [
+        pattern
+        for resource in settings.BLOCKED_RESOURCES
+        for pattern in RESOURCE_PATTERNS.get(resource.strip(), ())
+    ]
+    patterns.extend(f"*{host.strip()}*" for host in settings.BLOCKED_HOSTS)
+    return patterns
+
+
+def configure_lean_options(options: Options) -> None:
+    # Performance logs carry the Network events the page weight is read from
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_argument("--mute-audio")
+    options.add_argument("--autoplay-policy=user-gesture-required")
+    options.add_argument("--disable-background-networking")
+
+
+def enable_blocking(driver: WebDriver) -> None:
+    patterns = blocked_url_patterns()
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    LOGGER.info(f"Lean browser profile blocks {len(patterns)} url patterns.")
+
+
+def read_page_weight(driver: WebDriver) -> PageWeight:
+    # Drains the performance log, so it covers everything since the last call
+    try:
+        entries = driver.get_log("performance")
+    except WebDriverException as e:
+        LOGGER.debug(f"No performance log: {e}")
+        return PageWeight()
+
+    types: dict[str, str] = {}
+    weight = PageWeight()
+    for entry in entries:
+        message = json.loads(entry["message"])["message"]
+        method, params = message["method"], message.get("params", {})
+        if method == "Network.requestWillBeSent":
+            types[params["requestId"]] = params.get("type", "Other")
+        elif method == "Network.loadingFinished":
+            weight.requests += 1
+            weight.bytes += int(params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            resource = params.get("type") or types.get(params["requestId"], "Other")
+            weight.blocked += 1
+            weight.saved_bytes += TYPICAL_BYTES.get(resource, DEFAULT_BYTES)
+            weight.blocked_types[resource] = weight.blocked_types.get(resource, 0) + 1
+    return weight
+
+
+def report_page_weight(driver: WebDriver, url: str) -> PageWeight:
+    weight = read_page_weight(driver)
+    BROWSER_REQUESTS.inc(weight.requests, result="loaded")
+    BROWSER_REQUESTS.inc(weight.blocked, result="blocked")
+    BROWSER_BYTES.inc(weight.bytes, result="loaded")
+    BROWSER_BYTES.inc(weight.saved_bytes, result="saved")
+    LOGGER.info(
+        f"{url}: {weight.requests} requests, {weight.bytes / 1024:.0f} KiB loaded,"
+        f" {weight.blocked} blocked, ~{weight.saved_bytes / 1024:.0f} KiB saved"
+        f" {weight.blocked_types}"
+    )
+    return weight
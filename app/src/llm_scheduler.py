@@ -0,0 +1,323 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, TypeVar, cast
+
+import requests
+from google.api_core import exceptions as google_exceptions
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.ai import UsageMetadata, add_usage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai.chat_models import _response_to_result
+from pydantic import SecretStr
+
+from src.config import settings
+from src.metrics import LLM_KEY_RATE, LLM_QUEUE_DEPTH, LLM_REQUESTS, span
+from src.preprocess import estimate_tokens
+from src.ratelimit import AdaptiveTokenBucket
+
+LOGGER = logging.getLogger("llm")
+
+T = TypeVar("T")
+
+# 429, the key is over its requests or tokens per minute
+QUOTA_ERRORS: tuple[type[Exception], ...] = (google_exceptions.TooManyRequests,)
+# Worth another try, on whichever key is free first
+TRANSIENT_ERRORS: tuple[type[Exception], ...] = QUOTA_ERRORS + (
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    requests.ConnectionError,
+    requests.Timeout,
+    TimeoutError,
+)
+
+
+def build_gemini(api_key: SecretStr) -> ChatGoogleGenerativeAI:
+    options: dict[str, Any] = {}
+    if settings.LLM_ENDPOINT:
+        # Only the REST transport can be pointed at a plain http server
+        options = {
+            "transport": "rest",
+            "client_options": {"api_endpoint": settings.LLM_ENDPOINT},
+        }
+    return ChatGoogleGenerativeAI(
+        model=settings.LLM_MODEL,
+        temperature=settings.LLM_TEMPERATURE,
+        api_key=SecretStr(api_key.get_secret_value()),
+        timeout=settings.LLM_TIMEOUT,
+        **options,
+    )
+
+
+# The client's own _generate and _stream retry a 429 after sleeping, while
+# the scheduler's slot is held and without the key's bucket hearing of it.
+# Requests go to the generative service directly instead, with its retry of
+# 503s turned off too, so LLMScheduler is the only one retrying.
+def generate_once(
+    client: ChatGoogleGenerativeAI,
+    messages: list[BaseMessage],
+    stop: list[str] | None = None,
+    **kwargs: Any,
+) -> ChatResult:
+    kwargs.setdefault("cached_content", client.cached_content)
+    request = client._prepare_request(messages, stop=stop, **kwargs)
+    response = client.client.generate_content(
+        request=request,
+        metadata=client.default_metadata,
+        retry=None,
+        timeout=settings.LLM_TIMEOUT,
+    )
+    return _response_to_result(response)
+
+
+def stream_once(
+    client: ChatGoogleGenerativeAI,
+    messages: list[BaseMessage],
+    stop: list[str] | None = None,
+    **kwargs: Any,
+) -> Iterator[ChatGenerationChunk]:
+    kwargs.setdefault("cached_content", client.cached_content)
+    request = client._prepare_request(messages, stop=stop, **kwargs)
+    response = client.client.stream_generate_content(
+        request=request,
+        metadata=client.default_metadata,
+        retry=None,
+        timeout=settings.LLM_TIMEOUT,
+    )
+    # Chunks report the usage so far, the previous total turns it into a delta
+    usage: UsageMetadata | None = None
+    for chunk in response:
+        result = _response_to_result(chunk, stream=True, prev_usage=usage)
+        generation = cast(ChatGenerationChunk, result.generations[0])
+        if generation.message.usage_metadata:
+            usage = add_usage(usage, generation.message.usage_metadata)
+        yield generation
+
+
+# Quota of one API key, or this process's share of it. A quarter of a
+# minute's quota can be spent at once, a 429 halves the rate and blocks the
+# key for a jittered backoff.
+class ApiKey:
+    def __init__(self, api_key: SecretStr, label: str, share: float = 1.0) -> None:
+        self.api_key = api_key
+        # Shown in logs and metrics instead of the key itself
+        self.label = label
+        self.requests = self._bucket(settings.LLM_RPM * share)
+        self.tokens = self._bucket(settings.LLM_TPM * share)
+        self._client: ChatGoogleGenerativeAI | None = None
+
+    @staticmethod
+    def _bucket(per_minute: float) -> AdaptiveTokenBucket:
+        rate = per_minute / 60
+        return AdaptiveTokenBucket(
+            rate,
+            per_minute / 4,
+            max_rate=rate,
+            min_rate=rate / 16,
+            increase=rate / 10,
+            backoff=settings.LLM_BACKOFF,
+            max_backoff=settings.LLM_BACKOFF_MAX,
+        )
+
+    @property
+    def client(self) -> ChatGoogleGenerativeAI:
+        if self._client is None:
+            self._client = build_gemini(self.api_key)
+        return self._client
+
+    def wait_time(self, tokens: int) -> float:
+        return max(self.requests.wait_time(), self.tokens.wait_time(tokens))
+
+    def report(self, throttled: bool) -> None:
+        self.requests.report(throttled)
+        self.tokens.report(throttled)
+        LLM_KEY_RATE.set(self.requests.rate * 60, key=self.label)
+
+
+# Shared by every analyzer in the process. Calls wait for the key that can
+# send soonest and for one of LLM_CONCURRENCY slots, transient errors are
+# retried with jittered backoff, on another key when one is free. Other
+# processes using the same keys are not seen, see share_llm_quota.
+class LLMScheduler:
+    def __init__(
+        self,
+        concurrency: int = settings.LLM_CONCURRENCY,
+        retries: int = settings.LLM_RETRIES,
+    ) -> None:
+        self.retries = retries
+        # Fraction of every key's quota this process may use
+        self.quota_share = 1.0
+        self._keys: dict[str, ApiKey] = {}
+        self._waiting = 0
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._lock = threading.Lock()
+
+    def keys(self, api_keys: Iterable[SecretStr]) -> list[ApiKey]:
+        with self._lock:
+            found = []
+            for api_key in api_keys:
+                secret = api_key.get_secret_value()
+                if secret not in self._keys:
+                    label = f"key{len(self._keys)}"
+                    self._keys[secret] = ApiKey(api_key, label, self.quota_share)
+                found.append(self._keys[secret])
+            return found
+
+    def run(self, keys: list[ApiKey], tokens: int, call: Callable[[ApiKey], T]) -> T:
+        attempt = 0
+        while True:
+            key = self._acquire(keys, tokens)
+            delay = None
+            try:
+                result = call(key)
+            except TRANSIENT_ERRORS as e:
+                delay = self._retry_delay(key, e, attempt)
+                if delay is None:
+                    raise
+            except Exception:
+                LLM_REQUESTS.inc(key=key.label, result="failed")
+                raise
+            finally:
+                self._slots.release()
+            if delay is None:
+                self._succeeded(key)
+                return result
+            # Slept without a slot, other calls go ahead meanwhile
+            time.sleep(delay)
+            attempt += 1
+
+    def stream(
+        self, keys: list[ApiKey], tokens: int, call: Callable[[ApiKey], Iterator[T]]
+    ) -> Iterator[T]:
+        # Retried only until the first chunk, a partial answer has been shown
+        attempt = 0
+        while True:
+            key = self._acquire(keys, tokens)
+            started = False
+            delay = None
+            try:
+                for chunk in call(key):
+                    started = True
+                    yield chunk
+            except TRANSIENT_ERRORS as e:
+                if started:
+                    LLM_REQUESTS.inc(key=key.label, result="failed")
+                    raise
+                delay = self._retry_delay(key, e, attempt)
+                if delay is None:
+                    raise
+            except Exception:
+                LLM_REQUESTS.inc(key=key.label, result="failed")
+                raise
+            finally:
+                self._slots.release()
+            if delay is None:
+                self._succeeded(key)
+                return
+            time.sleep(delay)
+            attempt += 1
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def _acquire(self, keys: list[ApiKey], tokens: int) -> ApiKey:
+        with self._lock:
+            self._waiting += 1
+        LLM_QUEUE_DEPTH.inc()
+        try:
+            key = min(keys, key=lambda key: key.wait_time(tokens))
+            with span("llm_wait", key=key.label, tokens=tokens) as current:
+                waited = key.requests.acquire() + key.tokens.acquire(tokens)
+                self._slots.acquire()
+                current.set(seconds=round(waited, 3))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+            LLM_QUEUE_DEPTH.dec()
+        return key
+
+    def _succeeded(self, key: ApiKey) -> None:
+        key.report(throttled=False)
+        LLM_REQUESTS.inc(key=key.label, result="ok")
+
+    def _retry_delay(self, key: ApiKey, error: Exception, attempt: int) -> float | None:
+        # Seconds to wait before the next attempt, None when out of retries
+        throttled = isinstance(error, QUOTA_ERRORS)
+        key.report(throttled=throttled)
+        if attempt == self.retries:
+            LLM_REQUESTS.inc(key=key.label, result="failed")
+            return None
+        LLM_REQUESTS.inc(key=key.label, result="throttled" if throttled else "retried")
+        LOGGER.warning(f"Gemini call on {key.label} failed, retrying: {error}")
+        if throttled:
+            # Throttled keys already back off in their buckets
+            return 0.0
+        delay = min(settings.LLM_BACKOFF_MAX, settings.LLM_BACKOFF * 2**attempt)
+        return delay * random.uniform(0.5, 1.5)
+
+
+llm_scheduler = LLMScheduler()
+
+
+def share_llm_quota(processes: int) -> None:
+    # Process pool initializer, every process paces its calls to its share
+    # of each key's quota so that together they stay within it
+    llm_scheduler.quota_share = 1 / max(1, processes)
+
+
+def _prompt_tokens(messages: list[BaseMessage]) -> int:
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+
+# Chat model for the chains, every call goes through the shared scheduler
+# with one of `api_keys`. Async calls run the sync path in an executor.
+class ScheduledGemini(BaseChatModel):
+    api_keys: list[SecretStr]
+
+    @property
+    def _llm_type(self) -> str:
+        return "scheduled-gemini"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        def call(key: ApiKey) -> ChatResult:
+            result = generate_once(key.client, messages, stop=stop, **kwargs)
+            key.tokens.charge(
+                sum(
+                    estimate_tokens(generation.text)
+                    for generation in result.generations
+                )
+            )
+            return result
+
+        keys = llm_scheduler.keys(self.api_keys)
+        return llm_scheduler.run(keys, _prompt_tokens(messages), call)
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        def call(key: ApiKey) -> Iterator[ChatGenerationChunk]:
+            for chunk in stream_once(key.client, messages, stop=stop, **kwargs):
+                key.tokens.charge(estimate_tokens(chunk.text))
+                yield chunk
+
+        keys = llm_scheduler.keys(self.api_keys)
+        for chunk in llm_scheduler.stream(keys, _prompt_tokens(messages), call):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -1,5 +1,24 @@
+import json
 import logging
 
+from src.config import settings
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if span := getattr(record, "span", None):
+            entry["span"] = span
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
 
 def setup_logging():
     console_handler = logging.StreamHandler()
@@ -8,15 +27,23 @@ def setup_logging():
     console_handler.setLevel(logging.INFO)
     file_handler.setLevel(logging.DEBUG)
 
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
+    formatter: logging.Formatter
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        )
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
 
     loggers = {
         "llm": logging.DEBUG,
         "fetcher": logging.DEBUG,
+        "batch": logging.DEBUG,
+        "jobs": logging.DEBUG,
+        "issues": logging.DEBUG,
+        "trace": logging.DEBUG,
     }
 
     for logger_name, level in loggers.items():
@@ -0,0 +1,299 @@
+import logging
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from src.config import settings
+
+LOGGER = logging.getLogger("trace")
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not settings.METRICS:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        return self._values.get(key, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels: str) -> None:
+        if not settings.METRICS:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: count per bucket (non-cumulative), sum and count
+        self._values: dict[LabelValues, tuple[list[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not settings.METRICS:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            for ix, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[ix] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip([*self.buckets, "+Inf"], counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, le=f"{bound}")
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {total:g}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Gauge | Histogram] = []
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: tuple[str, ...] = ()
+    ) -> Histogram:
+        metric = Histogram(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+SPAN_DURATION = registry.histogram(
+    "span_duration_seconds", "Time spent in each traced stage.", ("span",)
+)
+ERRORS = registry.counter(
+    "errors_total", "Stages that ended with an exception.", ("span",)
+)
+PAGES_FETCHED = registry.counter(
+    "pages_fetched_total", "Review pages fetched.", ("backend",)
+)
+COMMENTS_FETCHED = registry.counter(
+    "comments_fetched_total", "Review comments fetched.", ("backend",)
+)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total",
+    "Estimated tokens sent to and received from the LLM.",
+    ("direction",),
+)
+THROTTLED = registry.counter(
+    "throttled_responses_total",
+    "Captcha, robot check and 503 responses by host.",
+    ("host",),
+)
+BROWSER_REQUESTS = registry.counter(
+    "browser_requests_total",
+    "Requests made by the lean browser profile, loaded or blocked.",
+    ("result",),
+)
+BROWSER_BYTES = registry.counter(
+    "browser_bytes_total",
+    "Bytes loaded by the lean browser profile and estimated bytes saved.",
+    ("result",),
+)
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total",
+    "LLM calls by API key and result: ok, throttled, retried or failed.",
+    ("key", "result"),
+)
+LLM_QUEUE_DEPTH = registry.gauge(
+    "llm_queue_depth", "LLM calls waiting for quota or a free slot."
+)
+LLM_KEY_RATE = registry.gauge(
+    "llm_key_requests_per_minute",
+    "Requests per minute currently allowed for every API key.",
+    ("key",),
+)
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result.", ("cache", "result")
+)
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+# One traced stage, nested spans share the trace id of the outermost one.
+# Logged as a record with a `span` attribute when it ends.
+class Span:
+    def __init__(self, name: str, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        SPAN_DURATION.observe(duration, span=self.name)
+        if exc_type is not None:
+            ERRORS.inc(span=self.name)
+        LOGGER.debug(
+            f"{self.name} took {duration:.3f}s",
+            extra={
+                "span": {
+                    "name": self.name,
+                    "trace_id": self.trace_id,
+                    "span_id": self.span_id,
+                    "parent_id": self.parent_id,
+                    "duration": round(duration, 6),
+                    "error": exc_type.__name__ if exc_type else None,
+                    **self.attributes,
+                }
+            },
+        )
+
+
+class _NoopSpan:
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        pass
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    # Shared no-op when metrics are off, nothing is allocated or timed
+    if not settings.METRICS:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = settings.METRICS_PORT) -> None:
+    global _server
+    if not settings.METRICS:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer(
+                (settings.METRICS_HOST, port), _MetricsHandler
+            )
+        except OSError as e:
+            LOGGER.warning(f"Metrics endpoint not started on port {port}: {e}")
+            return
+        thread = threading.Thread(target=_server.serve_forever, daemon=True)
+        thread.start()
+        LOGGER.info(f"Metrics served on http://{settings.METRICS_HOST}:{port}/metrics")
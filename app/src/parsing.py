@@ -0,0 +1,225 @@
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+from lxml import html as lxml_html
+
+LOGGER = logging.getLogger("fetcher")
+
+TITLE_XPATH = "//span[@id='productTitle']"
+PRICE_XPATH = "//div[@id='corePrice_feature_div']"
+PRICE_OFFSCREEN_XPATH = PRICE_XPATH + "//span[contains(@class, 'a-offscreen')]"
+CATEGORY_XPATH = "//div[@id='wayfinding-breadcrumbs_feature_div']//li[1]"
+RATING_XPATH = (
+    "//div[@id='averageCustomerReviews_feature_div']"
+    "//span[contains(@class, 'a-size-base') and contains(@class, 'a-color-base')]"
+)
+REVIEW_TEXT_XPATH = "//span[contains(@class, 'review-text')]"
+NEXT_PAGE_XPATH = "//ul[@class='a-pagination']//li[@class='a-last']/a"
+REVIEWS_LINK_XPATH = "//a[contains(text(), 'See more reviews')]"
+# Amazon lists this many reviews on every review page
+REVIEWS_PER_PAGE = 10
+# Review blocks, the XPaths after it are relative to one block
+REVIEW_XPATH = "//div[@data-hook='review']"
+REVIEW_BODY_XPATH = ".//span[contains(@class, 'review-text')]"
+REVIEW_RATING_XPATH = ".//i[contains(@data-hook, 'review-star-rating')]"
+REVIEW_DATE_XPATH = ".//span[@data-hook='review-date']"
+REVIEW_HELPFUL_XPATH = ".//span[@data-hook='helpful-vote-statement']"
+REVIEW_VERIFIED_XPATH = ".//span[@data-hook='avp-badge']"
+
+# Reads every product field and the visible reviews in one WebDriver round
+# trip, the XPaths above are passed in as arguments. Reviews use innerText
+# like WebElement.text, so hidden translations are left out.
+PRODUCT_PAGE_SCRIPT = """
+const first = (xpath) => {
+  const node = document.evaluate(
+    xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+  ).singleNodeValue;
+  return node ? node.textContent : null;
+};
+const all = (xpath) => {
+  const nodes = document.evaluate(
+    xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+  );
+  const texts = [];
+  for (let i = 0; i < nodes.snapshotLength; i++) {
+    texts.push(nodes.snapshotItem(i).innerText.trim());
+  }
+  return texts;
+};
+const [title, offscreenPrice, price, category, rating, reviews, next] = arguments;
+return {
+  title: first(title),
+  price: first(offscreenPrice) ?? first(price),
+  category: first(category),
+  rating: first(rating),
+  reviews: all(reviews),
+  has_next: first(next) !== null,
+};
+"""
+PRODUCT_PAGE_SCRIPT_ARGS = (
+    TITLE_XPATH,
+    PRICE_OFFSCREEN_XPATH,
+    PRICE_XPATH,
+    CATEGORY_XPATH,
+    RATING_XPATH,
+    REVIEW_TEXT_XPATH,
+    NEXT_PAGE_XPATH,
+)
+
+
+@dataclass
+class Review:
+    text: str
+    rating: float | None = None
+    # ISO date, Amazon only shows the day
+    date: str | None = None
+    helpful_votes: int = 0
+    verified: bool = False
+
+
+def extract_asin(url: str) -> str | None:
+    match = re.search(r"/dp/([A-Z0-9]{10})", url)
+    return match.group(1) if match else None
+
+
+def _clean_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _first_text(tree: lxml_html.HtmlElement, xpath: str) -> str | None:
+    elements = tree.xpath(xpath)
+    if not elements:
+        return None
+    return _clean_text(elements[0].text_content())
+
+
+def build_product_details(
+    title: str | None, price: str | None, category: str | None, rating: str | None
+) -> dict[str, str | float]:
+    # Shared by the html parser and the in-browser extraction,
+    # every missing field is reported by name
+    details: dict[str, str | float] = {}
+    if title:
+        details["product"] = _clean_text(title)
+    if price:
+        details["price"] = _clean_text(price.replace("\n", "."))
+    if category:
+        details["category"] = _clean_text(category)
+    if rating:
+        try:
+            details["rating"] = float(_clean_text(rating))
+        except ValueError:
+            LOGGER.warning(f"Unexpected rating format: {rating!r}")
+
+    missing = {"product", "price", "category", "rating"} - details.keys()
+    if missing:
+        LOGGER.warning(f"Missing product fields: {', '.join(sorted(missing))}")
+    return details
+
+
+def build_product_data(
+    details: dict[str, Any], url: str, comments: list[str]
+) -> dict[str, str | float | list[str]]:
+    # The shape every fetcher returns and the analyzer reads
+    return {
+        "product": details.get("product", ""),
+        "price": details.get("price", ""),
+        "category": details.get("category", ""),
+        "rating": details.get("rating", -1.0),
+        "url": url,
+        "comments": comments,
+    }
+
+
+def parse_product_details(page: str) -> dict[str, str | float]:
+    tree = lxml_html.fromstring(page)
+    # The visible price is split into whole and fraction spans,
+    # the screen reader copy holds it in one piece
+    price = _first_text(tree, PRICE_OFFSCREEN_XPATH)
+    if price is None:
+        price = _first_text(tree, PRICE_XPATH)
+    return build_product_details(
+        _first_text(tree, TITLE_XPATH),
+        price,
+        _first_text(tree, CATEGORY_XPATH),
+        _first_text(tree, RATING_XPATH),
+    )
+
+
+def parse_review_page(page: str) -> tuple[list[str], bool]:
+    tree = lxml_html.fromstring(page)
+    comments = [
+        _clean_text(element.text_content()) for element in tree.xpath(REVIEW_TEXT_XPATH)
+    ]
+    return comments, bool(tree.xpath(NEXT_PAGE_XPATH))
+
+
+def _parse_rating(text: str | None) -> float | None:
+    # "4.0 out of 5 stars"
+    match = re.search(r"(\d+(?:\.\d+)?) out of 5", text or "")
+    return float(match.group(1)) if match else None
+
+
+def _parse_date(text: str | None) -> str | None:
+    # "Reviewed in the United States on January 5, 2024"
+    match = re.search(r"(\w+ \d{1,2}, \d{4})$", text or "")
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%B %d, %Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+def _parse_helpful_votes(text: str | None) -> int:
+    # "One person found this helpful", "1,024 people found this helpful"
+    if not text:
+        return 0
+    if text.lower().startswith("one person"):
+        return 1
+    match = re.match(r"([\d,]+)", text)
+    return int(match.group(1).replace(",", "")) if match else 0
+
+
+def parse_review_records(page: str) -> tuple[list[Review], bool]:
+    tree = lxml_html.fromstring(page)
+    has_next = bool(tree.xpath(NEXT_PAGE_XPATH))
+    blocks = tree.xpath(REVIEW_XPATH)
+    if not blocks:
+        # Older layouts have the texts without the surrounding review blocks
+        texts = [_clean_text(el.text_content()) for el in tree.xpath(REVIEW_TEXT_XPATH)]
+        return [Review(text=text) for text in texts], has_next
+
+    reviews: list[Review] = []
+    for block in blocks:
+        text = _first_text(block, REVIEW_BODY_XPATH)
+        if text is None:
+            continue
+        reviews.append(
+            Review(
+                text=text,
+                rating=_parse_rating(_first_text(block, REVIEW_RATING_XPATH)),
+                date=_parse_date(_first_text(block, REVIEW_DATE_XPATH)),
+                helpful_votes=_parse_helpful_votes(
+                    _first_text(block, REVIEW_HELPFUL_XPATH)
+                ),
+                verified=bool(block.xpath(REVIEW_VERIFIED_XPATH)),
+            )
+        )
+    return reviews, has_next
+
+
+# Robot check, captcha and the "Sorry! Something went wrong!" page served
+# under load, all mean the requests have to slow down
+THROTTLE_MARKERS = (
+    "validateCaptcha",
+    "api-services-support@amazon.com",
+    "Sorry! Something went wrong!",
+)
+
+
+def is_throttled_page(page: str) -> bool:
+    return any(marker in page for marker in THROTTLE_MARKERS)
@@ -0,0 +1,210 @@
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from src.config import settings
+from src.fetcher import AmazonScraper, ScrapingError
+
+LOGGER = logging.getLogger("fetcher")
+
+
+class PoolExhaustedError(ScrapingError):
+    pass
+
+
+class _PortAllocator:
+    def __init__(self, base: int) -> None:
+        self.base = base
+        self._used: set[int] = set()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        with self._lock:
+            port = self.base
+            while port in self._used:
+                port += 1
+            self._used.add(port)
+            return port
+
+    def release(self, port: int) -> None:
+        with self._lock:
+            self._used.discard(port)
+
+
+_PORTS = _PortAllocator(settings.DEBUGGING_PORT_BASE)
+
+
+# Logged-in drivers for one set of credentials, launched lazily up to `size`.
+# Dead drivers are replaced on checkout, idle ones closed after `idle_timeout`.
+class DriverPool:
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        size: int = settings.POOL_SIZE,
+        checkout_timeout: float = settings.POOL_CHECKOUT_TIMEOUT,
+        idle_timeout: float = settings.POOL_IDLE_TIMEOUT,
+    ) -> None:
+        self.email = email
+        self.password = password
+        self.size = max(1, size)
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+
+        # (scraper, returned_at) pairs, most recently returned last
+        self._idle: list[tuple[AmazonScraper, float]] = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            idle = len(self._idle)
+            return {"size": self.size, "open": self._created, "idle": idle}
+
+    def checkout(self, timeout: float | None = None) -> AmazonScraper:
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise ScrapingError("Driver pool is closed.")
+                expired = self._pop_expired()
+                scraper = self._idle.pop()[0] if self._idle else None
+                if scraper is None and self._created < self.size:
+                    self._created += 1
+                    launch = True
+                else:
+                    launch = False
+                if scraper is None and not launch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"No driver available within {timeout:g}s."
+                        )
+                    self._cond.wait(remaining)
+            self._close_all(expired)
+
+            if launch:
+                return self._launch()
+            if scraper is not None:
+                if scraper.is_alive():
+                    return scraper
+                LOGGER.warning("Discarding unresponsive pooled driver.")
+                self._discard(scraper)
+
+    def checkin(self, scraper: AmazonScraper, healthy: bool = True) -> None:
+        if not healthy or self._closed:
+            self._discard(scraper)
+            return
+        with self._cond:
+            self._idle.append((scraper, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def scraper(self, timeout: float | None = None) -> Iterator[AmazonScraper]:
+        scraper = self.checkout(timeout)
+        try:
+            yield scraper
+        except Exception:
+            self.checkin(scraper, healthy=scraper.is_alive())
+            raise
+        self.checkin(scraper)
+
+    def warm_up(self, count: int = 1) -> None:
+        scrapers = [self.checkout() for _ in range(min(count, self.size))]
+        for scraper in scrapers:
+            self.checkin(scraper)
+
+    def evict_idle(self) -> None:
+        with self._cond:
+            expired = self._pop_expired()
+        self._close_all(expired)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [scraper for scraper, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def _pop_expired(self) -> list[AmazonScraper]:
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [scraper for scraper, ts in self._idle if ts < cutoff]
+        self._idle = [(scraper, ts) for scraper, ts in self._idle if ts >= cutoff]
+        return expired
+
+    def _close_all(self, scrapers: list[AmazonScraper]) -> None:
+        for scraper in scrapers:
+            LOGGER.info(f"Closing idle driver on port {scraper.debugging_port}.")
+            self._discard(scraper)
+
+    def _launch(self) -> AmazonScraper:
+        port = _PORTS.acquire()
+        scraper = AmazonScraper(self.email, self.password, debugging_port=port)
+        try:
+            scraper.open_connection()
+        except Exception:
+            _PORTS.release(port)
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+        LOGGER.info(f"Launched pooled driver on port {port}.")
+        return scraper
+
+    def _discard(self, scraper: AmazonScraper) -> None:
+        try:
+            scraper.close_connection()
+        except Exception as e:
+            LOGGER.warning(f"Error closing pooled driver: {e}")
+        _PORTS.release(scraper.debugging_port)
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+
+_POOLS: dict[str, DriverPool] = {}
+_POOLS_LOCK = threading.Lock()
+_REAPER_INTERVAL = 60.0
+_reaper: threading.Thread | None = None
+
+
+def _pool_key(email: str, password: str) -> str:
+    return hashlib.sha256(f"{email}\0{password}".encode()).hexdigest()
+
+
+def _reap_idle_drivers() -> None:
+    while True:
+        time.sleep(_REAPER_INTERVAL)
+        with _POOLS_LOCK:
+            pools = list(_POOLS.values())
+        for pool in pools:
+            pool.evict_idle()
+
+
+def get_driver_pool(email: str, password: str) -> DriverPool:
+    global _reaper
+    key = _pool_key(email, password)
+    with _POOLS_LOCK:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap_idle_drivers, daemon=True)
+            _reaper.start()
+        if key not in _POOLS:
+            _POOLS[key] = DriverPool(email, password)
+        return _POOLS[key]
+
+
+@atexit.register
+def close_all_pools() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,237 @@
+import re
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.config import settings
+
+# Texts Amazon renders inside review bodies instead of the review itself
+BOILERPLATE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r"^your browser does not support html5 video\.?$",
+        r"^the media could not be loaded\.?$",
+        r"^read more$",
+        r"^video player is loading\.?.*$",
+        r"^(verified purchase|helpful|report|report abuse)$",
+        r"^(one person|\d+ people) found this helpful\.?$",
+        r"^translate (review|all reviews) to english$",
+    )
+]
+
+NUM_PERM = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(seed=7)
+_PERM_A = _rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+@dataclass
+class SelectionReport:
+    total: int
+    kept: int = 0
+    empty: int = 0
+    duplicates: int = 0
+    trimmed: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def __str__(self) -> str:
+        return (
+            f"kept {self.kept}/{self.total} reviews ({self.empty} empty, "
+            f"{self.duplicates} duplicates, {self.trimmed} trimmed), "
+            f"~{self.tokens_after} tokens, ~{self.tokens_saved} saved"
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    # Close enough to Gemini's tokenizer for English prose
+    return len(text) // 4 + 1
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def is_boilerplate(text: str, min_chars: int = 2) -> bool:
+    # Counts letters and digits rather than words, "Terrible!" is a review and
+    # scripts without spaces between words are too
+    if len(re.findall(r"\w", text)) < min_chars:
+        return True
+    return any(pattern.match(text) for pattern in BOILERPLATE_PATTERNS)
+
+
+def trim(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut + " ..."
+
+
+def _shingles(text: str) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash_signatures(texts: list[str]) -> np.ndarray:
+    signatures = np.empty((len(texts), NUM_PERM), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) for shingle in _shingles(text)),
+            dtype=np.uint64,
+        )
+        permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME
+        signatures[row] = permuted.min(axis=1)
+    return signatures
+
+
+# Banded LSH finds candidate pairs, the signature agreement confirms them.
+# Only reviews that are not duplicates themselves are indexed.
+class NearDuplicateIndex:
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self._buckets: dict[tuple[int, bytes], list[int]] = {}
+        self._signatures: list[np.ndarray] = []
+
+    def add(self, signature: np.ndarray) -> bool:
+        # True for a near duplicate of an earlier review
+        rows = NUM_PERM // LSH_BANDS
+        keys = [
+            (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for band in range(LSH_BANDS)
+        ]
+        candidates = {ix for key in keys for ix in self._buckets.get(key, ())}
+        for other in candidates:
+            if np.mean(self._signatures[other] == signature) >= self.threshold:
+                return True
+        for key in keys:
+            self._buckets.setdefault(key, []).append(len(self._signatures))
+        self._signatures.append(signature)
+        return False
+
+
+def find_near_duplicates(signatures: np.ndarray, threshold: float) -> set[int]:
+    # The later review of every confirmed pair is reported as the duplicate
+    index = NearDuplicateIndex(threshold)
+    return {ix for ix, signature in enumerate(signatures) if index.add(signature)}
+
+
+def _pick_diverse(signatures: np.ndarray, costs: list[int], budget: int) -> list[int]:
+    # Greedy max-min: repeatedly take the review least similar to everything
+    # picked so far, ties go to the earlier (more helpful) review
+    count = len(costs)
+    closest = np.full(count, -1.0)
+    available = np.ones(count, dtype=bool)
+    picked: list[int] = []
+    remaining = budget
+    while available.any():
+        candidates = np.flatnonzero(available)
+        ix = int(candidates[np.argmin(closest[candidates])])
+        available[ix] = False
+        if costs[ix] > remaining:
+            continue
+        picked.append(ix)
+        remaining -= costs[ix]
+        similarity = np.mean(signatures == signatures[ix], axis=1)
+        closest = np.maximum(closest, similarity)
+    return sorted(picked)
+
+
+# The cleaning and duplicate checks of select_reviews for reviews that arrive
+# page by page. Earlier pages are only kept as hashes and signatures.
+class ReviewDeduplicator:
+    def __init__(
+        self,
+        max_chars: int = settings.MAX_REVIEW_CHARS,
+        duplicate_threshold: float = settings.DUPLICATE_THRESHOLD,
+    ) -> None:
+        self.max_chars = max_chars
+        self.report = SelectionReport(total=0)
+        self._seen: set[int] = set()
+        self._index = NearDuplicateIndex(duplicate_threshold)
+
+    def add(self, comments: list[str]) -> list[str]:
+        self.report.total += len(comments)
+        self.report.tokens_before += sum(estimate_tokens(c) for c in comments)
+        reviews: list[str] = []
+        for comment in comments:
+            text = normalize(comment)
+            if is_boilerplate(text):
+                self.report.empty += 1
+                continue
+            key = hash(text.lower())
+            if key in self._seen:
+                self.report.duplicates += 1
+                continue
+            self._seen.add(key)
+            trimmed = trim(text, self.max_chars)
+            self.report.trimmed += trimmed != text
+            reviews.append(trimmed)
+
+        if reviews:
+            signatures = minhash_signatures(reviews)
+            unique = [
+                review
+                for review, signature in zip(reviews, signatures)
+                if not self._index.add(signature)
+            ]
+            self.report.duplicates += len(reviews) - len(unique)
+            reviews = unique
+        self.report.kept += len(reviews)
+        self.report.tokens_after += sum(estimate_tokens(r) for r in reviews)
+        return reviews
+
+
+def select_reviews(
+    comments: list[str],
+    token_budget: int = settings.PROMPT_TOKEN_BUDGET,
+    max_chars: int = settings.MAX_REVIEW_CHARS,
+    duplicate_threshold: float = settings.DUPLICATE_THRESHOLD,
+) -> tuple[list[str], SelectionReport]:
+    report = SelectionReport(total=len(comments))
+    report.tokens_before = sum(estimate_tokens(comment) for comment in comments)
+
+    seen: set[str] = set()
+    reviews: list[str] = []
+    for comment in comments:
+        text = normalize(comment)
+        if is_boilerplate(text):
+            report.empty += 1
+            continue
+        if text.lower() in seen:
+            report.duplicates += 1
+            continue
+        seen.add(text.lower())
+        trimmed = trim(text, max_chars)
+        report.trimmed += trimmed != text
+        reviews.append(trimmed)
+
+    if reviews:
+        signatures = minhash_signatures(reviews)
+        duplicates = find_near_duplicates(signatures, duplicate_threshold)
+        report.duplicates += len(duplicates)
+        unique = [ix for ix in range(len(reviews)) if ix not in duplicates]
+        reviews = [reviews[ix] for ix in unique]
+        signatures = signatures[unique]
+
+        costs = [estimate_tokens(review) for review in reviews]
+        if token_budget > 0 and sum(costs) > token_budget:
+            reviews = [
+                reviews[ix] for ix in _pick_diverse(signatures, costs, token_budget)
+            ]
+
+    report.kept = len(reviews)
+    report.tokens_after = sum(estimate_tokens(review) for review in reviews)
+    return reviews, report
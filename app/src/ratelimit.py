@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+
+from src.config import settings
+from src.metrics import THROTTLED, span
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        # Reserves the tokens and sleeps until they are due, returns the time slept
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        # How long acquire would sleep right now, nothing is reserved
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = amount - self._tokens
+        return max(0.0, missing / self.rate)
+
+    def charge(self, amount: float) -> None:
+        # Usage only known afterwards, later callers wait for it
+        with self._lock:
+            self._tokens -= amount
+
+
+# Speeds up additively while responses are healthy, halves its rate and
+# pauses with exponential backoff on every throttled one
+class AdaptiveTokenBucket(TokenBucket):
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        max_rate: float,
+        min_rate: float = settings.RATE_MIN,
+        increase: float = settings.RATE_INCREASE,
+        backoff: float = settings.THROTTLE_BACKOFF,
+        max_backoff: float = settings.THROTTLE_BACKOFF_MAX,
+    ) -> None:
+        super().__init__(rate, capacity)
+        self.max_rate = max(rate, max_rate)
+        self.min_rate = min(rate, min_rate)
+        self.increase = increase
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._current_backoff = 0.0
+        self._blocked_until = 0.0
+
+    def acquire(self, amount: float = 1.0) -> float:
+        with self._lock:
+            blocked = max(0.0, self._blocked_until - time.monotonic())
+        if blocked:
+            time.sleep(blocked)
+        return blocked + super().acquire(amount)
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        with self._lock:
+            blocked = max(0.0, self._blocked_until - time.monotonic())
+        return blocked + super().wait_time(amount)
+
+    def report(self, throttled: bool) -> None:
+        with self._lock:
+            if not throttled:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                self._current_backoff = 0.0
+                return
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._current_backoff = min(
+                self.max_backoff, self._current_backoff * 2 or self.backoff
+            )
+            # Jitter keeps workers sharing the bucket from retrying in lockstep
+            pause = self._current_backoff * random.uniform(0.8, 1.2)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            self._tokens = min(self._tokens, 0.0)
+
+
+# Paces every request by the host it goes to and the account it is made
+# with, a request waits for both
+class RequestScheduler:
+    def __init__(self) -> None:
+        self._hosts: dict[str, AdaptiveTokenBucket] = {}
+        self._accounts: dict[str, AdaptiveTokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, host: str, account: str) -> list[AdaptiveTokenBucket]:
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = AdaptiveTokenBucket(
+                    settings.HOST_RATE_LIMIT,
+                    settings.HOST_RATE_BURST,
+                    max_rate=settings.HOST_RATE_MAX,
+                )
+            buckets = [self._hosts[host]]
+            if account:
+                if account not in self._accounts:
+                    self._accounts[account] = AdaptiveTokenBucket(
+                        settings.ACCOUNT_RATE_LIMIT,
+                        1,
+                        max_rate=settings.ACCOUNT_RATE_MAX,
+                    )
+                buckets.append(self._accounts[account])
+            return buckets
+
+    def acquire(self, host: str, account: str = "") -> float:
+        if settings.HOST_RATE_LIMIT <= 0:
+            return 0.0
+        with span("rate_limit_wait", host=host) as current:
+            waited = sum(bucket.acquire() for bucket in self._buckets(host, account))
+            current.set(seconds=round(waited, 3))
+        return waited
+
+    def report(self, host: str, account: str = "", throttled: bool = False) -> None:
+        if settings.HOST_RATE_LIMIT <= 0:
+            return
+        if throttled:
+            THROTTLED.inc(host=host)
+        for bucket in self._buckets(host, account):
+            bucket.report(throttled)
+
+    def rates(self) -> dict[str, float]:
+        with self._lock:
+            return {
+                **{f"host:{key}": bucket.rate for key, bucket in self._hosts.items()},
+                **{
+                    f"account:{key}": bucket.rate
+                    for key, bucket in self._accounts.items()
+                },
+            }
+
+
+scheduler = RequestScheduler()
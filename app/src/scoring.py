@@ -0,0 +1,198 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from src.config import settings
+
+# Small VADER-style valence lexicon tuned for product reviews
+LEXICON: dict[str, float] = {
+    **dict.fromkeys(
+        "amazing awesome excellent fantastic perfect love loved loves outstanding "
+        "superb wonderful best flawless".split(),
+        3.0,
+    ),
+    **dict.fromkeys(
+        "great good nice happy sturdy reliable comfortable recommend recommended "
+        "easy solid durable works worked beautiful pleased satisfied "
+        "impressed worth fits bright clear smooth".split(),
+        2.0,
+    ),
+    **dict.fromkeys("fine decent ok okay cheap affordable simple".split(), 1.0),
+    **dict.fromkeys(
+        "slow small loose noisy flimsy thin weak confusing hard difficult late "
+        "missing scratched scratches expensive overpriced uncomfortable dim "
+        "annoying".split(),
+        -1.5,
+    ),
+    **dict.fromkeys(
+        "bad poor broke broken break breaks cracked crack defective disappointed "
+        "disappointing problem problems issue issues fail failed fails faulty "
+        "stopped leak leaks leaking died dies drains damaged fake wrong useless "
+        "unreliable refund returned return returning".split(),
+        -2.0,
+    ),
+    **dict.fromkeys(
+        "terrible horrible awful worst garbage junk waste scam dangerous hate "
+        "hated unusable".split(),
+        -3.0,
+    ),
+}
+NEGATIONS = {"not", "no", "never", "without", "hardly", "nothing", "nor"}
+NEGATION_SCOPE = 3
+# Controls how fast the compound score saturates, as in VADER
+ALPHA = 15.0
+
+POSITIVE, NEGATIVE, MIXED, NEUTRAL = "positive", "negative", "mixed", "neutral"
+CRITICAL_LABELS = (NEGATIVE, MIXED)
+OTHER_ASPECT = "other"
+
+_TOKEN_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")  # keeps "don't" in one piece
+_vocabulary = sorted({*LEXICON, *(f"not_{word}" for word in LEXICON)})
+_weights = np.array(
+    [
+        -LEXICON[term[4:]] * 0.75 if term.startswith("not_") else LEXICON[term]
+        for term in _vocabulary
+    ]
+)
+_sentiment_vectorizer = CountVectorizer(
+    vocabulary=_vocabulary, analyzer=lambda doc: doc, lowercase=False
+)
+
+
+@dataclass
+class ReviewScores:
+    labels: list[str]
+    compound: np.ndarray
+    aspects: list[list[str]]
+    aspect_terms: list[str] = field(default_factory=list)
+
+    @property
+    def label_counts(self) -> dict[str, int]:
+        counts = Counter(self.labels)
+        return {label: counts[label] for label in (NEGATIVE, MIXED, POSITIVE, NEUTRAL)}
+
+    def extend(self, labels: list[str], compound: np.ndarray) -> None:
+        # Streamed reviews are scored page by page, aspects need every review
+        # at once and stay empty
+        self.labels.extend(labels)
+        self.compound = np.concatenate([self.compound, compound])
+        self.aspects.extend([] for _ in labels)
+
+    def breakdown(self) -> dict[str, dict[str, int]]:
+        # Reviews per label for every aspect, most criticised aspects first
+        table: dict[str, Counter] = {}
+        for label, aspects in zip(self.labels, self.aspects):
+            for aspect in aspects or [OTHER_ASPECT]:
+                table.setdefault(aspect, Counter())[label] += 1
+        ordered = sorted(
+            table.items(),
+            key=lambda item: (-sum(item[1][lb] for lb in CRITICAL_LABELS), item[0]),
+        )
+        return {
+            aspect: {label: counts[label] for label in (NEGATIVE, MIXED, POSITIVE)}
+            for aspect, counts in ordered
+        }
+
+
+def _tokenize(text: str) -> list[str]:
+    tokens: list[str] = []
+    negated = 0
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in NEGATIONS or token.endswith("n't"):
+            negated = NEGATION_SCOPE
+            continue
+        tokens.append(f"not_{token}" if negated else token)
+        negated = max(0, negated - 1)
+    return tokens
+
+
+def score_sentiment(comments: list[str]) -> tuple[list[str], np.ndarray]:
+    counts = _sentiment_vectorizer.transform([_tokenize(c) for c in comments])
+    positive = counts @ np.clip(_weights, 0, None)
+    negative = -(counts @ np.clip(_weights, None, 0))
+    raw = positive - negative
+    compound = raw / np.sqrt(raw * raw + ALPHA)
+
+    labels = np.full(len(comments), NEUTRAL, dtype=object)
+    labels[compound >= 0.05] = POSITIVE
+    labels[compound <= -0.05] = NEGATIVE
+    # Praise and complaints of comparable weight in one review
+    smaller = np.minimum(positive, negative)
+    labels[(smaller >= 2.0) & (smaller >= 0.5 * np.maximum(positive, negative))] = MIXED
+    return labels.tolist(), compound
+
+
+def extract_aspect_terms(
+    comments: list[str], max_terms: int = settings.MAX_ASPECTS
+) -> list[str]:
+    if len(comments) < 2:
+        return []
+    vectorizer = TfidfVectorizer(
+        stop_words="english",
+        ngram_range=(1, 2),
+        min_df=2,
+        max_df=0.6,
+        token_pattern=r"(?u)\b[a-zA-Z][a-zA-Z]+\b",
+    )
+    try:
+        tfidf = vectorizer.fit_transform(comments)
+    except ValueError:
+        # Nothing left after stop words and document frequency limits
+        return []
+    terms = vectorizer.get_feature_names_out()
+    weights = np.asarray(tfidf.sum(axis=0)).ravel()
+    # Sentiment words describe how people feel, not what they talk about
+    is_aspect = np.array(
+        [not any(word in LEXICON for word in term.split()) for term in terms]
+    )
+    ranked = [ix for ix in np.argsort(-weights) if is_aspect[ix]]
+    return [str(terms[ix]) for ix in ranked[:max_terms]]
+
+
+def assign_aspects(comments: list[str], aspect_terms: list[str]) -> list[list[str]]:
+    if not aspect_terms:
+        return [[] for _ in comments]
+    vectorizer = CountVectorizer(vocabulary=aspect_terms, ngram_range=(1, 2))
+    hits = vectorizer.transform(comments).tocsr()
+    hits.sort_indices()
+    return [
+        [
+            aspect_terms[ix]
+            for ix in hits.indices[hits.indptr[row] : hits.indptr[row + 1]]
+        ]
+        for row in range(len(comments))
+    ]
+
+
+def score_reviews(comments: list[str]) -> ReviewScores:
+    labels, compound = score_sentiment(comments)
+    aspect_terms = extract_aspect_terms(comments)
+    return ReviewScores(
+        labels=labels,
+        compound=compound,
+        aspects=assign_aspects(comments, aspect_terms),
+        aspect_terms=aspect_terms,
+    )
+
+
+def critical_reviews(comments: list[str], scores: ReviewScores) -> list[str]:
+    # Neutral is also what reviews without a single lexicon word get, in other
+    # languages or plain English, so only the praise is left out
+    return [
+        comment for comment, label in zip(comments, scores.labels) if label != POSITIVE
+    ]
+
+
+def group_by_aspect(
+    comments: list[str], aspect_terms: list[str]
+) -> list[tuple[str, list[str]]]:
+    # Every review goes to its first matching aspect, largest groups first
+    groups: dict[str, list[str]] = {}
+    for comment, aspects in zip(comments, assign_aspects(comments, aspect_terms)):
+        groups.setdefault(aspects[0] if aspects else OTHER_ASPECT, []).append(comment)
+    return sorted(
+        groups.items(), key=lambda item: (item[0] == OTHER_ASPECT, -len(item[1]))
+    )
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from src.config import settings
+
+LOGGER = logging.getLogger("fetcher")
+
+# Keys accepted by WebDriver's add_cookie
+COOKIE_KEYS = ("name", "value", "domain", "path", "secure", "httpOnly", "expiry")
+
+
+class SessionStore:
+    def __init__(self, directory: Path = settings.SESSION_STORE_DIR) -> None:
+        self.directory = Path(directory)
+
+    def _path(self, account: str) -> Path:
+        digest = hashlib.sha256(account.strip().lower().encode()).hexdigest()
+        return self.directory / f"{digest[:32]}.json"
+
+    def load(self, account: str) -> dict[str, Any] | None:
+        path = self._path(account)
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            LOGGER.warning(f"Ignoring unreadable session file {path}: {e}")
+            return None
+        if not state.get("cookies"):
+            return None
+        now = time.time()
+        state["cookies"] = [
+            cookie
+            for cookie in state["cookies"]
+            if "expiry" not in cookie or cookie["expiry"] > now
+        ]
+        return state
+
+    def save(
+        self,
+        account: str,
+        cookies: list[dict[str, Any]],
+        local_storage: dict[str, str],
+    ) -> None:
+        state = {
+            "saved_at": time.time(),
+            "cookies": [
+                {key: cookie[key] for key in COOKIE_KEYS if key in cookie}
+                for cookie in cookies
+            ],
+            "local_storage": local_storage,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(account)
+        tmp_path = path.with_suffix(".tmp")
+        # Cookies are credentials, keep them readable by the owner only
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def clear(self, account: str) -> None:
+        self._path(account).unlink(missing_ok=True)
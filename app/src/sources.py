@@ -0,0 +1,153 @@
+import logging
+import re
+from contextlib import AbstractContextManager, contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Protocol
+
+from src.config import settings
+from src.fetcher import ScrapingError, extract_asin
+from src.http_fetcher import HttpFetchError, HttpReviewFetcher, ProgressCallback
+from src.metrics import span
+from src.parsing import Review, build_product_data
+from src.pool import get_driver_pool
+
+LOGGER = logging.getLogger("fetcher")
+
+ProductData = dict[str, str | float | list[str]]
+
+
+class ProductFetcher(Protocol):
+    def fetch_product_data(
+        self,
+        product_url: str,
+        max_review_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> ProductData: ...
+
+    def fetch_product_details(self, product_url: str) -> dict[str, str | float]: ...
+
+    def is_alive(self) -> bool: ...
+
+    def stream_reviews(
+        self,
+        product_url: str,
+        max_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> Iterator[list[Review]]: ...
+
+
+# Hands out fetchers to the jobs and batch workers, DriverPool is the live one
+class FetcherSource(Protocol):
+    def scraper(
+        self, timeout: float | None = None
+    ) -> AbstractContextManager[ProductFetcher]: ...
+
+    def warm_up(self, count: int = 1) -> None: ...
+
+
+def fixture_paths(fixture_dir: Path, asin: str) -> tuple[Path, Path]:
+    # <fixture_dir>/<ASIN>/product.html and reviews-<page>.html next to it,
+    # reviews-recent-<page>.html holds the pages sorted by date if recorded
+    product_dir = Path(fixture_dir) / asin
+    return product_dir / "product.html", product_dir
+
+
+def save_fixture(
+    fixture_dir: Path,
+    asin: str,
+    product_page: str,
+    review_pages: list[str],
+    recent_pages: list[str] | None = None,
+) -> Path:
+    product_path, product_dir = fixture_paths(fixture_dir, asin)
+    product_dir.mkdir(parents=True, exist_ok=True)
+    product_path.write_text(product_page)
+    for page_ix, page in enumerate(review_pages, start=1):
+        (product_dir / f"reviews-{page_ix}.html").write_text(page)
+    for page_ix, page in enumerate(recent_pages or [], start=1):
+        (product_dir / f"reviews-recent-{page_ix}.html").write_text(page)
+    return product_dir
+
+
+# Serves recorded pages from disk through the same parsing and pagination
+# code as the http backend, without network access or rate limiting
+class FixtureFetcher(HttpReviewFetcher):
+    backend = "fixture"
+
+    def __init__(self, fixture_dir: Path) -> None:
+        super().__init__(user_agent="fixture")
+        self.fixture_dir = Path(fixture_dir)
+
+    def fetch_product_data(
+        self,
+        product_url: str,
+        max_review_pages: int,
+        progress: ProgressCallback | None = None,
+    ) -> ProductData:
+        asin = extract_asin(product_url)
+        if asin is None:
+            raise ScrapingError(f"Invalid URL format: {product_url}")
+        product_url = f"https://www.amazon.com/dp/{asin}"
+        with span("fetch_product_data", asin=asin, backend=self.backend):
+            details = self.fetch_product_details(product_url)
+            comments = self.fetch_product_comments(
+                product_url, max_review_pages, progress=progress
+            )
+        return build_product_data(details, product_url, comments)
+
+    def is_alive(self) -> bool:
+        return True
+
+    def _get(self, url: str, params: dict[str, Any] | None = None) -> str:
+        params = params or {}
+        asin = extract_asin(url) or self._review_asin(url)
+        if asin is None:
+            raise HttpFetchError(f"No fixture for {url}")
+        product_path, product_dir = fixture_paths(self.fixture_dir, asin)
+        if "pageNumber" not in params:
+            path = product_path
+        else:
+            page_ix = params["pageNumber"]
+            path = product_dir / f"reviews-{page_ix}.html"
+            recent = product_dir / f"reviews-recent-{page_ix}.html"
+            if params.get("sortBy") == "recent" and recent.exists():
+                path = recent
+        try:
+            return path.read_text()
+        except OSError as e:
+            raise HttpFetchError(f"No fixture for {url}: {e}")
+
+    @staticmethod
+    def _review_asin(url: str) -> str | None:
+        match = re.search(r"/product-reviews/([A-Z0-9]{10})", url)
+        return match.group(1) if match else None
+
+
+class FixtureSource:
+    def __init__(self, fixture_dir: Path) -> None:
+        self.fixture_dir = Path(fixture_dir)
+        if not self.fixture_dir.is_dir():
+            raise ScrapingError(f"Fixture directory {fixture_dir} does not exist.")
+
+    @property
+    def stats(self) -> dict[str, int]:
+        products = sum(1 for path in self.fixture_dir.iterdir() if path.is_dir())
+        return {"products": products}
+
+    @contextmanager
+    def scraper(self, timeout: float | None = None) -> Iterator[FixtureFetcher]:
+        fetcher = FixtureFetcher(self.fixture_dir)
+        try:
+            yield fetcher
+        finally:
+            fetcher.close()
+
+    def warm_up(self, count: int = 1) -> None:
+        pass
+
+
+def get_fetcher_source(email: str, password: str) -> FetcherSource:
+    if settings.FIXTURE_DIR:
+        LOGGER.info(f"Serving products from fixtures in {settings.FIXTURE_DIR}")
+        return FixtureSource(Path(settings.FIXTURE_DIR))
+    return get_driver_pool(email, password)
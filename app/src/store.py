@@ -0,0 +1,90 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from src.config import settings
+
+LOGGER = logging.getLogger("fetcher")
+
+
+@dataclass
+class StoredProduct:
+    data: dict[str, Any]
+    fetched_at: float
+    # Review pages the comments were collected from
+    pages: int = 0
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def covers(self, pages: int) -> bool:
+        return self.pages >= pages
+
+
+def split_new_comments(comments: list[str], known: set[str]) -> tuple[list[str], bool]:
+    # Comments come newest first, so everything after the first known one
+    # has already been collected
+    for ix, comment in enumerate(comments):
+        if comment in known:
+            return comments[:ix], True
+    return comments, False
+
+
+class ProductStore:
+    def __init__(self, path: Path = settings.PRODUCT_STORE_PATH) -> None:
+        self.path = Path(path)
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                " asin TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL,"
+                " pages INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {
+                row[1] for row in self._conn.execute("PRAGMA table_info(products)")
+            }
+            if "pages" not in columns:
+                # Stores written before pages were tracked, their rows cover none
+                self._conn.execute(
+                    "ALTER TABLE products ADD COLUMN pages INTEGER NOT NULL DEFAULT 0"
+                )
+        return self._conn
+
+    def get(self, asin: str) -> StoredProduct | None:
+        try:
+            with self._lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT data, fetched_at, pages FROM products WHERE asin = ?",
+                    (asin,),
+                ).fetchone()
+        except sqlite3.Error as e:
+            LOGGER.warning(f"Product store read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return StoredProduct(data=json.loads(row[0]), fetched_at=row[1], pages=row[2])
+
+    def put(self, asin: str, data: dict[str, Any], pages: int) -> None:
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?)",
+                    (asin, json.dumps(data), time.time(), pages),
+                )
+        except sqlite3.Error as e:
+            LOGGER.warning(f"Product store write failed: {e}")
+
+
+product_store = ProductStore()
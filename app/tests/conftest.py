@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+import pytest
+
+# The module level stores open their files on import, keep them out of .cache/
+_cache_dir = tempfile.mkdtemp(prefix="tests-cache-")
+for name, default in (
+    ("ANALYSIS_CACHE", "false"),
+    ("PRODUCT_STORE", "false"),
+    ("ISSUE_INDEX", "false"),
+    ("METRICS", "false"),
+    ("ANALYSIS_CACHE_PATH", os.path.join(_cache_dir, "analyses.db")),
+    ("PRODUCT_STORE_PATH", os.path.join(_cache_dir, "products.db")),
+    ("ISSUE_INDEX_PATH", os.path.join(_cache_dir, "issues.db")),
+):
+    os.environ.setdefault(name, default)
+
+
+class FakeClock:
+    # Stands in for the time module, sleeping only moves the clock
+    def __init__(self, start: float = 1000.0) -> None:
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from benchmarks.fake_gemini import FakeGeminiServer
+from benchmarks.fakes import CANNED_ANSWER, make_fixture
+from src import api
+from src.config import settings
+from src.issues import IssueIndex
+
+TOKEN = "s3cret"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+    monkeypatch.setattr(api, "setup_logging", lambda: None)
+    monkeypatch.setattr(settings, "API_TOKEN", TOKEN)
+    return TestClient(api.create_app(), root_path="/api")
+
+
+@pytest.fixture
+def product_url(tmp_path, monkeypatch) -> str:
+    # Scraped from recorded pages and analysed by the fake Gemini server
+    url = make_fixture(tmp_path, pages=2)
+    monkeypatch.setattr(settings, "FIXTURE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "API_GOOGLE_API_KEY", "api-test-key")
+    with FakeGeminiServer() as server:
+        monkeypatch.setattr(settings, "LLM_ENDPOINT", server.url)
+        yield url
+
+
+def _wait_for(client: TestClient, link: str) -> dict:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        job = client.get(link, headers=AUTH).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"{link} did not finish")
+
+
+def test_health_needs_no_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "API_TOKEN", "")
+    assert client.get("/api/health").json() == {"status": "ok"}
+    assert client.get("/api/jobs/x").status_code == 503
+
+
+def test_requests_need_the_token(client):
+    response = client.get("/api/jobs/x")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    wrong = client.get("/api/jobs/x", headers={"Authorization": "Bearer nope"})
+    assert wrong.status_code == 401
+    assert client.get("/api/jobs/x", headers=AUTH).status_code == 404
+
+
+def test_invalid_submissions(client, product_url):
+    def submit(**kwargs) -> int:
+        return client.post("/api/jobs", headers=AUTH, **kwargs).status_code
+
+    assert submit(content=b"not json") == 400
+    assert submit(json=["list"]) == 400
+    assert submit(json={}) == 422
+    assert submit(json={"url": "https://example.com/"}) == 422
+    assert submit(json={"url": product_url, "max_pages": 0}) == 422
+
+
+def test_missing_credentials(client, product_url, monkeypatch):
+    monkeypatch.setattr(settings, "FIXTURE_DIR", "")
+    monkeypatch.setattr(settings, "API_EMAIL", "")
+    monkeypatch.setattr(settings, "EMAIL", "")
+    response = client.post("/api/jobs", json={"url": product_url}, headers=AUTH)
+    assert response.status_code == 503
+    assert "API_EMAIL" in response.json()["detail"]
+
+    monkeypatch.setattr(settings, "FIXTURE_DIR", "fixtures")
+    monkeypatch.setattr(settings, "API_GOOGLE_API_KEY", "")
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", "")
+    monkeypatch.setattr(settings, "GOOGLE_API_KEYS", ())
+    response = client.post("/api/jobs", json={"url": product_url}, headers=AUTH)
+    assert response.status_code == 503
+    assert "API_GOOGLE_API_KEY" in response.json()["detail"]
+
+
+def test_job_runs_to_the_analysis(client, product_url):
+    response = client.post(
+        "/api/jobs", json={"url": product_url, "max_pages": 2}, headers=AUTH
+    )
+    assert response.status_code == 202
+    links = response.json()["jobs"][0]["links"]
+    assert links["self"].startswith("/api/jobs/")
+
+    job = _wait_for(client, links["self"])
+    assert job["status"] == "done", job
+    assert job["pages_done"] == 2
+    data = client.get(links["data"], headers=AUTH).json()["data"]
+    assert len(data["comments"]) == 20
+    analysis = client.get(links["analysis"], headers=AUTH).json()
+    assert analysis["complete"]
+    assert analysis["analysis"].strip() == CANNED_ANSWER
+    assert sum(analysis["review_scores"].values()) == 20
+
+
+def test_issue_search_and_clusters(client, tmp_path, monkeypatch):
+    index = IssueIndex(tmp_path / "issues.db")
+    monkeypatch.setattr(api, "issue_index", index)
+    index.add_product("B000000001", "Watch", "- Battery drains overnight")
+    index.add_product("B000000002", "Phone", "- The battery drains overnight")
+
+    assert client.get("/api/issues/search", headers=AUTH).status_code == 422
+    assert (
+        client.get("/api/issues/search?q=x&kind=other", headers=AUTH).status_code == 422
+    )
+    hits = client.get("/api/issues/search?q=battery&k=1", headers=AUTH).json()["hits"]
+    assert len(hits) == 1
+    assert hits[0]["kind"] == "issue" and "battery" in hits[0]["text"].lower()
+
+    clusters = client.get("/api/issues/clusters", headers=AUTH).json()["clusters"]
+    assert clusters[0]["asins"] == ["B000000001", "B000000002"]
+    assert client.get("/api/issues/clusters?limit=0", headers=AUTH).status_code == 422
@@ -0,0 +1,70 @@
+import json
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from benchmarks.fakes import FakeProductAnalyzer, make_product
+from src import batch
+from src.batch import BatchRunner
+
+
+class FakeScraper:
+    def __init__(self) -> None:
+        self.alive = True
+
+    def fetch_product_data(self, url: str, max_review_pages: int) -> dict[str, Any]:
+        if "kill" in url:
+            self.alive = False
+        if not self.alive or "fail" in url:
+            raise RuntimeError(f"cannot fetch {url}")
+        return {**make_product(10), "url": url}
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+
+class FakeSource:
+    def __init__(self) -> None:
+        self.checked_out = 0
+        self.unhealthy = 0
+
+    @contextmanager
+    def scraper(self, timeout: float | None = None) -> Iterator[FakeScraper]:
+        # Checked back in as unhealthy on errors, as DriverPool does
+        self.checked_out += 1
+        scraper = FakeScraper()
+        try:
+            yield scraper
+        except Exception:
+            self.unhealthy += int(not scraper.is_alive())
+            raise
+
+
+def _read(path) -> dict[str, dict[str, Any]]:
+    with open(path) as f:
+        return {record["url"]: record for record in map(json.loads, f)}
+
+
+def test_dead_driver_is_replaced(tmp_path):
+    source = FakeSource()
+    urls = ["https://a/kill", "https://a/1", "https://a/fail", "https://a/2"]
+    runner = BatchRunner(source, FakeProductAnalyzer(), scrape_workers=1)
+    progress = runner.run(urls, tmp_path / "out.jsonl")
+    records = _read(tmp_path / "out.jsonl")
+    assert (progress.done, progress.failed) == (2, 2)
+    assert records["https://a/1"]["status"] == "done"
+    assert records["https://a/kill"]["status"] == "failed"
+    # A failure with a live driver keeps it
+    assert (source.checked_out, source.unhealthy) == (2, 1)
+
+
+def test_analysis_errors_keep_the_queue_draining(tmp_path, monkeypatch):
+    def broken_index(data: Any, analysis: str) -> None:
+        raise RuntimeError("index is broken")
+
+    monkeypatch.setattr(batch, "index_analysis", broken_index)
+    urls = [f"https://a/{ix}" for ix in range(12)]
+    runner = BatchRunner(FakeSource(), FakeProductAnalyzer(), llm_workers=1)
+    progress = runner.run(urls, tmp_path / "out.jsonl")
+    records = _read(tmp_path / "out.jsonl")
+    assert progress.failed == len(urls)
+    assert {record["error"] for record in records.values()} == {"index is broken"}
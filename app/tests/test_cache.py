@@ -0,0 +1,41 @@
+from src import cache
+from src.cache import AnalysisCache, make_cache_key
+
+
+def test_cache_key_covers_model_and_temperature():
+    key = make_cache_key("prompt", "gemini", 0.0)
+    assert key == make_cache_key("prompt", "gemini", 0.0)
+    assert key != make_cache_key("prompt", "gemini", 0.5)
+    assert key != make_cache_key("prompt", "other", 0.0)
+    assert key != make_cache_key("other prompt", "gemini", 0.0)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(cache, "time", clock)
+    analyses = AnalysisCache(tmp_path / "analyses.db", ttl=60, max_entries=10)
+    analyses.put("key", "analysis")
+    clock.sleep(59)
+    assert analyses.get("key") == "analysis"
+    clock.sleep(2)
+    assert analyses.get("key") is None
+    assert analyses.stats == {"hits": 1, "misses": 1}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(cache, "time", clock)
+    analyses = AnalysisCache(tmp_path / "analyses.db", ttl=0, max_entries=2)
+    analyses.put("a", "1")
+    clock.sleep(1)
+    analyses.put("b", "2")
+    clock.sleep(1)
+    assert analyses.get("a") == "1"
+    clock.sleep(1)
+    analyses.put("c", "3")
+    assert analyses.get("b") is None
+    assert analyses.get("a") == "1"
+    assert analyses.get("c") == "3"
+
+
+def test_entries_survive_a_restart(tmp_path):
+    AnalysisCache(tmp_path / "analyses.db").put("key", "analysis")
+    assert AnalysisCache(tmp_path / "analyses.db").get("key") == "analysis"
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from src import issues
+from src.config import settings
+from src.issues import ISSUE, REVIEW, IssueIndex, embed, extract_issues, index_analysis
+
+TABLE = """Here is what customers report:
+
+| **Key Issue** | **Improvement Suggestion** | **Priority** |
+|---|---|---|
+| Battery drains overnight | Use a larger cell | High |
+| **Strap breaks** | Reinforce the buckle | Medium |
+"""
+
+
+@pytest.fixture
+def index(tmp_path) -> IssueIndex:
+    return IssueIndex(tmp_path / "issues.db")
+
+
+def test_extract_issues_from_the_table():
+    assert extract_issues(TABLE) == [
+        ("Battery drains overnight", "Use a larger cell"),
+        ("Strap breaks", "Reinforce the buckle"),
+    ]
+
+
+def test_extract_issues_from_a_list():
+    analysis = "Main problems:\n- **Battery** drains fast\n2. Screen scratches easily"
+    assert extract_issues(analysis) == [
+        ("Battery drains fast", ""),
+        ("Screen scratches easily", ""),
+    ]
+
+
+def test_paraphrases_embed_close_together():
+    vectors = embed(
+        [
+            "Battery drains overnight",
+            "the battery drained over night",
+            "Strap buckle broke",
+        ]
+    )
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    assert vectors[0] @ vectors[1] > 0.5 > vectors[0] @ vectors[2]
+
+
+def test_search_finds_the_matching_products(index):
+    index.add_product(
+        "B000000001", "Watch", TABLE, ["The strap broke in a week, terrible."]
+    )
+    index.add_product(
+        "B000000002",
+        "Phone",
+        "| Key Issue | Suggestion |\n|---|---|\n| Screen cracks | Thicker glass |",
+    )
+    assert len(index) == 4
+    hits = index.search("battery drained", k=2)
+    assert hits[0].asin == "B000000001"
+    assert hits[0].text == "Battery drains overnight"
+    assert hits[0].detail == "Use a larger cell"
+    assert hits[0].score > hits[1].score
+    reviews = index.search("strap broke", k=1, kind=REVIEW)
+    assert [hit.kind for hit in reviews] == [REVIEW]
+    assert reviews[0].text == "The strap broke in a week, terrible."
+
+
+def test_adding_a_product_again_replaces_it(index):
+    index.add_product("B000000001", "Watch", TABLE)
+    index.add_product("B000000001", "Watch", "- Screen cracks")
+    assert len(index) == 1
+    assert [hit.text for hit in index.search("battery", k=5)] == ["Screen cracks"]
+
+
+def test_clusters_group_issues_across_products(index):
+    index.add_product(
+        "B000000001", "Watch", "- Battery drains overnight\n- Strap breaks"
+    )
+    index.add_product("B000000002", "Phone", "- The battery drains overnight")
+    index.add_product("B000000003", "Tablet", "- Battery drained overnight\n- Loud fan")
+    clusters = index.clusters()
+    assert len(clusters) == 1
+    assert clusters[0].asins == ["B000000001", "B000000002", "B000000003"]
+    assert all(hit.kind == ISSUE for hit in clusters[0].hits)
+    # Single products are kept with min_products=1
+    labels = {cluster.label for cluster in index.clusters(min_products=1)}
+    assert {"Strap breaks", "Loud fan"} <= labels
+
+
+def test_indexes_on_one_file_see_each_others_writes(tmp_path):
+    first = IssueIndex(tmp_path / "issues.db")
+    second = IssueIndex(tmp_path / "issues.db")
+    first.add_product("B000000001", "Watch", TABLE)
+    assert len(second) == 2
+    second.add_product("B000000001", "Watch", "- Screen cracks")
+    assert [hit.text for hit in first.search("screen", k=5)] == ["Screen cracks"]
+    second.clear()
+    assert len(first) == 0
+
+
+def test_index_analysis(index, monkeypatch):
+    monkeypatch.setattr(issues, "issue_index", index)
+    data = {"url": "https://www.amazon.com/dp/B000000001", "product": "Watch"}
+    monkeypatch.setattr(settings, "ISSUE_INDEX", False)
+    index_analysis(data, TABLE)
+    assert len(index) == 0
+    monkeypatch.setattr(settings, "ISSUE_INDEX", True)
+    index_analysis({"url": "no asin"}, TABLE)
+    index_analysis(data, TABLE)
+    assert len(index) == 2
@@ -0,0 +1,57 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+from langchain_core.messages import HumanMessage
+from pydantic import SecretStr
+
+from benchmarks.fake_gemini import FakeGeminiServer
+from benchmarks.fakes import CANNED_ANSWER
+from src.config import settings
+from src.llm_scheduler import LLMScheduler, generate_once, stream_once
+
+MESSAGES = [HumanMessage(content="Summarise the reviews.")]
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RPM", 6000)
+    monkeypatch.setattr(settings, "LLM_BACKOFF", 0.01)
+    monkeypatch.setattr(settings, "LLM_BACKOFF_MAX", 0.05)
+    with FakeGeminiServer(rpm=1) as server:
+        monkeypatch.setattr(settings, "LLM_ENDPOINT", server.url)
+        yield server
+
+
+def test_generate_and_stream(gemini):
+    scheduler = LLMScheduler()
+    keys = scheduler.keys([SecretStr("first"), SecretStr("second")])
+    result = scheduler.run(
+        keys[:1], 10, lambda key: generate_once(key.client, MESSAGES)
+    )
+    assert result.generations[0].text == CANNED_ANSWER
+    chunks = scheduler.stream(
+        keys[1:], 10, lambda key: stream_once(key.client, MESSAGES)
+    )
+    assert "".join(chunk.text for chunk in chunks).strip() == CANNED_ANSWER
+    assert gemini.requests == {"first": 1, "second": 1}
+
+
+def test_only_the_scheduler_retries(gemini):
+    scheduler = LLMScheduler(retries=2)
+    keys = scheduler.keys([SecretStr("key")])
+    scheduler.run(keys, 10, lambda key: generate_once(key.client, MESSAGES))
+    with pytest.raises(google_exceptions.TooManyRequests):
+        scheduler.run(keys, 10, lambda key: generate_once(key.client, MESSAGES))
+    # One request per attempt, the client does not retry on its own
+    assert gemini.requests["key"] == 1 + 3
+    assert gemini.throttled["key"] == 3
+    assert keys[0].requests.rate < settings.LLM_RPM / 60
+
+
+def test_throttled_calls_move_to_a_free_key(gemini):
+    scheduler = LLMScheduler(retries=1)
+    keys = scheduler.keys([SecretStr("busy"), SecretStr("free")])
+    for _ in range(2):
+        scheduler.run(keys, 10, lambda key: generate_once(key.client, MESSAGES))
+    # Both idle keys tie and the first is tried, its 429 blocks it
+    assert gemini.requests == {"busy": 2, "free": 1}
+    assert gemini.throttled == {"busy": 1}
@@ -0,0 +1,77 @@
+from benchmarks.fakes import make_product, make_product_page, make_review_page
+from src.parsing import (
+    Review,
+    build_product_data,
+    extract_asin,
+    is_throttled_page,
+    parse_product_details,
+    parse_review_page,
+    parse_review_records,
+)
+
+
+def test_extract_asin():
+    assert extract_asin("https://www.amazon.com/Some-Case/dp/B0BENCHMRK/ref=sr_1") == (
+        "B0BENCHMRK"
+    )
+    assert extract_asin("https://www.amazon.com/product-reviews/B0BENCHMRK/") is None
+    assert extract_asin("not a url") is None
+
+
+def test_parse_product_details():
+    details = parse_product_details(make_product_page(make_product(0)))
+    assert details == {
+        "product": "Benchmark phone case",
+        "price": "$19.99",
+        "category": "Cell Phones & Accessories",
+        "rating": 3.9,
+    }
+
+
+def test_missing_product_fields_are_left_out():
+    details = parse_product_details(
+        "<html><body><span id='productTitle'> A\n  title </span></body></html>"
+    )
+    assert details == {"product": "A title"}
+    data = build_product_data(details, "https://www.amazon.com/dp/B0BENCHMRK", [])
+    assert data["price"] == ""
+    assert data["rating"] == -1.0
+
+
+def test_parse_review_page():
+    page = make_review_page(["First  review.", "Second review."], has_next=True)
+    assert parse_review_page(page) == (["First review.", "Second review."], True)
+    last = make_review_page(["Only review."], has_next=False)
+    assert parse_review_page(last) == (["Only review."], False)
+
+
+def test_parse_review_records():
+    page = make_review_page(["Broke after a week.", "Works fine."], has_next=False)
+    reviews, has_next = parse_review_records(page)
+    assert not has_next
+    assert reviews[0] == Review(
+        text="Broke after a week.",
+        rating=1.0,
+        date="2024-03-01",
+        helpful_votes=2,
+        verified=True,
+    )
+    assert reviews[1].rating == 2.0
+    assert reviews[1].helpful_votes == 3
+
+
+def test_parse_review_records_without_review_blocks():
+    page = (
+        "<html><body><span class='review-text'>Old layout.</span>"
+        "<span class='review-text'>Still parsed.</span></body></html>"
+    )
+    reviews, has_next = parse_review_records(page)
+    assert [review.text for review in reviews] == ["Old layout.", "Still parsed."]
+    assert reviews[0].rating is None
+    assert not has_next
+
+
+def test_is_throttled_page():
+    assert is_throttled_page("<form action='/errors/validateCaptcha'></form>")
+    assert is_throttled_page("<h1>Sorry! Something went wrong!</h1>")
+    assert not is_throttled_page(make_review_page(["Fine."], has_next=False))
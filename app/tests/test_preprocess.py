@@ -0,0 +1,77 @@
+from src.preprocess import (
+    ReviewDeduplicator,
+    is_boilerplate,
+    normalize,
+    select_reviews,
+    trim,
+)
+
+
+def test_short_reviews_are_kept():
+    assert not is_boilerplate("Terrible!")
+    assert not is_boilerplate("Broke immediately.")
+    assert not is_boilerplate("OK")
+
+
+def test_cjk_reviews_are_kept():
+    assert not is_boilerplate("很好用")
+    assert not is_boilerplate("すぐに壊れました。")
+    reviews, report = select_reviews(["很好用", "质量太差了，用了两天就坏了。"])
+    assert reviews == ["很好用", "质量太差了，用了两天就坏了。"]
+    assert report.empty == 0
+
+
+def test_boilerplate_is_dropped():
+    for text in (
+        "",
+        "!!!",
+        "5",
+        "Read more",
+        "Your browser does not support HTML5 video.",
+        "12 people found this helpful",
+        "Verified Purchase",
+    ):
+        assert is_boilerplate(normalize(text)), text
+
+
+def test_select_reviews_drops_empty_and_duplicates():
+    comments = [
+        "Terrible!",
+        "terrible!",
+        "Read more",
+        "  The battery   lasts two days and charges quickly.  ",
+        "The battery lasts two days and charges quickly!",
+    ]
+    reviews, report = select_reviews(comments)
+    assert reviews == ["Terrible!", "The battery lasts two days and charges quickly."]
+    assert report.total == 5
+    assert report.kept == 2
+    assert report.empty == 1
+    assert report.duplicates == 2
+
+
+def test_select_reviews_stays_within_budget():
+    comments = [
+        f"Review number {ix} talks about feature {ix} at length." for ix in range(50)
+    ]
+    reviews, report = select_reviews(comments, token_budget=100)
+    assert 0 < len(reviews) < 50
+    assert report.tokens_after <= 100
+    # Kept in their original order
+    assert reviews == sorted(reviews, key=comments.index)
+
+
+def test_trim_cuts_at_a_word():
+    assert trim("short", 10) == "short"
+    assert trim("one two three four", 10) == "one two ..."
+
+
+def test_deduplicator_remembers_earlier_pages():
+    deduplicator = ReviewDeduplicator()
+    assert deduplicator.add(["Terrible!", "很好用"]) == ["Terrible!", "很好用"]
+    assert deduplicator.add(["TERRIBLE!", "Works great for the price."]) == [
+        "Works great for the price."
+    ]
+    assert deduplicator.report.total == 4
+    assert deduplicator.report.kept == 3
+    assert deduplicator.report.duplicates == 1
@@ -0,0 +1,88 @@
+import pytest
+
+from src import ratelimit
+from src.config import settings
+from src.ratelimit import AdaptiveTokenBucket, RequestScheduler, TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.wait_time() == pytest.approx(0.5)
+    # wait_time reserves nothing
+    assert bucket.wait_time() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_refill_is_capped(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.acquire(2)
+    clock.sleep(60)
+    assert bucket.acquire(2) == 0.0
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_charge_delays_later_callers():
+    bucket = TokenBucket(rate=10.0, capacity=10)
+    bucket.charge(30)
+    assert bucket.wait_time() == pytest.approx(2.1)
+
+
+def test_adaptive_rate_follows_throttling(clock):
+    bucket = AdaptiveTokenBucket(
+        rate=1.0,
+        capacity=1,
+        max_rate=2.0,
+        min_rate=0.25,
+        increase=0.5,
+        backoff=10.0,
+        max_backoff=30.0,
+    )
+    for _ in range(5):
+        bucket.report(throttled=False)
+    assert bucket.rate == 2.0
+
+    bucket.report(throttled=True)
+    assert bucket.rate == 1.0
+    assert 8.0 <= bucket.wait_time() - 1.0 <= 12.0
+    waited = bucket.acquire()
+    assert 8.0 <= waited <= 13.0
+
+    # Consecutive throttles double the backoff up to its maximum
+    bucket.report(throttled=True)
+    bucket.report(throttled=True)
+    bucket.report(throttled=True)
+    assert bucket.rate == 0.25
+    assert bucket._current_backoff == 30.0
+    bucket.report(throttled=False)
+    assert bucket._current_backoff == 0.0
+    assert bucket.rate == 0.75
+
+
+def test_scheduler_waits_for_host_and_account(monkeypatch):
+    monkeypatch.setattr(settings, "HOST_RATE_LIMIT", 10.0)
+    monkeypatch.setattr(settings, "HOST_RATE_BURST", 5)
+    monkeypatch.setattr(settings, "ACCOUNT_RATE_LIMIT", 1.0)
+    scheduler = RequestScheduler()
+    assert scheduler.acquire("amazon.com", "a@b.c") == 0.0
+    # The account allows one request a second, the host ten
+    assert scheduler.acquire("amazon.com", "a@b.c") == pytest.approx(1.0)
+    assert scheduler.acquire("amazon.com") == 0.0
+    assert set(scheduler.rates()) == {"host:amazon.com", "account:a@b.c"}
+
+    scheduler.report("amazon.com", "a@b.c", throttled=True)
+    assert scheduler.rates() == {"host:amazon.com": 5.0, "account:a@b.c": 0.5}
+
+
+def test_scheduler_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(settings, "HOST_RATE_LIMIT", 0)
+    scheduler = RequestScheduler()
+    assert all(scheduler.acquire("amazon.com", "a@b.c") == 0.0 for _ in range(100))
+    assert scheduler.rates() == {}
@@ -0,0 +1,70 @@
+from src.scoring import (
+    MIXED,
+    NEGATIVE,
+    NEUTRAL,
+    OTHER_ASPECT,
+    POSITIVE,
+    critical_reviews,
+    extract_aspect_terms,
+    group_by_aspect,
+    score_reviews,
+    score_sentiment,
+)
+
+
+def test_score_sentiment_labels():
+    labels, compound = score_sentiment(
+        [
+            "Excellent quality, I love it.",
+            "Terrible, it broke after a day.",
+            "The screen is amazing but the battery is awful.",
+            "Arrived on Tuesday.",
+        ]
+    )
+    assert labels == [POSITIVE, NEGATIVE, MIXED, NEUTRAL]
+    assert compound[0] > 0 > compound[1]
+    assert compound[3] == 0
+
+
+def test_negation_flips_the_valence():
+    labels, _ = score_sentiment(["It does not work and is not good."])
+    assert labels == [NEGATIVE]
+
+
+def test_critical_reviews_keep_unscored_reviews():
+    comments = [
+        "Great value, works perfectly.",
+        "Terrible, stopped charging after a week.",
+        "Se rompió a los dos días.",
+        "质量太差了。",
+        "The strap came off after a week.",
+    ]
+    critical = critical_reviews(comments, score_reviews(comments))
+    assert critical == comments[1:]
+
+
+def test_aspects_and_breakdown():
+    comments = [
+        "The battery died after a week, terrible battery life.",
+        "Battery is weak and the charger is slow.",
+        "Love the screen, bright and clear screen.",
+        "The screen cracked and the battery is bad.",
+        "Charger broke, the charger cable is flimsy.",
+    ]
+    scores = score_reviews(comments)
+    assert "battery" in scores.aspect_terms
+    assert "terrible" not in extract_aspect_terms(comments)
+    breakdown = scores.breakdown()
+    assert next(iter(breakdown)) == "battery"
+    assert breakdown["battery"][NEGATIVE] >= 3
+    assert sum(scores.label_counts.values()) == len(comments)
+
+
+def test_group_by_aspect_puts_other_last():
+    groups = group_by_aspect(
+        ["The battery is weak.", "Arrived late.", "Battery died."], ["battery"]
+    )
+    assert groups == [
+        ("battery", ["The battery is weak.", "Battery died."]),
+        (OTHER_ASPECT, ["Arrived late."]),
+    ]
@@ -0,0 +1,94 @@
+import sqlite3
+
+from benchmarks.fakes import make_product_page, make_review_page
+from src import fetcher, store
+from src.config import settings
+from src.fetcher import AmazonScraper
+from src.sources import FixtureFetcher, save_fixture
+from src.store import ProductStore, StoredProduct, split_new_comments
+
+ASIN = "B0BENCHMRK"
+URL = f"https://www.amazon.com/dp/{ASIN}"
+
+
+def test_stored_product_freshness_and_pages(clock, monkeypatch):
+    monkeypatch.setattr(store, "time", clock)
+    stored = StoredProduct(data={}, fetched_at=clock.time(), pages=3)
+    assert stored.covers(3) and not stored.covers(4)
+    clock.sleep(59)
+    assert stored.is_fresh(60)
+    clock.sleep(1)
+    assert not stored.is_fresh(60)
+
+
+def test_split_new_comments():
+    assert split_new_comments(["c", "b", "a"], {"b", "a"}) == (["c"], True)
+    assert split_new_comments(["c", "b"], {"a"}) == (["c", "b"], False)
+
+
+def test_product_store_round_trip(tmp_path):
+    products = ProductStore(tmp_path / "products.db")
+    assert products.get(ASIN) is None
+    products.put(ASIN, {"comments": ["a"]}, pages=2)
+    stored = ProductStore(tmp_path / "products.db").get(ASIN)
+    assert stored.data == {"comments": ["a"]}
+    assert stored.pages == 2
+
+
+def test_stores_without_pages_cover_none(tmp_path):
+    path = tmp_path / "products.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE products (asin TEXT PRIMARY KEY, data TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO products VALUES (?, '{}', 0)", (ASIN,))
+    stored = ProductStore(path).get(ASIN)
+    assert stored.pages == 0
+    assert not stored.covers(1)
+
+
+class StubDriver:
+    current_url = URL
+
+    def get_cookies(self) -> list:
+        return []
+
+    def quit(self) -> None:
+        pass
+
+
+def _save_pages(fixture_dir, recent: list[str]) -> None:
+    # The default order is by helpfulness, refreshes rely on the date order
+    pages = [recent[ix : ix + 10] for ix in range(0, len(recent), 10)]
+    save_fixture(
+        fixture_dir,
+        ASIN,
+        make_product_page(
+            {"product": "Case", "price": "$1", "category": "C", "rating": 4.0}
+        ),
+        [make_review_page(["Top review."] * 10, has_next=True) for _ in pages],
+        [
+            make_review_page(page, has_next=ix < len(pages) - 1)
+            for ix, page in enumerate(pages)
+        ],
+    )
+
+
+def test_refresh_only_adds_new_reviews(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FETCH_BACKEND", "http")
+    monkeypatch.setattr(settings, "PRODUCT_STORE", True)
+    monkeypatch.setattr(settings, "PRODUCT_STORE_TTL", 0)
+    monkeypatch.setattr(fetcher, "product_store", ProductStore(tmp_path / "p.db"))
+    scraper = AmazonScraper("", "")
+    scraper.driver = StubDriver()
+    scraper.http_fetcher = FixtureFetcher(tmp_path)
+
+    old = [f"Old review {ix}." for ix in range(20)]
+    _save_pages(tmp_path, old)
+    assert scraper.fetch_product_data(URL, 2)["comments"] == old
+
+    _save_pages(tmp_path, ["New review 1.", "New review 0."] + old)
+    data = scraper.fetch_product_data(URL, 2)
+    assert data["comments"] == ["New review 1.", "New review 0."] + old[:18]
+    assert fetcher.product_store.get(ASIN).pages == 2